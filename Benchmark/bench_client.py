@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# 受信処理 ベンチマーク
+#===============================================================================
+# 使い方:
+#   python Benchmark/bench_client.py [--record 記録ディレクトリ] [--json 出力ファイル]
+#                                    [--messages 件数] [--readers 板参照スレッド数] [--dispatch]
+# 接続せずにBybitの受信フレームを模したmessage (または記録したフレーム) を受信処理に渡し,
+# シナリオ毎に以下を計測します.
+#   msgs_per_sec            1秒あたりの処理数
+#   p50_us / p99_us         1messageの処理時間
+#   alloc_peak_bytes        1messageの処理中に確保したメモリの最大 (tracemalloc, 平均)
+#   alloc_retained_bytes    1messageの処理後に残ったメモリ (tracemalloc, 平均)
+# book_readは板の差分を適用し続けながら, 別スレッドから get_orderbooks/get_best_quote を
+# 呼び出した時間を計測します.
+# --jsonを指定すると結果をJSONで出力します (回帰の比較用).
+#===============================================================================
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import threading
+import tracemalloc
+from time import perf_counter, perf_counter_ns
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from bybit_ws_replay import BybitWSReplay
+from message_recorder import MessageReader
+from json_decoder import JsonDecoder
+
+SYMBOL = 'BTCUSD'
+BOOK_TOPIC = 'orderBook_200.100ms.' + SYMBOL
+
+
+#-------------------------------------------------------------------------------
+# Bybitの受信フレームを模したmessage生成
+#-------------------------------------------------------------------------------
+def book_snapshot(rnd:random.Random, mid:float, seq:int):
+    book = []
+    for i in range(200):
+        ask = mid + 0.5 * (i + 1)
+        bid = mid - 0.5 * i
+        book.append({'price': f'{ask:.2f}', 'symbol': SYMBOL, 'id': int(ask * 10000), 'side': 'Sell',
+                     'size': rnd.randint(1, 500000)})
+        book.append({'price': f'{bid:.2f}', 'symbol': SYMBOL, 'id': int(bid * 10000), 'side': 'Buy',
+                     'size': rnd.randint(1, 500000)})
+    return {'topic': BOOK_TOPIC, 'type': 'snapshot', 'data': book, 'cross_seq': seq, 'timestamp_e6': seq}
+
+
+# 板の差分 (既存の価格の更新 + 板の外側への追加/削除を交互に行い, 常に整合した板になる)
+def book_deltas(rnd:random.Random, mid:float, n:int):
+    frames = [book_snapshot(rnd, mid, 1)]
+    for i in range(n):
+        update = []
+        for _ in range(3):
+            k = rnd.randint(0, 199)
+            p, side = (mid + 0.5 * (k + 1), 'Sell') if rnd.random() < 0.5 else (mid - 0.5 * k, 'Buy')
+            update.append({'price': f'{p:.2f}', 'symbol': SYMBOL, 'id': int(p * 10000), 'side': side,
+                           'size': rnd.randint(1, 500000)})
+        outer = {'price': f'{mid + 200.0:.2f}', 'symbol': SYMBOL, 'id': int((mid + 200.0) * 10000), 'side': 'Sell'}
+        insert, delete = [], []
+        if i % 2 == 0:
+            insert.append(dict(outer, size=rnd.randint(1, 500000)))
+        else:
+            delete.append(outer)
+        frames.append({'topic': BOOK_TOPIC, 'type': 'delta', 'cross_seq': i + 2, 'timestamp_e6': i + 2,
+                       'data': {'delete': delete, 'update': update, 'insert': insert}})
+    return frames
+
+
+def trade_bursts(rnd:random.Random, mid:float, n:int, size:int=20):
+    frames = []
+    ts = 1580000000000
+    for i in range(n):
+        trades = []
+        for j in range(size):
+            trades.append({'trade_time_ms': ts, 'timestamp': '2020-01-26T00:53:20.000Z', 'symbol': SYMBOL,
+                           'side': rnd.choice(['Buy', 'Sell']), 'size': rnd.randint(1, 10000),
+                           'price': mid + 0.5 * rnd.randint(-10, 10), 'tick_direction': 'ZeroPlusTick',
+                           'trade_id': f'{i:08d}-{j:04d}', 'cross_seq': i * size + j})
+            ts += 1
+        frames.append({'topic': 'trade.' + SYMBOL, 'data': trades})
+    return frames
+
+
+# 注文/約定/ポジションが連続した場合 (新規 -> 約定 -> ポジション更新)
+def private_storm(rnd:random.Random, mid:float, n:int):
+    frames = []
+    for i in range(n):
+        order_id = f'order-{i:08d}'
+        side = rnd.choice(['Buy', 'Sell'])
+        qty = rnd.randint(1, 1000)
+        order = {'order_id': order_id, 'order_link_id': '', 'symbol': SYMBOL, 'side': side, 'order_type': 'Limit',
+                 'price': f'{mid:.1f}', 'qty': qty, 'time_in_force': 'GoodTillCancel', 'create_type': 'CreateByUser',
+                 'cancel_type': '', 'order_status': 'New', 'leaves_qty': qty, 'cum_exec_qty': 0,
+                 'cum_exec_value': '0', 'cum_exec_fee': '0', 'timestamp': '2020-01-26T00:53:20.000Z'}
+        frames.append({'topic': 'order', 'data': [order]})
+        frames.append({'topic': 'execution', 'data': [
+            {'symbol': SYMBOL, 'side': side, 'order_id': order_id, 'exec_id': f'exec-{i:08d}', 'order_link_id': '',
+             'price': f'{mid:.1f}', 'order_qty': qty, 'exec_type': 'Trade', 'exec_qty': qty,
+             'exec_fee': '0.00000001', 'leaves_qty': 0, 'is_maker': True, 'trade_time': '2020-01-26T00:53:20.000Z'}]})
+        frames.append({'topic': 'order', 'data': [dict(order, order_status='Filled', leaves_qty=0, cum_exec_qty=qty)]})
+        frames.append({'topic': 'position', 'data': [
+            {'symbol': SYMBOL, 'side': side, 'size': i + 1, 'position_value': '1.0', 'entry_price': f'{mid:.1f}',
+             'liq_price': '1.0', 'bust_price': '1.0', 'leverage': '1', 'order_margin': '0', 'position_margin': '1.0',
+             'available_balance': '1.0', 'take_profit': '0', 'stop_loss': '0', 'realised_pnl': '0',
+             'trailing_stop': '0', 'wallet_balance': f'{1.0 + i * 1e-8:.8f}', 'occ_closing_fee': '0',
+             'occ_funding_fee': '0', 'cum_realised_pnl': '0', 'position_status': 'Normal', 'position_seq': i}]})
+    return frames
+
+
+def scenarios(n:int):
+    rnd = random.Random(0)
+    mid = 9000.0
+    seq = iter(range(1, n + 1))
+    return [
+        ('trade_burst', ['trade.' + SYMBOL], trade_bursts(rnd, mid, n)),
+        ('book_snapshot', [BOOK_TOPIC], [book_snapshot(rnd, mid, next(seq)) for _ in range(max(1, n // 10))]),
+        ('book_delta', [BOOK_TOPIC], book_deltas(rnd, mid, n)),
+        ('private_storm', ['order', 'execution', 'position'], private_storm(rnd, mid, max(1, n // 4))),
+    ]
+
+
+# 記録したフレーム (チャンネルは記録に含まれるtopic)
+def recorded(directory:str, n:int):
+    frames = []
+    topics = []
+    for _, frame in MessageReader(directory).read():
+        topic = json.loads(frame).get('topic')
+        if topic is None:
+            continue
+        if topic not in topics:
+            topics.append(topic)
+        frames.append(frame)
+        if len(frames) >= n:
+            break
+    return ('recorded', topics, frames)
+
+
+#-------------------------------------------------------------------------------
+# 計測
+#-------------------------------------------------------------------------------
+def new_client(channel:list, dispatch:bool):
+    callback = {}
+    if dispatch:
+        noop = lambda ws, data: None
+        callback = {t: noop for t in ['trade', 'orderbook', 'ohlcv', 'instrument', 'position', 'execution', 'order']}
+    symbols = [SYMBOL] + sorted({t.rsplit('.', 1)[1] for t in channel if '.' in t} - {SYMBOL})
+    client = BybitWSReplay([], symbol=symbols, channel=channel, callback=callback)
+    client.logger.setLevel(30)
+    if dispatch:
+        client.dispatcher.start()
+    return client
+
+
+def percentile(sorted_values:list, q:float):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def bench_scenario(name:str, channel:list, frames:list, dispatch:bool, alloc_samples:int=2000):
+    frames = [f if isinstance(f, str) else json.dumps(f) for f in frames]
+
+    # スループット
+    client = new_client(channel, dispatch)
+    on_message = client._on_message
+    start = perf_counter()
+    for f in frames:
+        on_message(f)
+    elapsed = perf_counter() - start
+    client.dispatcher.stop()
+
+    # 1messageの処理時間
+    client = new_client(channel, dispatch)
+    on_message = client._on_message
+    latency = []
+    for f in frames:
+        t = perf_counter_ns()
+        on_message(f)
+        latency.append(perf_counter_ns() - t)
+    client.dispatcher.stop()
+    latency.sort()
+
+    # メモリ確保 (先頭のalloc_samples件)
+    client = new_client(channel, dispatch)
+    on_message = client._on_message
+    sample = frames[:alloc_samples]
+    peak_total = 0
+    tracemalloc.start()
+    begin, _ = tracemalloc.get_traced_memory()
+    for f in sample:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        on_message(f)
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.dispatcher.stop()
+
+    return {
+        'scenario': name,
+        'messages': len(frames),
+        'msgs_per_sec': len(frames) / elapsed if elapsed > 0 else 0.0,
+        'p50_us': percentile(latency, 0.50) / 1000,
+        'p99_us': percentile(latency, 0.99) / 1000,
+        'max_us': latency[-1] / 1000 if latency else 0.0,
+        'alloc_peak_bytes': peak_total / len(sample) if sample else 0.0,
+        'alloc_retained_bytes': (end - begin) / len(sample) if sample else 0.0,
+    }
+
+
+# 差分を適用し続けながら別スレッドから板を参照
+def bench_book_read(readers:int, n:int, seconds:float=2.0):
+    rnd = random.Random(1)
+    frames = [json.dumps(f) for f in book_deltas(rnd, 9000.0, n)]
+    client = new_client([BOOK_TOPIC], False)
+    on_message = client._on_message
+    on_message(frames[0])
+
+    stop = threading.Event()
+    results = []
+    def reader(kind:str):
+        get = (lambda: client.get_orderbooks(10)) if kind == 'depth10' else client.get_best_quote
+        latency = []
+        while not stop.is_set():
+            t = perf_counter_ns()
+            get()
+            latency.append(perf_counter_ns() - t)
+        results.append((kind, latency))
+
+    threads = [threading.Thread(target=reader, args=('depth10' if i % 2 == 0 else 'best_quote',))
+               for i in range(readers)]
+    for t in threads:
+        t.start()
+    applied = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        # 差分を最後まで適用したらsnapshotから繰り返す
+        for f in frames:
+            on_message(f)
+        applied += len(frames)
+    elapsed = perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+
+    report = {'scenario': 'book_read', 'readers': readers, 'writer_msgs_per_sec': applied / elapsed}
+    for kind in ('depth10', 'best_quote'):
+        latency = sorted(l for k, lst in results if k == kind for l in lst)
+        report[kind] = {
+            'calls_per_sec': len(latency) / elapsed,
+            'p50_us': percentile(latency, 0.50) / 1000,
+            'p99_us': percentile(latency, 0.99) / 1000,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', help='MessageRecorderの記録ディレクトリ')
+    parser.add_argument('--json', help='結果のJSON出力先 (-は標準出力)')
+    parser.add_argument('--messages', type=int, default=20000, help='シナリオ毎のmessage数')
+    parser.add_argument('--readers', type=int, default=4, help='板を参照するスレッド数')
+    parser.add_argument('--dispatch', action='store_true', help='CallbackDispatcherへの投入も含めて計測')
+    args = parser.parse_args()
+
+    cases = scenarios(args.messages)
+    if args.record:
+        cases.append(recorded(args.record, args.messages))
+
+    results = [bench_scenario(name, channel, frames, args.dispatch) for name, channel, frames in cases]
+    book_read = bench_book_read(args.readers, min(args.messages, 2000))
+
+    print(f"{'scenario':<16} {'messages':>9} {'msgs/s':>10} {'p50[us]':>9} {'p99[us]':>9} {'max[us]':>9} "
+          f"{'alloc peak[B]':>14} {'retained[B]':>12}")
+    for r in results:
+        print(f"{r['scenario']:<16} {r['messages']:>9} {r['msgs_per_sec']:>10.0f} {r['p50_us']:>9.1f} "
+              f"{r['p99_us']:>9.1f} {r['max_us']:>9.1f} {r['alloc_peak_bytes']:>14.0f} {r['alloc_retained_bytes']:>12.1f}")
+    print(f"book_read (readers:{book_read['readers']}, writer {book_read['writer_msgs_per_sec']:.0f} msgs/s)")
+    for kind in ('depth10', 'best_quote'):
+        r = book_read[kind]
+        print(f"  {kind:<12} {r['calls_per_sec']:>10.0f} calls/s  p50 {r['p50_us']:.1f}us  p99 {r['p99_us']:.1f}us")
+
+    if args.json:
+        output = json.dumps({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'decoder': JsonDecoder().name,
+            'dispatch': args.dispatch,
+            'scenarios': results,
+            'book_read': book_read,
+        }, indent=2)
+        if args.json == '-':
+            print(output)
+        else:
+            with open(args.json, 'w') as f:
+                f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# JSONデコーダ ベンチマーク
+#===============================================================================
+# 使い方:
+#   python Benchmark/bench_json_decoder.py [受信フレームファイル(1行1フレーム)]
+# ファイル省略時はBybitの受信フレームを模したmessageで計測します.
+#===============================================================================
+import os
+import sys
+import json
+import random
+from time import perf_counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from json_decoder import JsonDecoder
+
+
+#-------------------------------------------------------------------------------
+# Bybitの受信フレームを模したmessage生成
+#-------------------------------------------------------------------------------
+def sample_frames(symbol:str='BTCUSD'):
+    rnd = random.Random(0)
+    mid = 9000.0
+    ts = 1580000000000
+    frames = []
+
+    # orderBook_200 snapshot
+    book = []
+    for i in range(200):
+        book.append({'price': f'{mid + 0.5 * (i + 1):.2f}', 'symbol': symbol, 'id': int((mid + 0.5 * (i + 1)) * 10000),
+                     'side': 'Sell', 'size': rnd.randint(1, 500000)})
+        book.append({'price': f'{mid - 0.5 * i:.2f}', 'symbol': symbol, 'id': int((mid - 0.5 * i) * 10000),
+                     'side': 'Buy', 'size': rnd.randint(1, 500000)})
+    frames.append(('orderbook snapshot', {'topic': 'orderBook_200.100ms.' + symbol, 'type': 'snapshot', 'data': book,
+                                          'cross_seq': 1, 'timestamp_e6': ts * 1000}))
+
+    # orderBook_200 delta
+    delta = {'delete': [], 'update': [], 'insert': []}
+    for k in ('delete', 'update', 'insert'):
+        for _ in range(3):
+            p = mid + 0.5 * rnd.randint(-50, 50)
+            d = {'price': f'{p:.2f}', 'symbol': symbol, 'id': int(p * 10000), 'side': 'Buy' if p <= mid else 'Sell'}
+            if k != 'delete':
+                d['size'] = rnd.randint(1, 500000)
+            delta[k].append(d)
+    frames.append(('orderbook delta', {'topic': 'orderBook_200.100ms.' + symbol, 'type': 'delta', 'data': delta,
+                                       'cross_seq': 2, 'timestamp_e6': ts * 1000}))
+
+    # trade (約定が連続した場合)
+    trades = []
+    for i in range(20):
+        trades.append({'trade_time_ms': ts + i, 'timestamp': '2020-01-26T00:53:20.000Z', 'symbol': symbol,
+                       'side': rnd.choice(['Buy', 'Sell']), 'size': rnd.randint(1, 10000), 'price': mid,
+                       'tick_direction': 'ZeroPlusTick', 'trade_id': '8241a632-9f07-5fa0-a63d-06cefd570d75',
+                       'cross_seq': 1000 + i})
+    frames.append(('trade burst', {'topic': 'trade.' + symbol, 'data': trades}))
+
+    # instrument_info delta
+    frames.append(('instrument delta', {'topic': 'instrument_info.100ms.' + symbol, 'type': 'delta',
+                                        'data': {'delete': [], 'update': [{'id': 1, 'symbol': symbol,
+                                                 'prev_price_24h_e4': 89925000, 'price_24h_pcnt_e6': -4152,
+                                                 'open_value_e8': 1151474283548, 'total_turnover_e8': 148296937254391,
+                                                 'turnover_24h_e8': 2021290553660, 'volume_24h': 180234780,
+                                                 'cross_seq': 1053192657, 'created_at': '2018-11-14T16:33:26Z',
+                                                 'updated_at': '2020-01-12T18:25:25Z', 'last_price_e4': 89890000}],
+                                                 'insert': []},
+                                        'cross_seq': 1053192658, 'timestamp_e6': ts * 1000}))
+    return [(name, json.dumps(m)) for name, m in frames]
+
+
+#-------------------------------------------------------------------------------
+# 計測
+#-------------------------------------------------------------------------------
+def bench(decoder:JsonDecoder, frame, repeat:int):
+    loads = decoder.decode
+    start = perf_counter()
+    for _ in range(repeat):
+        loads(frame)
+    return (perf_counter() - start) / repeat * 1e6 # us/message
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r', encoding='utf-8') as f:
+            lines = [l.rstrip('\n') for l in f if l.strip()]
+        frames = [(f'recorded[{i}]', l) for i, l in enumerate(lines[:20])]
+    else:
+        frames = sample_frames()
+
+    # 標準jsonを基準に比較
+    decoders = [JsonDecoder(n) for n in ['json', 'simplejson', 'orjson'] if JsonDecoder.available(n)]
+
+    print(f"{'frame':<20} {'bytes':>7} " + ' '.join(f'{d.name + "(str)":>16} {d.name + "(bytes)":>16}' for d in decoders))
+    for name, frame in frames:
+        raw = frame.encode('utf-8')
+        repeat = max(200, int(2000000 / len(raw)))
+        row = f'{name:<20} {len(raw):>7} '
+        base = None
+        for d in decoders:
+            t_str = bench(d, frame, repeat)
+            t_bytes = bench(d, raw, repeat)
+            if base is None:
+                base = t_str
+            row += f'{t_str:>9.2f}us x{base / t_str:<4.1f} {t_bytes:>9.2f}us x{base / t_bytes:<4.1f} '
+        print(row)
+    print('(x: 標準jsonのstr入力に対する速度比)')
+
+
+if __name__ == '__main__':
+    main()
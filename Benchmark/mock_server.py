@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Bybit WebSocket 模擬サーバ
+#===============================================================================
+# 使い方:
+#   python Benchmark/mock_server.py [--port 8765] [--scale 10] [--disconnect 60] [--malformed 0.001]
+#   bybit_ws = BybitWS('API_KEY', 'API_SECRET', endpoint='ws://127.0.0.1:8765')
+#
+# op: auth / subscribe / unsubscribe / ping に本番と同じ形式で応答し, 購読したtopicを
+# 指定した頻度で送信します. (要websockets)
+#   orderBook_200.100ms.*  購読時にsnapshot, 以降は整合した差分 (価格の上下/数量の更新)
+#   trade.*                1〜5件の約定
+#   klineV2.*              生成中の足の更新 (足の境界で次の足)
+#   instrument_info.100ms.* 購読時にsnapshot, 以降は last_price_e4 の更新
+#   order / execution / position  注文 -> 約定 -> 約定済み -> ポジション更新 (要auth)
+# 障害の注入
+#   disconnect   接続毎にこの秒数で切断
+#   malformed    送信するフレームを壊れたJSONに置き換える確率
+#   kick()       接続中の全クライアントを切断, broadcast(message) 任意のフレームを送信
+#===============================================================================
+import hmac
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from time import time, sleep
+
+import websockets
+
+
+#===============================================================================
+# 模擬サーバクラス
+#===============================================================================
+class MockBybitServer(object):
+
+    # topic種類別の送信頻度 [message/sec] (scale倍して使用)
+    RATES = {
+        'orderBook_200': 10.0,
+        'orderBookL2_25': 10.0,
+        'trade': 20.0,
+        'klineV2': 1.0,
+        'instrument_info': 10.0,
+        'private': 1.0,
+    }
+    PRIVATE_TOPICS = ['position', 'execution', 'order']
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     host         待ち受けるアドレス
+    #     port         待ち受けるポート
+    #     rates        topic種類別の送信頻度 (RATESを上書き)
+    #     scale        送信頻度の倍率 (10〜100倍の負荷試験など)
+    #     disconnect   接続毎にこの秒数で切断 (Noneは切断しない)
+    #     malformed    フレームを壊れたJSONに置き換える確率
+    #     api_key      指定するとauthのAPI KEYと署名を検証
+    #     secret       署名の検証に使うAPI SECRET
+    #     seed         乱数のseed
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, host:str='127.0.0.1', port:int=8765, rates:dict={}, scale:float=1.0,
+                 disconnect:float=None, malformed:float=0.0, api_key:str=None, secret:str=None, seed:int=None):
+        self.host = host
+        self.port = port
+        self.rates = dict(self.RATES)
+        self.rates.update(rates)
+        self.scale = scale
+        self.disconnect = disconnect
+        self.malformed = malformed
+        self.api_key = api_key
+        self.secret = secret
+        self.random = random.Random(seed)
+        self.stats = {'connections': 0, 'auth': 0, 'subscribe': 0, 'ping': 0, 'sent': 0, 'malformed': 0,
+                      'disconnect': 0}
+        self.__loop = None
+        self.__server = None
+        self.__thread = None
+        self.__conns = set()
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}'
+
+    #---------------------------------------------------------------------------
+    # 開始/停止 (別スレッドのイベントループで動かす)
+    #---------------------------------------------------------------------------
+    def start(self):
+        ready = threading.Event()
+        def run():
+            self.__loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.__loop)
+            self.__server = self.__loop.run_until_complete(self.__serve())
+            ready.set()
+            self.__loop.run_forever()
+        self.__thread = threading.Thread(target=run)
+        self.__thread.daemon = True
+        self.__thread.start()
+        ready.wait(10.0)
+        return self
+
+    async def __serve(self):
+        return await websockets.serve(self.__handler, self.host, self.port)
+
+    def stop(self):
+        if self.__loop is None:
+            return
+        async def shutdown():
+            self.__server.close()
+            await self.__server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.__loop).result(10.0)
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join(10.0)
+        self.__loop = None
+
+    #---------------------------------------------------------------------------
+    # 接続中の全クライアントを切断 (再接続の試験用)
+    #---------------------------------------------------------------------------
+    def kick(self):
+        for conn in list(self.__conns):
+            asyncio.run_coroutine_threadsafe(conn.close(), self.__loop)
+
+    #---------------------------------------------------------------------------
+    # 接続中の全クライアントに任意のフレームを送信 (不整合な差分の注入など)
+    #---------------------------------------------------------------------------
+    def broadcast(self, message:dict):
+        for conn in list(self.__conns):
+            asyncio.run_coroutine_threadsafe(conn.send(json.dumps(message)), self.__loop).result(10.0)
+
+    #---------------------------------------------------------------------------
+    # 接続毎の処理
+    #---------------------------------------------------------------------------
+    async def __handler(self, ws, path=None):
+        self.stats['connections'] += 1
+        self.__conns.add(ws)
+        conn = _Connection(self, ws)
+        timer = None
+        if self.disconnect:
+            timer = asyncio.ensure_future(self.__disconnect_later(ws))
+        try:
+            async for raw in ws:
+                await conn.on_request(raw)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.__conns.discard(ws)
+            conn.close()
+            if timer is not None:
+                timer.cancel()
+
+    async def __disconnect_later(self, ws):
+        await asyncio.sleep(self.disconnect)
+        self.stats['disconnect'] += 1
+        await ws.close()
+
+    #---------------------------------------------------------------------------
+    # 送信 (malformedの確率で壊れたJSONに置き換える)
+    #---------------------------------------------------------------------------
+    async def send(self, ws, message:dict):
+        frame = json.dumps(message)
+        if self.malformed > 0 and self.random.random() < self.malformed:
+            frame = frame[:self.random.randint(1, len(frame) - 1)]
+            self.stats['malformed'] += 1
+        await ws.send(frame)
+        self.stats['sent'] += 1
+
+    def verify(self, args:list):
+        if self.api_key is None:
+            return True
+        try:
+            api_key, expires, sign = args
+        except (TypeError, ValueError):
+            return False
+        expected = hmac.new(self.secret.encode('utf-8'), f'GET/realtime{expires}'.encode('utf-8'),
+                            hashlib.sha256).hexdigest()
+        return api_key == self.api_key and hmac.compare_digest(sign, expected) and int(expires) > time() * 1000
+
+
+#===============================================================================
+# 接続 (購読中のtopicの送信タスクを管理)
+#===============================================================================
+class _Connection(object):
+
+    def __init__(self, server:MockBybitServer, ws):
+        self.server = server
+        self.ws = ws
+        self.authed = False
+        self.conn_id = f'{server.random.getrandbits(64):016x}'
+        self.tasks = {}   # topic -> 送信タスク
+
+    async def on_request(self, raw):
+        server = self.server
+        try:
+            request = json.loads(raw)
+            op = request['op']
+        except (ValueError, KeyError, TypeError):
+            await self.reply({'op': None}, False, 'error:invalid request')
+            return
+        args = request.get('args')
+        if op == 'ping':
+            server.stats['ping'] += 1
+            await self.reply(request, True, 'pong')
+        elif op == 'auth':
+            server.stats['auth'] += 1
+            self.authed = server.verify(args)
+            await self.reply(request, self.authed, '' if self.authed else 'error:signature verification failed')
+        elif op == 'subscribe':
+            server.stats['subscribe'] += 1
+            topics = args or []
+            if any(t in server.PRIVATE_TOPICS for t in topics) and not self.authed:
+                await self.reply(request, False, 'error:not authed')
+                return
+            await self.reply(request, True, '')
+            for t in topics:
+                self.subscribe(t)
+        elif op == 'unsubscribe':
+            for t in args or []:
+                task = self.tasks.pop(t, None)
+                if task is not None:
+                    task.cancel()
+            await self.reply(request, True, '')
+        else:
+            await self.reply(request, False, f'error:unknown op {op}')
+
+    async def reply(self, request:dict, success:bool, ret_msg:str):
+        await self.ws.send(json.dumps({'success': success, 'ret_msg': ret_msg, 'conn_id': self.conn_id,
+                                       'request': request}))
+
+    def subscribe(self, topic:str):
+        if topic in self.tasks:
+            self.tasks[topic].cancel()
+        name = topic.split('.')[0]
+        if name in self.server.PRIVATE_TOPICS:
+            # 注文/約定/ポジションは1つのタスクでまとめて生成
+            topic = name = 'private'
+            if topic in self.tasks:
+                return
+        source = _SOURCES.get(name)
+        if source is None:
+            return
+        rate = self.server.rates.get(name, 1.0) * self.server.scale
+        self.tasks[topic] = asyncio.ensure_future(self.publish(source(topic, self.server.random), rate))
+
+    #---------------------------------------------------------------------------
+    # 送信タスク (経過時間から送信すべき数を計算して, 遅れた分はまとめて送信)
+    #---------------------------------------------------------------------------
+    async def publish(self, source, rate:float):
+        try:
+            for message in source.initial():
+                await self.server.send(self.ws, message)
+            start = time()
+            sent = 0
+            while True:
+                due = int((time() - start) * rate)
+                for _ in range(due - sent):
+                    for message in source.next():
+                        await self.server.send(self.ws, message)
+                sent = max(sent, due)
+                await asyncio.sleep(max(0.001, (sent + 1) / rate - (time() - start)))
+        except (asyncio.CancelledError, websockets.ConnectionClosed):
+            pass
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks = {}
+
+
+#===============================================================================
+# topic別の送信データ生成
+#===============================================================================
+class _OrderBookSource(object):
+
+    TICK = 0.5
+
+    def __init__(self, topic:str, rnd:random.Random):
+        self.topic = topic
+        self.symbol = topic.rsplit('.', 1)[1]
+        self.random = rnd
+        self.depth = 25 if topic.startswith('orderBookL2_25') else 200
+        self.mid = 9000.0   # 最良買い気配 (最良売り気配は mid + TICK)
+        self.seq = 1
+        self.sizes = {}     # price -> size
+
+    def level(self, price:float, size:int=None):
+        d = {'price': f'{price:.2f}', 'symbol': self.symbol, 'id': int(price * 10000),
+             'side': 'Buy' if price <= self.mid else 'Sell'}
+        if size is not None:
+            d['size'] = size
+        return d
+
+    def initial(self):
+        data = []
+        for i in range(self.depth):
+            for price in (self.mid - self.TICK * i, self.mid + self.TICK * (i + 1)):
+                self.sizes[price] = self.random.randint(1, 500000)
+        for price in sorted(self.sizes):
+            data.append(self.level(price, self.sizes[price]))
+        return [{'topic': self.topic, 'type': 'snapshot', 'data': data, 'cross_seq': self.seq,
+                 'timestamp_e6': int(time() * 1e6)}]
+
+    def next(self):
+        rnd = self.random
+        delete, update, insert = [], [], []
+        move = rnd.random()
+        if move < 0.05:
+            # 価格が1tick上昇: 最良売りが買いに変わり, 板の両端を入れ替え
+            self.__remove(self.mid + self.TICK, delete)
+            self.__remove(self.mid - self.TICK * (self.depth - 1), delete)
+            self.mid += self.TICK
+            self.__add(self.mid, insert)
+            self.__add(self.mid + self.TICK * self.depth, insert)
+        elif move < 0.10:
+            self.__remove(self.mid, delete)
+            self.__remove(self.mid + self.TICK * self.depth, delete)
+            self.mid -= self.TICK
+            self.__add(self.mid + self.TICK, insert)
+            self.__add(self.mid - self.TICK * (self.depth - 1), insert)
+        for _ in range(rnd.randint(1, 5)):
+            price = rnd.choice(list(self.sizes))
+            if any(d['price'] == f'{price:.2f}' for d in insert):
+                continue
+            self.sizes[price] = rnd.randint(1, 500000)
+            update.append(self.level(price, self.sizes[price]))
+        self.seq += 1
+        return [{'topic': self.topic, 'type': 'delta', 'data': {'delete': delete, 'update': update, 'insert': insert},
+                 'cross_seq': self.seq, 'timestamp_e6': int(time() * 1e6)}]
+
+    def __remove(self, price:float, delete:list):
+        self.sizes.pop(price, None)
+        delete.append(self.level(price))
+
+    def __add(self, price:float, insert:list):
+        self.sizes[price] = self.random.randint(1, 500000)
+        insert.append(self.level(price, self.sizes[price]))
+
+
+class _TradeSource(object):
+
+    def __init__(self, topic:str, rnd:random.Random):
+        self.topic = topic
+        self.symbol = topic.rsplit('.', 1)[1]
+        self.random = rnd
+        self.price = 9000.0
+        self.seq = 0
+
+    def initial(self):
+        return []
+
+    def next(self):
+        rnd = self.random
+        self.price += 0.5 * rnd.choice((-1, 0, 0, 1))
+        now = int(time() * 1000)
+        data = []
+        for _ in range(rnd.randint(1, 5)):
+            self.seq += 1
+            data.append({'trade_time_ms': now, 'timestamp': '', 'symbol': self.symbol,
+                         'side': rnd.choice(('Buy', 'Sell')), 'size': rnd.randint(1, 10000), 'price': self.price,
+                         'tick_direction': 'ZeroPlusTick', 'trade_id': f'{self.seq:016x}', 'cross_seq': self.seq})
+        return [{'topic': self.topic, 'data': data}]
+
+
+class _KlineSource(object):
+
+    PERIODS = {'1': 60, '3': 180, '5': 300, '15': 900, '30': 1800, '60': 3600, '120': 7200,
+               '240': 14400, '360': 21600, 'D': 86400}
+
+    def __init__(self, topic:str, rnd:random.Random):
+        self.topic = topic
+        _, period, self.symbol = topic.split('.')
+        self.interval = self.PERIODS.get(period, 60)
+        self.random = rnd
+        self.bar = None
+
+    def initial(self):
+        return []
+
+    def next(self):
+        now = int(time())
+        start = now - now % self.interval
+        if self.bar is None or self.bar['start'] != start:
+            close = self.bar['close'] if self.bar else 9000.0
+            self.bar = {'start': start, 'end': start + self.interval, 'open': close, 'high': close, 'low': close,
+                        'close': close, 'volume': 0, 'turnover': 0.0, 'confirm': False, 'cross_seq': 0}
+        bar = self.bar
+        bar['close'] += 0.5 * self.random.choice((-1, 0, 1))
+        bar['high'] = max(bar['high'], bar['close'])
+        bar['low'] = min(bar['low'], bar['close'])
+        bar['volume'] += self.random.randint(1, 10000)
+        bar['timestamp'] = int(time() * 1e6)
+        return [{'topic': self.topic, 'data': [dict(bar)], 'timestamp_e6': bar['timestamp']}]
+
+
+class _InstrumentSource(object):
+
+    def __init__(self, topic:str, rnd:random.Random):
+        self.topic = topic
+        self.symbol = topic.rsplit('.', 1)[1]
+        self.random = rnd
+        self.price_e4 = 90000000
+        self.seq = 0
+
+    def initial(self):
+        self.seq += 1
+        return [{'topic': self.topic, 'type': 'snapshot', 'cross_seq': self.seq, 'timestamp_e6': int(time() * 1e6),
+                 'data': {'id': 1, 'symbol': self.symbol, 'last_price_e4': self.price_e4, 'last_tick_direction': '',
+                          'prev_price_24h_e4': self.price_e4, 'price_24h_pcnt_e6': 0, 'volume_24h': 0,
+                          'mark_price_e4': self.price_e4, 'index_price_e4': self.price_e4}}]
+
+    def next(self):
+        self.seq += 1
+        self.price_e4 += 5000 * self.random.choice((-1, 0, 1))
+        return [{'topic': self.topic, 'type': 'delta', 'cross_seq': self.seq, 'timestamp_e6': int(time() * 1e6),
+                 'data': {'delete': [], 'insert': [],
+                          'update': [{'id': 1, 'symbol': self.symbol, 'last_price_e4': self.price_e4,
+                                      'mark_price_e4': self.price_e4}]}}]
+
+
+# 注文 -> 約定 -> 約定済み -> ポジション更新
+class _PrivateSource(object):
+
+    SYMBOL = 'BTCUSD'
+
+    def __init__(self, topic:str, rnd:random.Random):
+        self.random = rnd
+        self.count = 0
+        self.position = 0
+
+    def initial(self):
+        return []
+
+    def next(self):
+        rnd = self.random
+        self.count += 1
+        symbol = self.SYMBOL
+        order_id = f'{self.count:08d}-mock-order'
+        side = rnd.choice(('Buy', 'Sell'))
+        qty = rnd.randint(1, 1000)
+        self.position += qty if side == 'Buy' else -qty
+        order = {'order_id': order_id, 'order_link_id': '', 'symbol': symbol, 'side': side, 'order_type': 'Limit',
+                 'price': '9000', 'qty': qty, 'time_in_force': 'GoodTillCancel', 'create_type': 'CreateByUser',
+                 'cancel_type': '', 'order_status': 'New', 'leaves_qty': qty, 'cum_exec_qty': 0,
+                 'cum_exec_value': '0', 'cum_exec_fee': '0', 'timestamp': ''}
+        return [
+            {'topic': 'order', 'data': [order]},
+            {'topic': 'execution', 'data': [{'symbol': symbol, 'side': side, 'order_id': order_id,
+                                             'exec_id': f'{self.count:08d}-mock-exec', 'order_link_id': '',
+                                             'price': '9000', 'order_qty': qty, 'exec_type': 'Trade', 'exec_qty': qty,
+                                             'exec_fee': '0.00000001', 'leaves_qty': 0, 'is_maker': True,
+                                             'trade_time': ''}]},
+            {'topic': 'order', 'data': [dict(order, order_status='Filled', leaves_qty=0, cum_exec_qty=qty)]},
+            {'topic': 'position', 'data': [{'symbol': symbol, 'side': 'Buy' if self.position >= 0 else 'Sell',
+                                            'size': abs(self.position), 'position_value': '0', 'entry_price': '9000',
+                                            'liq_price': '0', 'bust_price': '0', 'leverage': '1',
+                                            'order_margin': '0', 'position_margin': '0', 'available_balance': '1',
+                                            'wallet_balance': '1', 'realised_pnl': '0', 'cum_realised_pnl': '0',
+                                            'position_status': 'Normal', 'position_seq': self.count}]},
+        ]
+
+
+_SOURCES = {
+    'orderBook_200': _OrderBookSource,
+    'orderBookL2_25': _OrderBookSource,
+    'trade': _TradeSource,
+    'klineV2': _KlineSource,
+    'instrument_info': _InstrumentSource,
+    'private': _PrivateSource,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--scale', type=float, default=1.0, help='送信頻度の倍率')
+    parser.add_argument('--disconnect', type=float, help='接続毎にこの秒数で切断')
+    parser.add_argument('--malformed', type=float, default=0.0, help='壊れたJSONを送る確率')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = MockBybitServer(args.host, args.port, scale=args.scale, disconnect=args.disconnect,
+                             malformed=args.malformed, seed=args.seed).start()
+    print(f'Mock server listening on {server.url}')
+    try:
+        while True:
+            sleep(10.0)
+            print(server.stats)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
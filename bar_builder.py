@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from time import time
+from ohlcv_store import new_ohlcv_store
+
+#===============================================================================
+# 約定からのOHLCV生成クラス
+#===============================================================================
+# trade の約定を受け取って複数の足を同時に生成する.
+# 足は [start, open, high, low, close, volume] (startは整数の秒, klineV2のohlcvと同じ形式).
+#
+# timeframe
+#   '1s', '5s', '1m', '5m', '1h', '1d' : 時間足 (境界の時刻を過ぎたらタイマーで確定)
+#   '100t'                             : tick足 (100約定毎に確定)
+#   '1000000v'                         : volume足 (出来高が1000000以上になった約定で確定)
+#
+# 時間足は約定時刻(trade_time_ms)で振り分け, 約定のなかった期間の足は生成しない.
+# 確定済みの足の期間に遅れて届いた約定は, 生成中(または次)の足に含める. (late に件数を記録)
+#===============================================================================
+class BarBuilder(object):
+
+    UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeframes   生成する足のリスト ['1s', '1m', '100t', '1000000v', ...]
+    #     on_bar       足が確定した時に呼び出す関数 on_bar(timeframe, bar)
+    #     maxlen       timeframe毎に保持する確定済みの足の数
+    #     delay        時間足を境界の時刻から何秒遅れて確定するか (約定の遅延分)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, timeframes:list, on_bar=None, maxlen:int=1000, delay:float=0.5):
+        self.on_bar = on_bar
+        self.delay = int(delay * 1000)
+        self.__frames = {}
+        for tf in timeframes:
+            kind, length = self.parse_timeframe(tf)
+            self.__frames[tf] = {
+                'kind': kind,       # 'time', 'tick', 'volume'
+                'length': length,   # timeは期間[ms], tickは約定数, volumeは出来高
+                'bar': None,        # 生成中の足
+                'end': None,        # 時間足の終了時刻[ms]
+                'closed_end': 0,    # 確定済みの時間足の終了時刻[ms]
+                'count': 0,         # tick足の約定数
+                'bars': new_ohlcv_store(maxlen), # 確定済みの足 (OHLCVStore)
+                'late': 0,
+            }
+        self.__lock = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    # timeframe文字列の解析
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeframe    '1m', '100t', '1000000v'など
+    # [return]
+    #     (種類, 長さ)  種類は 'time'(長さはms), 'tick'(約定数), 'volume'(出来高)
+    #---------------------------------------------------------------------------
+    @classmethod
+    def parse_timeframe(cls, timeframe:str):
+        m = re.fullmatch(r'(\d+)([smhdtv])', str(timeframe))
+        if m is None or int(m.group(1)) <= 0:
+            raise ValueError(f'Unknown timeframe: {timeframe}')
+        n, unit = int(m.group(1)), m.group(2)
+        if unit == 't':
+            return ('tick', n)
+        if unit == 'v':
+            return ('volume', n)
+        return ('time', n * cls.UNITS[unit])
+
+    #---------------------------------------------------------------------------
+    # 約定の追加
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timestamp    約定時刻 [ms]
+    #     price        約定価格
+    #     size         約定数量
+    # [return]
+    #---------------------------------------------------------------------------
+    def update(self, timestamp:int, price:float, size:float):
+        timestamp = int(timestamp)
+        closed = []
+        with self.__lock:
+            for tf, f in self.__frames.items():
+                bar = f['bar']
+                kind = f['kind']
+                if kind == 'time':
+                    if bar is not None:
+                        if timestamp >= f['end']:
+                            closed.append((tf, self.__close(f)))
+                            bar = None
+                        elif timestamp < f['end'] - f['length']:
+                            # 確定済みの期間の約定は生成中の足に含める
+                            f['late'] += 1
+                    if bar is None:
+                        length = f['length']
+                        start = timestamp - timestamp % length
+                        if start < f['closed_end']:
+                            # 確定済みの期間の約定は次の足に含める
+                            f['late'] += 1
+                            start = f['closed_end']
+                        f['end'] = start + length
+                        bar = f['bar'] = [start // 1000, price, price, price, price, size]
+                        continue
+                elif bar is None:
+                    # tick/volume足も時間足と同じく開始時刻は整数の秒 (最初の約定の秒)
+                    bar = f['bar'] = [timestamp // 1000, price, price, price, price, 0]
+                    f['count'] = 0
+
+                if price > bar[2]:
+                    bar[2] = price
+                if price < bar[3]:
+                    bar[3] = price
+                bar[4] = price
+                bar[5] += size
+
+                if kind == 'tick':
+                    f['count'] += 1
+                    if f['count'] >= f['length']:
+                        closed.append((tf, self.__close(f)))
+                elif kind == 'volume':
+                    if bar[5] >= f['length']:
+                        closed.append((tf, self.__close(f)))
+        self.__notify(closed)
+
+    #---------------------------------------------------------------------------
+    # 境界の時刻を過ぎた時間足を確定 (タイマーから呼び出す)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     now          現在時刻 [ms] (Noneはtime())
+    # [return]
+    #     確定した足の数
+    #---------------------------------------------------------------------------
+    def close_expired(self, now:int=None):
+        if now is None:
+            now = int(time() * 1000)
+        closed = []
+        with self.__lock:
+            for tf, f in self.__frames.items():
+                if f['kind'] == 'time' and f['bar'] is not None and now >= f['end'] + self.delay:
+                    closed.append((tf, self.__close(f)))
+        self.__notify(closed)
+        return len(closed)
+
+    #---------------------------------------------------------------------------
+    # 次に時間足を確定する時刻 [ms] (生成中の時間足がなければNone)
+    #---------------------------------------------------------------------------
+    def next_close_time(self):
+        with self.__lock:
+            ends = [f['end'] for f in self.__frames.values() if f['kind'] == 'time' and f['bar'] is not None]
+        return min(ends) + self.delay if ends else None
+
+    #---------------------------------------------------------------------------
+    # 生成中の足 (コピー, 生成中の足がなければNone)
+    #---------------------------------------------------------------------------
+    def partial(self, timeframe:str):
+        with self.__lock:
+            bar = self.__frames[timeframe]['bar']
+            return list(bar) if bar is not None else None
+
+    #---------------------------------------------------------------------------
+    # 確定済みの足 (古い順のlist)
+    #---------------------------------------------------------------------------
+    def bars(self, timeframe:str):
+        with self.__lock:
+            return list(self.__frames[timeframe]['bars'])
+
+    #---------------------------------------------------------------------------
+    # 確定済みの足の格納先 (OHLCVStore: to_numpy/to_pandas/add_indicator)
+    #---------------------------------------------------------------------------
+    def get_store(self, timeframe:str):
+        return self.__frames[timeframe]['bars']
+
+    #---------------------------------------------------------------------------
+    # 生成しているtimeframeのリスト
+    #---------------------------------------------------------------------------
+    def timeframes(self):
+        return list(self.__frames.keys())
+
+    #---------------------------------------------------------------------------
+    # 確定済みの期間に遅れて届いた約定数
+    #---------------------------------------------------------------------------
+    def late_count(self, timeframe:str):
+        return self.__frames[timeframe]['late']
+
+    def __close(self, f:dict):
+        bar = f['bar']
+        f['bar'] = None
+        if f['kind'] == 'time':
+            f['closed_end'] = f['end']
+        f['bars'].append(bar)
+        return bar
+
+    def __notify(self, closed:list):
+        if self.on_bar is not None:
+            for tf, bar in closed:
+                self.on_bar(tf, bar)
@@ -1,27 +1,26 @@
 # -*- coding: utf-8 -*-
-import os
-import hmac
-import hashlib
-import json
-import logging
 import websocket
 import threading
-import requests
-import queue
+import random
 import traceback
-import copy
 from time import time, sleep
 from datetime import datetime
 from pytz import timezone
-from collections import deque
-from sortedcontainers import SortedDict
 from pprint import pprint
-from notify import Notify
+from bybit_ws_base import BybitWSBase
+from callback_dispatcher import CallbackDispatcher
 
 #===============================================================================
 # bybit WebSocketクラス
 #===============================================================================
-class BybitWS(object):
+class BybitWS(BybitWSBase):
+
+    # 途切れを検知するtopic(チャンネル名)と無受信の許容秒数
+    STALE_TIMEOUT = {
+        'orderBook_200': 30.0,
+        'orderBookL2_25': 30.0,
+        'instrument_info': 30.0,
+    }
 
     #---------------------------------------------------------------------------
     # コンストラクタ
@@ -30,126 +29,251 @@ class BybitWS(object):
     #     api_key      API KEY
     #     secret       API SECRET
     #     is_testnet   True:testnet, False:real
-    #     symbol       通貨ペア
+    #     symbol       通貨ペア (複数購読する場合はリスト)
     #     channel      購読するチャンネルリスト
     #     callback     チャンネル別のコールバック関数dict
+    #     callback_batch True:溜まった受信データをlistでまとめてコールバック
+    #     callback_executor コールバックの実行方式
+    #                  'single':1スレッドで受信順に実行, 'topic':topic毎のスレッドで実行,
+    #                  'pool':callback_workers個のスレッドで実行 (topic内の順序は保持)
+    #     callback_workers callback_executor='pool'の場合のスレッド数
+    #     callback_policy topic別のキュー上限時の動作
+    #                  {'trade': ('drop_oldest', 10000), 'instrument': 'conflate', 'order': ('block', 100)}
+    #                  (instrument/orderbookは指定しなければ'conflate')
+    #     wait         True:最初のデータを受信するまでコンストラクタで待機
+    #                  False:接続を開始してすぐに戻る (wait_readyで待機できる)
+    #     timeout      wait=Trueの場合に待機する最大秒数 (超えた場合はTimeoutError)
+    #     backoff      再接続の待機秒数 (初回, 最大) 失敗する毎に2倍 (ジッターあり)
+    #     stale_timeout チャンネル名別の無受信の許容秒数 (超えると再接続, Noneは STALE_TIMEOUT)
+    #     resync_orders True:再接続時にREST APIで注文一覧を取得し直す
+    #     **kwargs     tick_size, topic_handler, json_decoder, endpoint, rest_endpoint, raw_records, trade_capacity, bar_timeframes,
+    #                  backfill, backfill_cache, record_dir, record_compression, metrics, metrics_port,
+    #                  latency, lag_threshold, lag_action, clock_sync (BybitWSBase参照)
     # [return]
     #---------------------------------------------------------------------------
-    def __init__(self, api_key:str, secret:str, is_testnet:bool=False, symbol:str='BTCUSD', channel:list=[], callback:dict={}):
-        # logger設定
-        self.logger = Notify.get_custom_logger(self.__class__.__name__)
-        self.logger.setLevel(20) # Level 10:debug 20:info
-        self.logger.info('Initializing WebSocket...')
-
-        self.api_key = api_key
-        self.secret = secret
-        self.symbol = symbol
-        if is_testnet:
-            self.endpoint = 'wss://stream-testnet.bybit.com/realtime'
-        else:
-            self.endpoint = 'wss://stream.bybit.com/realtime'
-        self.period = '1'
-        self.last_ohlcv = []
-
-        # 購読チャンネル設定
-        if len(channel) > 0:
-            self.channel_list = channel
-        else:
-            self.channel_list = [
-                'trade.' + self.symbol,
-                'instrument_info.100ms.' + self.symbol,
-                'orderBook_200.100ms.' + self.symbol, #'orderBookL2_25.' + self.symbol,
-                'klineV2.' + self.period + '.' + self.symbol,
-                'position',
-                'execution',
-                'order',
-            ]
+    def __init__(self, api_key:str, secret:str, is_testnet:bool=False, symbol='BTCUSD', channel:list=[], callback:dict={},
+                 callback_batch:bool=False, callback_executor:str='single', callback_workers:int=4, callback_policy:dict={},
+                 wait:bool=True, timeout:float=60.0, backoff:tuple=(1.0, 60.0), stale_timeout:dict=None,
+                 resync_orders:bool=True, **kwargs):
+        super().__init__(api_key, secret, is_testnet=is_testnet, symbol=symbol, channel=channel, callback=callback, **kwargs)
 
         # コールバック設定
-        self.callback = callback
-        self.callback_queue = queue.Queue()
+        #   instrument/orderbookは未処理分を最新の値で上書き(conflate)するのがdefault
+        policy = {'instrument': 'conflate', 'orderbook': 'conflate'}
+        policy.update(callback_policy)
+        self.dispatcher = CallbackDispatcher(self, self.callback, batch=callback_batch, logger=self.logger,
+                                             executor=callback_executor, workers=callback_workers,
+                                             policy=policy)
+        if self.latency is not None:
+            self.dispatcher.on_latency = self.latency.observe_callback
         if len(self.callback.keys()) > 0:
             # コールバックする場合はhandlerスレッド生成
-            t = threading.Thread(target=self.__callback_event_handler)
-            t.daemon = True
-            t.start()
-
-        # 受信データ格納dict
-        self.data = {
-            'connection':False,
-            'last_price':0,
-            'timestamp':{},
-            'ohlcv':deque(maxlen=1000),
-            'execution':deque(maxlen=200),
-            'instrument':{},
-            'board_snapshot':{
-                    'asks':[],
-                    'bids':[]
-                    },
-            'position':{},
-            'my_execution':deque(maxlen=50),
-            'my_order':deque(maxlen=50),
-            'my_open_order':{},
-        }
-        for i in self.channel_list:
-            self.data['timestamp'][i] = None
-
-        self.board_snapshot_bids_dict = SortedDict()
-        self.board_snapshot_asks_dict = SortedDict()
-        self.__lock = threading.Lock() # 排他制御
-
-        # WebSocket接続
-        self.__connect(self.endpoint)
-
-        # 定期ping/pongスレッド生成
-        self.ping_th = threading.Thread(target=self.__send_ping)
-        self.ping_th.daemon = True
-        self.ping_th.start()
+            self.dispatcher.start()
+
+        # 接続状態の通知
+        self.connected = threading.Event()   # WebSocket接続
+        self.authed = threading.Event()      # auth応答受信
+        self.subscribed = threading.Event()  # subscribe応答受信
+        self.ready = threading.Event()       # 購読した全topicの最初のデータ受信 (privateを除く)
+        self.first_data = {t: threading.Event() for t in self.channel_list}
+
+        # 再接続設定
+        self.backoff = backoff
+        self.ready_timeout = timeout
+        self.resync_orders = resync_orders and 'order' in self.channel_list
+        limits = self.STALE_TIMEOUT if stale_timeout is None else stale_timeout
+        self.__stale_limits = {t: limits[t.split('.')[0]] for t in self.channel_list if t.split('.')[0] in limits}
+        self.reconnect_count = 0
+        self.ws = None
+        self.ws_th = None
+        self.__wakeup = threading.Event()     # 監視スレッドを起こす
+        self.__closing = False
+        self.__reconnect_requested = False
+        self.__requested_ready = False        # 再接続を要求した時点で受信できていたか
+
+        # 時計のずれの推定, 過去足の読み込み (REST API)
+        self._prepare()
+        self._start_metrics_exporter()
+
+        # 足確定タイマースレッド生成 (約定から足を生成する場合のみ)
+        self.__bar_stop = threading.Event()
+        self.bar_th = None
+        if any('bars' in store for store in self.store.values()):
+            self.bar_th = threading.Thread(target=self.__bar_timer)
+            self.bar_th.daemon = True
+            self.bar_th.start()
+
+        # 接続監視スレッド生成 (接続/ping/途切れ検知/再接続を全てこのスレッドで行う)
+        self.supervisor_th = threading.Thread(target=self.__supervise)
+        self.supervisor_th.daemon = True
+        self.supervisor_th.start()
+
+        if wait and not self.wait_ready(timeout):
+            raise TimeoutError(f'First data not received in {timeout} sec.')
+
+    #---------------------------------------------------------------------------
+    # 接続監視スレッド
+    #---------------------------------------------------------------------------
+    def __supervise(self):
+        attempt = 0
+        while not self.__closing:
+            reason = 'connection failed'
+            if self.__open(self.endpoint):
+                reason = self.__monitor()
+                if self.ready.is_set() or (reason == 'requested' and self.__requested_ready):
+                    # 正常に受信できていた場合は待機時間を戻す
+                    attempt = 0
+            self.__teardown()
+            if self.__closing:
+                break
+
+            attempt += 1
+            self.reconnect_count += 1
+            delay = min(self.backoff[1], self.backoff[0] * (2 ** (attempt - 1)))
+            delay = random.uniform(delay / 2, delay)
+            self.logger.warning(f'Reconnect in {delay:.1f} sec. ({reason})')
+            self.__wakeup.wait(delay)
+            self.__wakeup.clear()
+
+        self.logger.info('Supervisor stopped.')
 
     #---------------------------------------------------------------------------
     # WebSocket接続
     #---------------------------------------------------------------------------
-    def __connect(self, endpoint):
-        while not self.data['connection']:
-            self.ws = websocket.WebSocketApp(endpoint,
-                                            on_message=self.__on_message,
-                                            on_close=self.__on_close,
-                                            on_open=self.__on_open,
-                                            on_error=self.__on_error)
+    # [@param]
+    #     endpoint     接続先URL
+    #     timeout      接続を待つ秒数
+    # [return]
+    #     True:接続成功, False:失敗
+    #---------------------------------------------------------------------------
+    def __open(self, endpoint, timeout:float=10.0):
+        self.__wakeup.clear()
+        self.__reconnect_requested = False
+        self.ws = websocket.WebSocketApp(endpoint,
+                                        on_message=self.__on_message,
+                                        on_close=self.__on_close,
+                                        on_open=self.__on_open,
+                                        on_error=self.__on_error)
+
+        self.logger.info('Connecting WebSocket...')
+
+        ws = self.ws
+        # ping_timeoutを指定しないとclose後もselectで待ち続けることがある
+        self.ws_th = threading.Thread(target=lambda: ws.run_forever(ping_timeout=1.0))
+        self.ws_th.daemon = True
+        self.ws_th.start()
+        # 接続できた時点で戻る
+        if not self.connected.wait(timeout):
+            self.logger.warning('WebSocket connection timed out.')
+            return False
+        return True
 
-            self.logger.info('Connecting WebSocket...')
+    #---------------------------------------------------------------------------
+    # 接続中の監視 (再接続が必要になったら理由を返す)
+    #---------------------------------------------------------------------------
+    def __monitor(self):
+        opened = time()
+        last_ping = opened
+        is_resynced = False
+        while True:
+            if self.__wakeup.wait(1.0):
+                self.__wakeup.clear()
+            if self.__closing:
+                return 'closing'
+            if self.__reconnect_requested:
+                return 'requested'
+            if not self.ws_th.is_alive() or not self.connected.is_set():
+                return 'disconnected'
+
+            now = time()
+            # 30~60秒ごとにピンポンした方が良いらしい
+            if now - last_ping >= 30:
+                last_ping = now
+                try:
+                    self.ws.send('{"op":"ping"}')
+                except Exception as e:
+                    return f'send ping failed : {e}'
+
+            if not self.ready.is_set():
+                if now - opened > self.ready_timeout:
+                    return 'first data timed out'
+                continue
 
-            self.ws_th = threading.Thread(target=lambda: self.ws.run_forever())
-            self.ws_th.daemon = True
-            self.ws_th.start()
-            sleep(5)
+            # 注文一覧の再取得 (購読開始後に1回. REST APIは別スレッドで取得し監視を止めない)
+            if self.resync_orders and not is_resynced and self.reconnect_count > 0:
+                is_resynced = True
+                self._resync_open_orders()
 
-        # message受信待機
-        self.__wait_first_data()
+            # 途切れ検知
+            timestamp = self.data['timestamp']
+            for topic, limit in self.__stale_limits.items():
+                ts = timestamp.get(topic)
+                if ts is not None and now - ts > limit:
+                    return f'stale {topic} ({now - ts:.1f} sec)'
 
     #---------------------------------------------------------------------------
-    # 終了処理
+    # 切断処理
     #---------------------------------------------------------------------------
-    def __exit(self):
-        self.ws.close()
-        self.data['connection'] = False
-        for i in self.data['timestamp']:
-            self.data['timestamp'][i] = None
+    def __teardown(self):
+        ws, th = self.ws, self.ws_th
+        # 以降に届いた旧接続のフレームは捨てる (__on_message参照)
+        self.ws = None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                self.logger.warning(traceback.format_exc())
+        if th is not None:
+            th.join(5.0)
+        # 旧接続の受信が止まってから状態と受信データをリセット (再購読時のsnapshotで復元)
+        for e in [self.connected, self.authed, self.subscribed, self.ready] + list(self.first_data.values()):
+            e.clear()
+        self._reset_connection()
 
     #---------------------------------------------------------------------------
-    # message受信待機
+    # 足確定タイマー (約定がなくても境界の時刻で時間足を確定する)
     #---------------------------------------------------------------------------
-    def __wait_first_data(self):
-        self.logger.info('Waiting for first data...')
+    def __bar_timer(self):
+        while not self.__bar_stop.is_set():
+            try:
+                next_time = self._close_bars()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                next_time = None
+            wait = 1.0 if next_time is None else min(1.0, max(0.01, next_time - time()))
+            self.__bar_stop.wait(wait)
 
-        for i in self.data['timestamp']:
-            # 実際に使う際はポジションは取得してからの方がいいです
-            if i in ['position', 'execution', 'order']:
-                continue
-            while not self.data['timestamp'][i]:
-                sleep(0.1)
+    #---------------------------------------------------------------------------
+    # 終了処理
+    #---------------------------------------------------------------------------
+    def close(self):
+        self.__closing = True
+        self.__wakeup.set()
+        self.__bar_stop.set()
+        self.supervisor_th.join(10.0)
+        if self.bar_th is not None:
+            self.bar_th.join(5.0)
+        self.dispatcher.stop(5.0)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics is not None and self.metrics_port is not None:
+            self.metrics.stop_http_server()
 
-        self.logger.info('Received first data.')
+    #---------------------------------------------------------------------------
+    # 最初のデータ受信まで待機
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeout      待機する最大秒数 (Noneは無制限)
+    # [return]
+    #     True:受信済み, False:タイムアウト
+    #---------------------------------------------------------------------------
+    def wait_ready(self, timeout:float=None):
+        self.logger.info('Waiting for first data...')
+        if not self.ready.wait(timeout):
+            waiting = [t for t, e in self.first_data.items() if not e.is_set() and t not in self.PRIVATE_TOPICS]
+            self.logger.warning(f'Waiting first data timed out. subscribed:{self.subscribed.is_set()} waiting:{waiting}')
+            return False
+        return True
 
     #---------------------------------------------------------------------------
     # [WebSocket] on open
@@ -157,219 +281,108 @@ class BybitWS(object):
     def __on_open(self, ws):
         self.logger.info('WebSocket opend.')
 
-        if 'position' in self.channel_list or 'order' in self.channel_list or 'execution' in self.channel_list:
-            # timestamp足してあげないとAuthエラーが出る
-            timestamp = int((time() + 10.0) * 1000)
-            param_str = 'GET/realtime' + str(timestamp)
-            sign = hmac.new(self.secret.encode('utf-8'),
-                            param_str.encode('utf-8'), hashlib.sha256).hexdigest()
-            self.ws.send(json.dumps(
-                        {'op': 'auth', 'args': [self.api_key, timestamp, sign]}))
-
-            self.logger.info('Send auth.')
-
-        self.ws.send(json.dumps(
-                    {'op': 'subscribe', 'args': self.channel_list}))
+        for m in self._open_messages():
+            ws.send(m)
 
         self.logger.info('Send subscribe.' + str(self.channel_list))
+        self.connected.set()
 
     #---------------------------------------------------------------------------
     # [WebSocket] on close
     #---------------------------------------------------------------------------
-    def __on_close(self, ws):
+    def __on_close(self, ws, *args):
         self.logger.info('WebSocket Closed.')
+        if ws is self.ws:
+            self.connected.clear()
+            self.__wakeup.set()
 
     #---------------------------------------------------------------------------
     # [WebSocket] on error
     #---------------------------------------------------------------------------
     def __on_error(self, ws, error):
+        # 再接続は監視スレッドで行う (受信スレッドでは何もしない)
         self.logger.error(f'WebSocket Error : {error}')
-        self.__exit()
-        self.__connect(self.endpoint)
+        if ws is self.ws:
+            self.connected.clear()
+            self.__wakeup.set()
 
     #---------------------------------------------------------------------------
     # [WebSocket] on message
     #---------------------------------------------------------------------------
     def __on_message(self, ws, message):
-        try:
-            message = json.loads(message)
-            topic = message.get('topic')
-            data = message.get('data')
-            ret_msg = message.get('ret_msg')
-            self.data['timestamp'][topic] = time()
-
-            # trade
-            if topic == 'trade.' + self.symbol:
-                for d in data:
-                    self.data['last_price'] = d['price']
-                    self.data['execution'].append(d)
-                    self.callback_queue.put({'topic': 'trade', 'data': d})
-
-            # instrument info
-            elif topic == 'instrument_info.100ms.' + self.symbol:
-                if message['type'] == 'snapshot':
-                    self.data['instrument'] = data
-                else:
-                    if self.data['instrument'] and data['update']:
-                        self.data['instrument'].update(data['update'][0])
-                        if 'last_price_e4' in data['update'][0].keys():
-                            self.callback_queue.put({'topic': 'instrument', 'data': self.data['instrument']})
-
-            # orderbook
-            elif topic == 'orderBook_200.100ms.' + self.symbol: # 'orderBookL2_25.'
-
-                if message['type'] == 'snapshot':
-                    self.board_snapshot_bids_dict.clear()
-                    self.board_snapshot_asks_dict.clear()
-                    for d in data:
-                        if d['side'] == 'Buy':
-                            self.board_snapshot_bids_dict[float(d['price'])] = [float(d['price']), float(d['size'])]
-                        elif d['side'] == 'Sell':
-                            self.board_snapshot_asks_dict[float(d['price'])] = [float(d['price']), float(d['size'])]
-
-                else:
-                    if data['delete']:
-                        for d in data['delete']:
-                            if d['side'] == 'Buy':
-                                del self.board_snapshot_bids_dict[float(d['price'])]
-                            elif d['side'] == 'Sell':
-                                del self.board_snapshot_asks_dict[float(d['price'])]
-
-                    if data['insert']:
-                        for i in data['insert']:
-                            if i['side'] == 'Buy':
-                                self.board_snapshot_bids_dict[float(i['price'])] = [float(i['price']), float(i['size'])]
-                            elif i['side'] == 'Sell':
-                                self.board_snapshot_asks_dict[float(i['price'])] = [float(i['price']), float(i['size'])]
-
-                    if data['update']:
-                        for u in data['update']:
-                            if u['side'] == 'Buy':
-                                self.board_snapshot_bids_dict[float(u['price'])] = [float(u['price']), float(u['size'])]
-                            elif u['side'] == 'Sell':
-                                self.board_snapshot_asks_dict[float(u['price'])] = [float(u['price']), float(u['size'])]
-
-                with self.__lock:
-                    self.data['board_snapshot']['bids'] = [v for v in reversed(self.board_snapshot_bids_dict.values())]
-                    self.data['board_snapshot']['asks'] = [v for v in self.board_snapshot_asks_dict.values()]
-
-            # ohlcv
-            elif topic == 'klineV2.' + self.period + '.' + self.symbol:
-                d = data[0]
-                ohlcv = [int(d['start']), float(d['open']), float(d['high']), float(d['low']), float(d['close']), int(d['volume'])]
-                if len(self.last_ohlcv) > 0 and int(d['start']) > self.last_ohlcv[0]:
-                    self.data['ohlcv'].append(self.last_ohlcv)
-                    self.callback_queue.put({'topic': 'ohlcv', 'data': self.last_ohlcv})
-                self.last_ohlcv = ohlcv
-
-            # position
-            elif topic == 'position':
-                if data[0]['symbol'] == self.symbol:
-                    pre_pos_size = -1
-                    pre_balance = -1.0
-                    if len(self.data['position']) > 0:
-                        pre_pos_size = int(self.data['position']['size'])
-                        pre_balance = float(self.data['position']['wallet_balance'])
-                    self.data['position'] = data[0]
-                    if ((pre_pos_size != int(self.data['position']['size'])) or
-                        (pre_balance != float(self.data['position']['wallet_balance']))):
-                        self.callback_queue.put({'topic': 'position', 'data': data[0]})
-
-            # execution
-            elif topic == 'execution':
-                for d in data:
-                    if d['symbol'] == self.symbol:
-                        self.data['my_execution'].append(d)
-                self.callback_queue.put({'topic': 'execution', 'data': data})
-
-            # order
-            elif topic == 'order':
-                lst_delete_order = []
-                for d in data:
-                    if d['symbol'] == self.symbol:
-                        self.data['my_order'].append(d)
-
-                        is_delete = False
-                        if 'order_status' in d.keys():
-                            if d['order_status'] == 'Canceled' or d['order_status'] == 'Filled':
-                                is_delete = True
-                        if 'leaves_qty' in d.keys():
-                            if d['leaves_qty'] <= 0:
-                                is_delete = True
-                        if is_delete:
-                            if d['order_id'] in self.data['my_open_order'].keys():
-                                self.data['my_open_order'].pop(d['order_id'])
-                            lst_delete_order.append(d)
-                        else:
-                            self.data['my_open_order'][d['order_id']] = d
-
-                self.callback_queue.put({'topic': 'order',
-                                         'data': {
-                                             'open': [o for o in self.data['my_open_order'].values()],
-                                             'close': lst_delete_order,
-                                         }})
-
-            elif 'success' in message.keys():
-                if message['success'] == True:
-                    if ret_msg == 'pong':
-                        pass
-                    elif len(message['request']['args']) == len(self.channel_list):
-                        self.data['connection'] = True
-                else:
-                    raise Exception(f'Connection failed: {message}')
-
-            else:
-                raise Exception(f'Unknown message: {message}')
-
-        except Exception:
-            self.logger.error(traceback.format_exc())
-
-    #---------------------------------------------------------------------------
-    # 定期ping送信
-    #---------------------------------------------------------------------------
-    def __send_ping(self):
-        # 30~60秒ごとにピンポンした方が良いらしい
-        while True:
-            self.ws.send('{"op":"ping"}')
-            sleep(30)
+        if ws is not self.ws:
+            return
+        self._on_message(message)
 
     #---------------------------------------------------------------------------
-    # WebSocket再接続
+    # コールバック対象のデータをdispatcherに投入
     #---------------------------------------------------------------------------
-    def reconnect(self):
-        self.logger.info('Try reconnecting...')
-        self.__exit()
-        self.__connect(self.endpoint)
+    def _emit(self, topic:str, symbol:str, data):
+        self.dispatcher.put(topic, symbol, data, self._received)
 
     #---------------------------------------------------------------------------
-    # orderbook取得
+    # message送信 (orderbookの再購読など)
     #---------------------------------------------------------------------------
-    def get_orderbooks(self):
-        with self.__lock:
-            bids = copy.copy(self.data['board_snapshot']['bids'])
-            asks = copy.copy(self.data['board_snapshot']['asks'])
-        return {'bids':bids, 'asks':asks}
+    def _send(self, message:str):
+        ws = self.ws
+        if ws is None:
+            return
+        try:
+            ws.send(message)
+        except Exception as e:
+            # 送れない場合は切断として監視スレッドで再接続される
+            self.logger.warning(f'Send failed : {e}')
 
     #---------------------------------------------------------------------------
-    # WebSocketの受信messageからコールバックを呼び出すhandler
+    # 接続状態の通知
     #---------------------------------------------------------------------------
-    def __callback_event_handler(self):
-        try:
-            while True:
-                if self.callback_queue.empty():
-                    sleep(0.01)
-                    continue
+    def _on_authed(self):
+        self.logger.info('Authenticated.')
+        self.authed.set()
 
-                data = self.callback_queue.get()
-                if data is not None:
-                    topic = data['topic']
-                    if topic in self.callback.keys() and self.callback[topic] != None:
-                        self.callback[topic](self, data['data'])
+    def _on_subscribed(self):
+        self.subscribed.set()
+        self.__check_ready()
 
-                self.callback_queue.task_done()
+    def _on_first_data(self, topic:str):
+        self.first_data[topic].set()
+        self.__check_ready()
 
-        except Exception:
-            self.logger.error(traceback.format_exc())
+    def __check_ready(self):
+        if not self.ready.is_set() and self.is_ready():
+            self.logger.info('Received first data.')
+            self.ready.set()
+
+    #---------------------------------------------------------------------------
+    # WebSocket再接続
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeout      再接続して最初のデータを受信するまで待機する最大秒数
+    # [return]
+    #     True:受信済み, False:タイムアウト
+    #---------------------------------------------------------------------------
+    def reconnect(self, timeout:float=None):
+        self._request_reconnect()
+        return self.wait_ready(timeout)
+
+    # 監視スレッドに再接続を要求 (待機しない)
+    def _request_reconnect(self):
+        self.logger.info('Try reconnecting...')
+        # 正常に受信できていた接続なら再接続の待機時間を延ばさない
+        self.__requested_ready = self.ready.is_set()
+        self.ready.clear()
+        self.__reconnect_requested = True
+        self.__wakeup.set()
+
+    #---------------------------------------------------------------------------
+    # コールバック統計取得
+    #---------------------------------------------------------------------------
+    # [return]
+    #     キューの未処理イベント数, キュー投入からコールバックまでの遅延など
+    #     (CallbackDispatcher.get_stats参照)
+    #---------------------------------------------------------------------------
+    def get_callback_stats(self):
+        return self.dispatcher.get_stats()
 
 
 if __name__ == '__main__':
@@ -393,6 +406,7 @@ if __name__ == '__main__':
     callback = {
         'trade': None,
         'instrument': None,
+        'orderbook': None,
         'ohlcv': None,
         'position': None,
         'execution': None,
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import inspect
+import random
+import traceback
+import websockets
+from collections import deque
+from time import time, perf_counter
+from bybit_ws_base import BybitWSBase
+from callback_dispatcher import CallbackDispatcher
+
+#===============================================================================
+# bybit WebSocketクラス (asyncio版)
+#===============================================================================
+# BybitWSと同じデータ構造(data/store)とコールバックtopicを持ち,
+# 接続/受信/コールバックを全てイベントループ上で処理する.
+#
+#   ws = AsyncBybitWS('API_KEY', 'API_SECRET', symbol='BTCUSD')
+#   await ws.start()                      # 最初のデータ受信まで待機
+#   async for trade in ws.stream('trade'):
+#       ...
+#   await ws.close()
+#===============================================================================
+class AsyncBybitWS(BybitWSBase):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     api_key      API KEY
+    #     secret       API SECRET
+    #     is_testnet   True:testnet, False:real
+    #     symbol       通貨ペア (複数購読する場合はリスト)
+    #     channel      購読するチャンネルリスト
+    #     callback     チャンネル別のコールバック関数dict (関数/コルーチン関数)
+    #                  topic毎のタスクで実行 (遅いコールバックが他のtopicを止めない)
+    #     callback_policy topic別の未処理データの上限に達した場合の動作
+    #                  {'trade': ('drop_oldest', 10000), 'instrument': 'conflate', 'order': ('block', 100)}
+    #                  (instrument/orderbookは指定しなければ'conflate', 'block'は空くまで受信を止める)
+    #     backoff      再接続の待機秒数 (初回, 最大) 失敗する毎に2倍 (ジッターあり)
+    #     **kwargs     tick_size, topic_handler, json_decoder, endpoint, rest_endpoint, raw_records, trade_capacity, bar_timeframes,
+    #                  backfill, backfill_cache, record_dir, record_compression, metrics, metrics_port,
+    #                  latency, lag_threshold, lag_action, clock_sync (BybitWSBase参照)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, api_key:str, secret:str, is_testnet:bool=False, symbol='BTCUSD', channel:list=[], callback:dict={},
+                 callback_policy:dict={}, backoff:tuple=(1.0, 60.0), **kwargs):
+        super().__init__(api_key, secret, is_testnet=is_testnet, symbol=symbol, channel=channel, callback=callback, **kwargs)
+        self.backoff = backoff
+        self.reconnect_count = 0
+        self.ws = None
+        self.__streams = {}          # topic -> [TopicStream, ...]
+
+        # コールバック設定 (BybitWSと同じくinstrument/orderbookはconflateがdefault)
+        policy = {'instrument': 'conflate', 'orderbook': 'conflate'}
+        policy.update(callback_policy)
+        self.__policy = {}
+        for topic, p in policy.items():
+            name, maxsize = (p, 0) if isinstance(p, str) else (p[0], p[1])
+            if name not in CallbackDispatcher.POLICIES:
+                raise ValueError(f'Unknown policy: {name}')
+            self.__policy[topic] = (name, maxsize)
+        self.__callback_tasks = None # topic -> _CallbackTask (コールバックする場合のみ)
+        self.__callback_topics = {key.split('.')[0] for key in self.callback}  # コールバックのあるtopic
+        self.__blocked = []          # 上限に達した'block'のtopic
+        self.__ready = None
+        self.__tasks = []
+        self.__closed = False
+        self.__prepared = False
+
+    #---------------------------------------------------------------------------
+    # 接続開始
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     wait         True:最初のデータを受信するまで待機
+    #     timeout      待機する最大秒数 (Noneは無制限)
+    # [return]
+    #---------------------------------------------------------------------------
+    async def start(self, wait:bool=True, timeout:float=None):
+        self.__ready = asyncio.Event()
+        self.__closed = False
+        if not self.__prepared:
+            # 時計のずれの推定, 過去足の読み込み (REST API) はイベントループを止めないようにexecutorで行う
+            await asyncio.get_event_loop().run_in_executor(None, self._prepare)
+            self.__prepared = True
+        self._start_metrics_exporter()
+        self.__tasks = [asyncio.ensure_future(self.__run())]
+        if any('bars' in store for store in self.store.values()):
+            self.__tasks.append(asyncio.ensure_future(self.__bar_timer()))
+        if len(self.callback.keys()) > 0:
+            # コールバックする場合のみtopic別のタスクを生成 (初めて受信した時)
+            self.__callback_tasks = {}
+        self.__blocked = []
+        if wait:
+            await self.wait_ready(timeout)
+
+    #---------------------------------------------------------------------------
+    # 最初のデータ受信まで待機
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeout      待機する最大秒数 (Noneは無制限)
+    # [return]
+    #---------------------------------------------------------------------------
+    async def wait_ready(self, timeout:float=None):
+        await asyncio.wait_for(self.__ready.wait(), timeout)
+
+    #---------------------------------------------------------------------------
+    # 終了処理
+    #---------------------------------------------------------------------------
+    async def close(self):
+        self.__closed = True
+        if self.ws is not None:
+            await self.ws.close()
+        tasks = self.__tasks + [c.task for c in (self.__callback_tasks or {}).values()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__tasks = []
+        self.__callback_tasks = None
+        for streams in self.__streams.values():
+            for s in streams:
+                s.close()
+        if self.recorder is not None:
+            # 記録待ちのフレームの書き込みはイベントループの外で待つ
+            await asyncio.get_event_loop().run_in_executor(None, self.recorder.close)
+        if self.metrics is not None and self.metrics_port is not None:
+            self.metrics.stop_http_server()
+
+    #---------------------------------------------------------------------------
+    # topic別の受信データstream
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     topic        'trade', 'instrument', 'orderbook', 'ohlcv', 'position', 'execution', 'order'
+    #     symbol       通貨ペア (Noneは全通貨ペア)
+    #     maxsize      未読データの上限 (超えた場合は古いものから捨てる, 0は無制限)
+    # [return]
+    #     async for で受信データを取り出せるTopicStream
+    #---------------------------------------------------------------------------
+    def stream(self, topic:str, symbol:str=None, maxsize:int=10000):
+        s = TopicStream(self, topic, symbol, maxsize)
+        self.__streams.setdefault(topic, []).append(s)
+        if topic == 'orderbook':
+            self._orderbook_event = True
+        return s
+
+    def _remove_stream(self, s):
+        streams = self.__streams.get(s.topic, [])
+        if s in streams:
+            streams.remove(s)
+
+    #---------------------------------------------------------------------------
+    # 受信〜再接続ループ
+    #---------------------------------------------------------------------------
+    async def __run(self):
+        attempt = 0
+        while not self.__closed:
+            try:
+                self.logger.info('Connecting WebSocket...')
+                async with websockets.connect(self.endpoint, ping_interval=None) as ws:
+                    self.ws = ws
+                    self.logger.info('WebSocket opend.')
+                    for m in self._open_messages():
+                        await ws.send(m)
+                    self.logger.info('Send subscribe.' + str(self.channel_list))
+
+                    ping = asyncio.ensure_future(self.__send_ping(ws))
+                    try:
+                        async for message in ws:
+                            self._on_message(message)
+                            if self.__blocked:
+                                # 'block'のtopicが空くまで次の受信を待たせる
+                                await self.__wait_blocked()
+                    finally:
+                        ping.cancel()
+                self.logger.info('WebSocket Closed.')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f'WebSocket Error : {e}')
+
+            if self.__ready.is_set():
+                # 正常に受信できていた場合は待機時間を戻す
+                attempt = 0
+            self.ws = None
+            self._reset_connection()
+            self.__ready.clear()
+            if not self.__closed:
+                attempt += 1
+                self.reconnect_count += 1
+                delay = min(self.backoff[1], self.backoff[0] * (2 ** (attempt - 1)))
+                delay = random.uniform(delay / 2, delay)
+                self.logger.info(f'Try reconnecting in {delay:.1f} sec...')
+                await asyncio.sleep(delay)
+
+    #---------------------------------------------------------------------------
+    # 定期ping送信
+    #---------------------------------------------------------------------------
+    async def __send_ping(self, ws):
+        # 30~60秒ごとにピンポンした方が良いらしい
+        try:
+            while True:
+                await ws.send('{"op":"ping"}')
+                await asyncio.sleep(30)
+        except websockets.exceptions.ConnectionClosed:
+            # 切断は受信ループで検知する
+            pass
+
+    #---------------------------------------------------------------------------
+    # 足確定タイマー (約定がなくても境界の時刻で時間足を確定する)
+    #---------------------------------------------------------------------------
+    async def __bar_timer(self):
+        while True:
+            try:
+                next_time = self._close_bars()
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                next_time = None
+            wait = 1.0 if next_time is None else min(1.0, max(0.01, next_time - time()))
+            await asyncio.sleep(wait)
+
+    #---------------------------------------------------------------------------
+    # 受信データをstream/コールバックに振り分け
+    #---------------------------------------------------------------------------
+    def _emit(self, topic:str, symbol:str, data):
+        streams = self.__streams.get(topic)
+        if streams:
+            for s in streams:
+                if s.symbol is None or s.symbol == symbol:
+                    s._put(data)
+        # コールバックのないtopic/通貨ペアはタスクを作らず積まない
+        if self.__callback_tasks is not None and topic in self.__callback_topics and \
+           (topic in self.callback or topic + '.' + symbol in self.callback):
+            c = self.__callback_tasks.get(topic)
+            if c is None:
+                policy, maxsize = self.__policy.get(topic, ('block', 0))
+                c = self.__callback_tasks[topic] = _CallbackTask(topic, policy, maxsize, self.__dispatch)
+            if c.put(symbol, data, self._received):
+                self.__blocked.append(c)
+
+    def _send(self, message:str):
+        if self.ws is not None:
+            asyncio.ensure_future(self.ws.send(message))
+
+    # イベントループを止めないようにexecutorで実行し, doneはイベントループ上で呼ぶ
+    def _run_background(self, func, done):
+        future = asyncio.get_event_loop().run_in_executor(None, func)
+        def on_done(f):
+            if f.cancelled():
+                return
+            error = f.exception()
+            done(None if error is not None else f.result(), error)
+        future.add_done_callback(on_done)
+
+    # 接続を閉じて受信ループに再接続させる
+    def _request_reconnect(self):
+        if self.ws is not None:
+            self.logger.info('Try reconnecting...')
+            asyncio.ensure_future(self.ws.close())
+
+    def _on_subscribed(self):
+        self.__check_ready()
+
+    def _on_first_data(self, topic:str):
+        self.__check_ready()
+
+    def __check_ready(self):
+        if self.__ready is not None and not self.__ready.is_set() and self.is_ready():
+            self.logger.info('Received first data.')
+            self.__ready.set()
+
+    #---------------------------------------------------------------------------
+    # 'block'のtopicの未処理データが上限を下回るまで待機
+    #---------------------------------------------------------------------------
+    async def __wait_blocked(self):
+        while self.__blocked:
+            await self.__blocked.pop().wait_space()
+
+    #---------------------------------------------------------------------------
+    # コールバック呼び出し (topic別のタスクから呼ばれる)
+    #---------------------------------------------------------------------------
+    async def __dispatch(self, topic:str, symbol:str, data, received:float):
+        if received is not None and self.latency is not None:
+            self.latency.observe_callback(topic, perf_counter() - received)
+        func = self.callback.get(topic + '.' + symbol)
+        if func is None:
+            func = self.callback.get(topic)
+        if func is None:
+            return
+        try:
+            ret = func(self, data)
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+    #---------------------------------------------------------------------------
+    # コールバックの統計取得
+    #---------------------------------------------------------------------------
+    # [return]
+    #     未処理データ数, 受信からコールバックまでの遅延など (BybitWS.get_callback_statsと同じ形式)
+    #---------------------------------------------------------------------------
+    def get_callback_stats(self):
+        tasks = list((self.__callback_tasks or {}).values())
+        topics = {c.topic: c.get_stats() for c in tasks}
+        n = sum(t['dispatched'] for t in topics.values())
+        delay_sum = sum(c.stats['delay_sum'] for c in tasks)
+        last = max([c.stats for c in tasks], key=lambda st: st['last_time'], default=None)
+        return {
+            'queue_size': sum(t['queue_size'] for t in topics.values()),
+            'dispatched': n,
+            'dropped': sum(t['dropped'] for t in topics.values()),
+            'conflated': sum(t['conflated'] for t in topics.values()),
+            'delay_last': last['delay_last'] if last else 0.0,
+            'delay_avg': delay_sum / n if n > 0 else 0.0,
+            'delay_max': max([t['delay_max'] for t in topics.values()], default=0.0),
+            'max_drain': max([c.max_drain for c in tasks], default=0),
+            'topics': topics,
+        }
+
+
+#===============================================================================
+# topic別のコールバックタスク (AsyncBybitWS内部用)
+#===============================================================================
+# CallbackDispatcherの_Workerと同じpolicyで未処理データを管理し, 溜まっている分をまとめて取り出して
+# 受信順にコールバックする. 'block'は投入側で待てないため, 上限に達したことを返して受信ループを待たせる.
+#===============================================================================
+class _CallbackTask(object):
+
+    def __init__(self, topic:str, policy:str, maxsize:int, dispatch):
+        self.topic = topic
+        self.policy = policy
+        self.maxsize = maxsize
+        self.max_drain = 0
+        self.stats = {'queued': 0, 'dispatched': 0, 'dropped': 0, 'conflated': 0,
+                      'delay_last': 0.0, 'delay_sum': 0.0, 'delay_max': 0.0, 'last_time': 0.0}
+        self.__dispatch = dispatch
+        self.__events = deque()  # 受信順のイベント [enqueued, symbol, data, alive, received]
+        self.__pending = {}      # symbol -> 未処理イベントのdeque
+        self.__wakeup = asyncio.Event()
+        self.__space = asyncio.Event()
+        self.__space.set()
+        self.task = asyncio.ensure_future(self.__run())
+
+    #---------------------------------------------------------------------------
+    # イベント投入 (policyに従って上限を処理)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     True:'block'で上限に達した (空くまで受信を待たせる)
+    #---------------------------------------------------------------------------
+    def put(self, symbol:str, data, received:float=None):
+        stats = self.stats
+        pending = self.__pending.get(symbol)
+        if pending is None:
+            pending = self.__pending[symbol] = deque()
+
+        if self.policy == 'conflate' and len(pending) > 0:
+            # 未処理のイベントを最新の値で上書き (受信順の位置はそのまま)
+            pending[-1][2] = data
+            pending[-1][4] = received
+            stats['conflated'] += 1
+            return False
+
+        if self.maxsize > 0 and len(pending) >= self.maxsize and self.policy == 'drop_oldest':
+            pending.popleft()[3] = False
+            stats['dropped'] += 1
+
+        event = [perf_counter(), symbol, data, True, received]
+        pending.append(event)
+        self.__events.append(event)
+        stats['queued'] += 1
+        self.__wakeup.set()
+        if self.policy == 'block' and self.maxsize > 0 and len(pending) >= self.maxsize:
+            self.__space.clear()
+            return True
+        return False
+
+    async def wait_space(self):
+        await self.__space.wait()
+
+    def get_stats(self):
+        st = self.stats
+        n = st['dispatched']
+        return {
+            'queue_size': st['queued'] - n - st['dropped'],
+            'dispatched': n,
+            'dropped': st['dropped'],
+            'conflated': st['conflated'],
+            'delay_last': st['delay_last'],
+            'delay_avg': st['delay_sum'] / n if n > 0 else 0.0,
+            'delay_max': st['delay_max'],
+        }
+
+    async def __run(self):
+        stats = self.stats
+        while True:
+            await self.__wakeup.wait()
+            self.__wakeup.clear()
+
+            # 溜まっている分をまとめて取り出す
+            events = []
+            for e in self.__events:
+                if e[3]:
+                    self.__pending[e[1]].popleft()
+                    events.append(e)
+            self.__events.clear()
+            # 待機している受信ループを再開させる
+            self.__space.set()
+
+            if len(events) > self.max_drain:
+                self.max_drain = len(events)
+            for enqueued, symbol, data, _, received in events:
+                now = perf_counter()
+                delay = now - enqueued
+                stats['delay_last'] = delay
+                stats['delay_sum'] += delay
+                if delay > stats['delay_max']:
+                    stats['delay_max'] = delay
+                stats['dispatched'] += 1
+                stats['last_time'] = now
+                await self.__dispatch(self.topic, symbol, data, received)
+
+
+#===============================================================================
+# topic別の受信データstream
+#===============================================================================
+class TopicStream(object):
+
+    def __init__(self, client:AsyncBybitWS, topic:str, symbol:str, maxsize:int):
+        self.client = client
+        self.topic = topic
+        self.symbol = symbol
+        self.dropped = 0  # 上限超過で捨てたデータ数
+        self.__queue = asyncio.Queue(maxsize)
+        self.__closed = False
+
+    def _put(self, data):
+        if self.__queue.full():
+            self.__queue.get_nowait()
+            self.dropped += 1
+        self.__queue.put_nowait(data)
+
+    #---------------------------------------------------------------------------
+    # 購読終了
+    #---------------------------------------------------------------------------
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.client._remove_stream(self)
+            # 待機中のasync forを終了させる
+            self._put(StopAsyncIteration)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.__closed and self.__queue.empty():
+            raise StopAsyncIteration
+        data = await self.__queue.get()
+        if data is StopAsyncIteration:
+            raise StopAsyncIteration
+        return data
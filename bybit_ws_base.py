@@ -0,0 +1,971 @@
+# -*- coding: utf-8 -*-
+import hmac
+import hashlib
+import json
+import threading
+import traceback
+import requests
+from time import time, perf_counter
+from collections import deque
+from notify import Notify
+from orderbook import OrderBook, TickOrderBook, OrderBookError
+from json_decoder import JsonDecoder
+from records import Trade, Execution, Order, Position
+from trade_buffer import TradeBuffer
+from bar_builder import BarBuilder
+from ohlcv_store import new_ohlcv_store
+from kline_backfill import KlineBackfill
+from message_recorder import MessageRecorder
+from metrics import Metrics
+from latency_tracker import LatencyTracker
+
+#===============================================================================
+# bybit WebSocket 共通クラス
+#===============================================================================
+# 受信データの格納, topic別のmessage処理, orderbook取得など接続方式に依らない部分.
+# 接続とコールバックの呼び出しは派生クラス (BybitWS, AsyncBybitWS) で実装する.
+#===============================================================================
+class BybitWSBase(object):
+
+    # 認証が必要なチャンネル
+    PRIVATE_TOPICS = ['position', 'execution', 'order']
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     api_key      API KEY
+    #     secret       API SECRET
+    #     is_testnet   True:testnet, False:real
+    #     symbol       通貨ペア (複数購読する場合はリスト)
+    #     channel      購読するチャンネルリスト
+    #     callback     チャンネル別のコールバック関数dict
+    #     tick_size    指定するとorderbookを固定tickのNumPy配列で管理 (Noneは通常のOrderBook)
+    #                  通貨ペア毎に異なる場合は {symbol: tick_size} のdict
+    #     topic_handler 追加するチャンネル別のmessage処理関数dict
+    #                  key: チャンネル名 ('liquidation'など), value: handler(ws, store, message)
+    #     json_decoder 受信messageのJSONデコーダ 'orjson', 'simplejson', 'json' (Noneは自動選択)
+    #     endpoint     接続先URL (Noneはis_testnetに従う)
+    #     rest_endpoint REST APIのURL (Noneはis_testnetに従う)
+    #     raw_records  True:trade/execution/order/positionを受信したdictのまま格納/コールバック
+    #                  False:数値変換済みのrecord (Trade, Execution, Order, Position)
+    #     trade_capacity 指定すると約定履歴をこの件数まで TradeBuffer (store['trades']) に保持 (要numpy)
+    #     bar_timeframes 指定すると約定から足を生成する BarBuilder (store['bars']) のtimeframeリスト
+    #                  ['1s', '1m', '5m', '1h', '100t', '1000000v'] 確定した足は 'bar' にコールバック
+    #     backfill     指定すると接続前にREST APIで klineV2 の確定済みの足をこの本数まで ohlcv に読み込む
+    #     backfill_cache 過去足のキャッシュの保存先ディレクトリ (Noneは保存しない)
+    #     record_dir   指定すると受信したフレームをこのディレクトリに圧縮して記録 (MessageRecorder)
+    #     record_compression 記録の圧縮形式 'gzip', 'zstd' (zstdは要zstandard)
+    #     metrics      True(またはMetricsインスタンス)で受信処理の計測値を記録 (get_metricsで取得)
+    #     metrics_port 指定するとこのポートで計測値をHTTP公開 (/metrics: Prometheus形式, /metrics.json)
+    #     latency      True(またはLatencyTrackerインスタンス)で 取引所の時刻->受信, 受信->コールバック の遅延を記録
+    #                  (get_latency_statsで取得. lag_threshold/metricsを指定した場合は自動で有効)
+    #     lag_threshold 取引所の時刻からの遅延の許容秒数 (超えた状態が続くとlag_actionを実行)
+    #     lag_action   'alert':警告ログのみ, 'reconnect':警告ログ + 再接続
+    #     clock_sync   True:接続前にREST APIのサーバ時刻で時計のずれを推定
+    #                  (False:直近の最小の遅延を0とみなした相対的な遅延)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, api_key:str, secret:str, is_testnet:bool=False, symbol='BTCUSD', channel:list=[], callback:dict={},
+                 tick_size=None, topic_handler:dict={}, json_decoder:str=None, endpoint:str=None, rest_endpoint:str=None,
+                 raw_records:bool=False, trade_capacity:int=0, bar_timeframes:list=None,
+                 backfill:int=0, backfill_cache:str=None, record_dir:str=None, record_compression:str='gzip',
+                 metrics=None, metrics_port:int=None, latency=None, lag_threshold:float=None,
+                 lag_action:str='alert', clock_sync:bool=False):
+        # logger設定
+        self.logger = Notify.get_custom_logger(self.__class__.__name__)
+        self.logger.setLevel(20) # Level 10:debug 20:info
+        self.logger.info('Initializing WebSocket...')
+
+        self.api_key = api_key
+        self.secret = secret
+        # 受信時刻の取得関数 (再生時は記録した受信時刻に差し替える)
+        self._clock = time
+        # 受信フレームの記録
+        self.recorder = None
+        if record_dir is not None:
+            self.recorder = MessageRecorder(record_dir, compression=record_compression)
+            self.logger.info(f'Recording messages to {record_dir}')
+        self.decoder = JsonDecoder(json_decoder)
+        self.__decode = self.decoder.decode
+        self.logger.info(f'JSON decoder: {self.decoder.name}')
+        # 計測 (無効の場合は計測用の処理を経由しない)
+        self.metrics = None
+        self.metrics_port = metrics_port
+        if metrics:
+            self.metrics = metrics if isinstance(metrics, Metrics) else Metrics()
+            self.__decode = self.__timed_decoder(self.__decode)
+            self.metrics.add_collector(self.__collect_metrics)
+            # HTTP公開はサブクラスの初期化が終わってから開始する (_start_metrics_exporter)
+        # 遅延計測 (無効の場合は計測用の処理を経由しない)
+        if lag_action not in ('alert', 'reconnect'):
+            raise ValueError(f'Unknown lag_action: {lag_action}')
+        self.latency = None
+        self.lag_action = lag_action
+        self._received = None   # handler処理中のフレームの受信時刻 (perf_counter, 遅延計測時のみ)
+        self.__received = (None, None)   # 最後に受信したフレームの (perf_counter, 受信時刻)
+        if latency or lag_threshold is not None or self.metrics is not None:
+            self.latency = latency if isinstance(latency, LatencyTracker) else LatencyTracker()
+            if lag_threshold is not None:
+                self.latency.threshold = lag_threshold
+                self.latency.on_lag = self.__on_lag
+            self.__decode = self.__tracked_decoder(self.__decode)
+            if self.metrics is not None:
+                # 遅延のhistogramはmetricsに登録したものを使う (exchange_lag_seconds, callback_latency_seconds)
+                if self.latency.metrics is None:
+                    self.latency.metrics = self.metrics
+                self.metrics.add_collector(self.__collect_latency)
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
+        if endpoint is not None:
+            self.endpoint = endpoint
+        elif is_testnet:
+            self.endpoint = 'wss://stream-testnet.bybit.com/realtime'
+        else:
+            self.endpoint = 'wss://stream.bybit.com/realtime'
+        if rest_endpoint is not None:
+            self.rest_endpoint = rest_endpoint
+        elif is_testnet:
+            self.rest_endpoint = 'https://api-testnet.bybit.com'
+        else:
+            self.rest_endpoint = 'https://api.bybit.com'
+        self.__clock_sync = clock_sync   # 時計のずれの推定は_prepareで行う
+        self.period = '1'
+        self.raw_records = raw_records
+        # 受信dict -> 格納/コールバックするデータ
+        if raw_records:
+            self.__trade = self.__execution = self.__order = self.__position = lambda d: d
+        else:
+            self.__trade = Trade.from_dict
+            self.__execution = Execution.from_dict
+            self.__order = Order.from_dict
+            self.__position = Position.from_dict
+        self.last_ohlcv = {s: [] for s in self.symbols}
+
+        # 購読チャンネル設定
+        if len(channel) > 0:
+            self.channel_list = channel
+        else:
+            self.channel_list = []
+            for s in self.symbols:
+                self.channel_list += [
+                    'trade.' + s,
+                    'instrument_info.100ms.' + s,
+                    'orderBook_200.100ms.' + s, #'orderBookL2_25.' + s,
+                    'klineV2.' + self.period + '.' + s,
+                ]
+            self.channel_list += [
+                'position',
+                'execution',
+                'order',
+            ]
+
+        # コールバック設定
+        #   key は topic ('trade') または topic.symbol ('trade.ETHUSD')
+        self.callback = callback
+        # orderbookは通知先がある場合のみ通知データを生成
+        self._orderbook_event = any(k.split('.')[0] == 'orderbook' and v is not None for k, v in self.callback.items())
+
+        # 通貨ペア別の受信データ格納dict
+        self.store = {}
+        for s in self.symbols:
+            ts = tick_size.get(s) if isinstance(tick_size, dict) else tick_size
+            self.store[s] = {
+                'symbol':s,
+                'last_price':0,
+                'ohlcv':new_ohlcv_store(1000),
+                'execution':deque(maxlen=200),
+                'instrument':{},
+                'board_snapshot':OrderBook() if ts is None else TickOrderBook(ts),
+                'position':{},
+                'my_execution':deque(maxlen=50),
+                'my_order':deque(maxlen=50),
+                'my_open_order':{},
+            }
+            if trade_capacity > 0:
+                self.store[s]['trades'] = TradeBuffer(trade_capacity)
+            if bar_timeframes:
+                self.store[s]['bars'] = BarBuilder(bar_timeframes, on_bar=self.__bar_emitter(s))
+
+        # 受信データ格納dict (先頭の通貨ペアのデータ + 接続状態)
+        self.data = self.store[self.symbol]
+        self.data['connection'] = False
+        self.data['timestamp'] = {}
+        for i in self.channel_list:
+            self.data['timestamp'][i] = None
+
+        # チャンネル名 -> handler
+        self.__handlers = {
+            'trade':self.__on_trade,
+            'instrument_info':self.__on_instrument,
+            'orderBook_200':self.__on_orderbook,
+            'orderBookL2_25':self.__on_orderbook,
+            'klineV2':self.__on_kline,
+            'position':self.__on_position,
+            'execution':self.__on_execution,
+            'order':self.__on_order,
+        }
+        for name, handler in topic_handler.items():
+            self.__handlers[name] = self.__wrap_topic_handler(name, handler)
+
+        # topic -> (handler, 通貨ペア別データ) の振り分けテーブル
+        self.__topic_table = self.__build_topic_table(self.channel_list)
+
+        self.__lock = threading.Lock() # 排他制御
+        self.__order_seen = None       # 注文一覧の再取得中にWebSocketで受信した注文ID
+
+        # orderbookの整合性検証
+        #   不整合を検知したtopicは板を空にして再購読し, 次のsnapshotまでdeltaを捨てる
+        #   (呼値の整数倍でない価格はtick_sizeの誤りのため再購読しない)
+        self.__book_resyncing = set()
+        self.__book_stats = {s: {'snapshot': 0, 'delta': 0, 'out_of_order': 0, 'missing_level': 0,
+                                 'crossed': 0, 'off_grid': 0, 'resubscribe': 0, 'skipped': 0} for s in self.symbols}
+
+        # 過去足の読み込み
+        self.backfill = None
+        self.__kline_lock = threading.Lock()   # 確定した足の追加 (抜けの取得スレッドと排他)
+        self.__gap_pending = {}                # (通貨ペア, 時間足) -> 抜けの取得中に確定した足
+        self.__backfill_count = backfill
+        if backfill > 0:
+            # 読み込みは_prepareで行う
+            self.backfill = KlineBackfill(self.rest_endpoint, cache_dir=backfill_cache)
+
+    #---------------------------------------------------------------------------
+    # 接続前のREST API処理 (時計のずれの推定, 過去足の読み込み)
+    #---------------------------------------------------------------------------
+    # ブロッキングするため, サブクラスが接続前に呼ぶ. (asyncio版はexecutorで呼ぶ)
+    #---------------------------------------------------------------------------
+    def _prepare(self):
+        if self.latency is not None and self.__clock_sync:
+            try:
+                offset = self.latency.sync_clock(self.rest_endpoint)
+                self.logger.info(f'Clock offset: {offset * 1000:.1f} ms')
+            except Exception as e:
+                self.logger.warning(f'Clock sync failed : {e}')
+        if self.backfill is not None:
+            self.__load_backfill(self.__backfill_count)
+
+    #---------------------------------------------------------------------------
+    # 過去足の読み込み (REST API + キャッシュ)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     count        読み込む本数 (ohlcvの保持数まで)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __load_backfill(self, count:int):
+        for topic in self.channel_list:
+            if topic.split('.')[0] != 'klineV2':
+                continue
+            _, interval, symbol = topic.split('.')
+            ohlcv = self.store[symbol]['ohlcv']
+            try:
+                bars = self.backfill.load(symbol, interval, min(count, ohlcv.maxlen))
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                continue
+            for bar in bars:
+                ohlcv.append(bar)
+            self.logger.info(f'Backfilled ohlcv. {symbol}:{len(bars)}')
+
+    #---------------------------------------------------------------------------
+    # topic振り分けテーブル生成
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     channel_list 購読するチャンネルリスト
+    # [return]
+    #     {topic: (handler, 通貨ペア別データ or None)}
+    #---------------------------------------------------------------------------
+    def __build_topic_table(self, channel_list:list):
+        handlers = self.__handlers
+        table = {}
+        for topic in channel_list:
+            name = topic.split('.')[0]
+            if name not in handlers:
+                self.logger.warning(f'No handler for channel: {topic}')
+                continue
+            store = None
+            if '.' in topic:
+                symbol = topic.rsplit('.', 1)[1]
+                if symbol not in self.store:
+                    raise Exception(f'Unknown symbol in channel: {topic}')
+                store = self.store[symbol]
+            handler = handlers[name]
+            if self.metrics is not None:
+                handler = self.__timed_handler(topic, name, handler)
+            if self.latency is not None:
+                handler = self.__tracked_handler(topic, name, handler)
+            table[topic] = (handler, store)
+        return table
+
+    #---------------------------------------------------------------------------
+    # 計測付きのデコード/handler
+    #---------------------------------------------------------------------------
+    # decode: topic別の受信数/受信byte数, デコード時間
+    def __timed_decoder(self, decode):
+        decode_time = self.metrics.histogram('decode_seconds')
+        counters = {}   # topic -> (受信数, 受信byte数)
+        def timed_decode(frame):
+            t = perf_counter()
+            message = decode(frame)
+            decode_time.observe(perf_counter() - t)
+            topic = message.get('topic') if isinstance(message, dict) else None
+            c = counters.get(topic)
+            if c is None:
+                label = topic or 'response'
+                c = counters[topic] = (self.metrics.counter('messages_total', topic=label),
+                                       self.metrics.counter('bytes_total', topic=label))
+            c[0].value += 1
+            c[1].value += len(frame)
+            return message
+        return timed_decode
+
+    # handler: topic別の処理時間
+    #          (取引所の時刻からの遅延はLatencyTrackerがmetricsのhistogramに記録する)
+    def __timed_handler(self, topic:str, name:str, handler):
+        handler_time = self.metrics.histogram('handler_seconds', topic=topic)
+        def on_topic(store:dict, message:dict):
+            t = perf_counter()
+            handler(store, message)
+            handler_time.observe(perf_counter() - t)
+        return on_topic
+
+    # 取り出す時に集める計測値 (板の更新数, 再接続回数, コールバックのキュー)
+    def __collect_metrics(self):
+        values = []
+        for symbol, st in self.__book_stats.items():
+            for key in ('snapshot', 'delta', 'skipped'):
+                values.append(('book_updates_total', 'counter', {'symbol': symbol, 'type': key}, st[key]))
+            for key in ('out_of_order', 'missing_level', 'crossed', 'off_grid', 'resubscribe'):
+                values.append(('book_errors_total', 'counter', {'symbol': symbol, 'type': key}, st[key]))
+        values.append(('reconnects_total', 'counter', {}, getattr(self, 'reconnect_count', 0)))
+        values.append(('connected', 'gauge', {}, 1 if self.data['connection'] else 0))
+        get_stats = getattr(self, 'get_callback_stats', None)
+        if get_stats is not None:
+            for topic, st in get_stats().get('topics', {}).items():
+                labels = {'topic': topic}
+                values.append(('callback_queue_size', 'gauge', labels, st['queue_size']))
+                values.append(('callback_dispatched_total', 'counter', labels, st['dispatched']))
+                values.append(('callback_dropped_total', 'counter', labels, st['dropped']))
+                values.append(('callback_delay_avg_seconds', 'gauge', labels, st['delay_avg']))
+                values.append(('callback_delay_max_seconds', 'gauge', labels, st['delay_max']))
+        if self.recorder is not None:
+            values.append(('recorder_dropped_total', 'counter', {}, self.recorder.dropped))
+        return values
+
+    #---------------------------------------------------------------------------
+    # 遅延計測付きのデコード/handler
+    #---------------------------------------------------------------------------
+    # decode: フレームの受信時刻 (デコード前)
+    def __tracked_decoder(self, decode):
+        def tracked_decode(frame):
+            self.__received = (perf_counter(), self._clock())
+            return decode(frame)
+        return tracked_decode
+
+    # handler: 取引所の時刻(timestamp_e6/trade_time_ms)から受信までの遅延
+    #          処理中にコールバック対象になったデータには受信時刻を付けて渡す (_received)
+    def __tracked_handler(self, topic:str, name:str, handler):
+        tracker = self.latency
+        is_private = name in self.PRIVATE_TOPICS
+        def on_topic(store:dict, message:dict):
+            received, recv_time = self.__received
+            self._received = received
+            try:
+                handler(store, message)
+            finally:
+                self._received = None
+            if is_private:
+                # 自分の注文/約定/ポジションは取引所の時刻を持たない
+                return
+            ts = message.get('timestamp_e6')
+            if ts is not None:
+                tracker.observe_exchange(topic, recv_time, int(ts) / 1e6)
+            elif name == 'trade' and message.get('data'):
+                tracker.observe_exchange(topic, recv_time, int(message['data'][-1]['trade_time_ms']) / 1000)
+        return on_topic
+
+    # 遅延がlag_thresholdを超えた状態が続いた
+    def __on_lag(self, topic:str, lag:float):
+        self.logger.warning(f'Feed lag {lag:.3f} sec on {topic} (threshold {self.latency.threshold} sec)')
+        if self.lag_action == 'reconnect' and self.data['connection']:
+            self._request_reconnect()
+
+    def __collect_latency(self):
+        st = self.latency
+        return [('clock_offset_seconds', 'gauge', {}, st.clock_offset),
+                ('lag_events_total', 'counter', {}, st.lag_events)]
+
+    #---------------------------------------------------------------------------
+    # 計測値のHTTP公開開始 (metrics_port指定時のみ)
+    #---------------------------------------------------------------------------
+    # 公開中は別スレッドから計測値を収集するため, サブクラスの初期化(dispatcherなど)が終わってから呼ぶ.
+    #---------------------------------------------------------------------------
+    def _start_metrics_exporter(self):
+        if self.metrics is not None and self.metrics_port is not None:
+            self.metrics.start_http_server(self.metrics_port)
+            self.logger.info(f'Metrics exporter: http://127.0.0.1:{self.metrics_port}/metrics')
+
+    #---------------------------------------------------------------------------
+    # 遅延統計の取得 (latency/lag_thresholdを指定しない場合はNone)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     LatencyTracker.stats参照
+    #---------------------------------------------------------------------------
+    def get_latency_stats(self):
+        if self.latency is None:
+            return None
+        return self.latency.stats()
+
+    #---------------------------------------------------------------------------
+    # 計測値の取得 (metricsを指定しない場合はNone)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     Metrics.snapshot参照
+    #---------------------------------------------------------------------------
+    def get_metrics(self):
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot()
+
+    #---------------------------------------------------------------------------
+    # チャンネル別のmessage処理関数を追加
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     name         チャンネル名 ('liquidation', 'orderBookL2_25'など)
+    #     handler      message処理関数 handler(ws, store, message)
+    #                  storeは通貨ペア別データ (通貨ペアのないチャンネルはNone)
+    #                  戻り値がNoneでなければ callback[name] にコールバック
+    # [return]
+    #---------------------------------------------------------------------------
+    def add_topic_handler(self, name:str, handler):
+        self.__handlers[name] = self.__wrap_topic_handler(name, handler)
+        # テーブルは作り直して参照ごと差し替える
+        self.__topic_table = self.__build_topic_table(self.channel_list)
+
+    def __wrap_topic_handler(self, name:str, handler):
+        def on_topic(store:dict, message:dict):
+            ret = handler(self, store, message)
+            if ret is not None:
+                symbol = store['symbol'] if store is not None else ''
+                self._emit(name, symbol, ret)
+        return on_topic
+
+    #---------------------------------------------------------------------------
+    # 受信message処理
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     message      受信したフレーム (str/bytes)
+    # [return]
+    #---------------------------------------------------------------------------
+    def _on_message(self, message):
+        if self.recorder is not None:
+            self.recorder.record(message)
+        try:
+            message = self.__decode(message)
+            topic = message.get('topic')
+
+            entry = self.__topic_table.get(topic)
+            if entry is not None:
+                timestamp = self.data['timestamp']
+                is_first = timestamp[topic] is None
+                timestamp[topic] = self._clock()
+                handler, store = entry
+                handler(store, message)
+                if is_first:
+                    self._on_first_data(topic)
+
+            elif topic is None and 'success' in message:
+                if message['success'] == True:
+                    op = message.get('request', {}).get('op')
+                    if message.get('ret_msg') == 'pong' or op == 'ping':
+                        pass
+                    elif op == 'auth':
+                        self._on_authed()
+                    elif op == 'subscribe':
+                        self.data['connection'] = True
+                        self._on_subscribed()
+                else:
+                    raise Exception(f'Connection failed: {message}')
+
+            else:
+                raise Exception(f'Unknown message: {message}')
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
+    #---------------------------------------------------------------------------
+    # 受信データ処理の通知 (派生クラスで実装)
+    #---------------------------------------------------------------------------
+    # コールバック対象のデータ
+    def _emit(self, topic:str, symbol:str, data):
+        pass
+
+    # 認証完了
+    def _on_authed(self):
+        pass
+
+    # 購読完了
+    def _on_subscribed(self):
+        pass
+
+    # topic別の最初のデータ受信
+    def _on_first_data(self, topic:str):
+        pass
+
+    # messageの送信 (接続中でなければ何もしない)
+    def _send(self, message:str):
+        pass
+
+    # 再接続の要求 (受信処理中から呼ばれるので待機しない)
+    def _request_reconnect(self):
+        pass
+
+    # 受信処理を止めない処理の実行 (func()の完了後に done(結果, 例外) を呼ぶ)
+    def _run_background(self, func, done):
+        def run():
+            try:
+                result = func()
+            except Exception as e:
+                done(None, e)
+                return
+            done(result, None)
+        th = threading.Thread(target=run)
+        th.daemon = True
+        th.start()
+
+    #---------------------------------------------------------------------------
+    # 接続完了 (購読完了 & public topicの最初のデータを受信済み)
+    #---------------------------------------------------------------------------
+    def is_ready(self):
+        if not self.data['connection']:
+            return False
+        for topic, ts in self.data['timestamp'].items():
+            # 実際に使う際はポジションは取得してからの方がいいです
+            if topic in self.PRIVATE_TOPICS:
+                continue
+            if not ts:
+                return False
+        return True
+
+    #---------------------------------------------------------------------------
+    # 接続状態のリセット
+    #---------------------------------------------------------------------------
+    def _reset_connection(self):
+        self.data['connection'] = False
+        # 切断前の生成中の足は確定させない (抜けとして再接続後にREST APIで取得)
+        for s in self.last_ohlcv:
+            self.last_ohlcv[s] = []
+        for i in self.data['timestamp']:
+            self.data['timestamp'][i] = None
+        # 切断中の差分を取りこぼした板は使えないため空にする (再購読時のsnapshotで復元)
+        with self.__lock:
+            for store in self.store.values():
+                store['board_snapshot'].apply_snapshot([])
+            self.__book_resyncing.clear()
+        if self.latency is not None:
+            self.latency.reset()
+
+    #---------------------------------------------------------------------------
+    # 注文一覧の再取得 (REST API)
+    #---------------------------------------------------------------------------
+    # 切断中に変化した注文を反映するため, 有効な注文一覧で my_open_order を置き換える.
+    # 取得中にWebSocketで受信した注文はWebSocketの内容を優先する.
+    # 取得は_run_backgroundで行い, 呼び出し元(監視/受信)を待たせない. (取得中の場合は何もしない)
+    #---------------------------------------------------------------------------
+    def _resync_open_orders(self):
+        with self.__lock:
+            if self.__order_seen is not None:
+                return
+            self.__order_seen = set()
+        symbols = list(self.symbols)
+        def fetch():
+            result = {}
+            for symbol in symbols:
+                try:
+                    result[symbol] = self.__fetch_open_orders(symbol)
+                except Exception:
+                    self.logger.error(traceback.format_exc())
+            return result
+        self._run_background(fetch, self.__on_open_orders)
+
+    def __fetch_open_orders(self, symbol:str):
+        params = {'api_key': self.api_key, 'symbol': symbol, 'timestamp': int(time() * 1000)}
+        query = '&'.join(f'{k}={params[k]}' for k in sorted(params))
+        params['sign'] = hmac.new(self.secret.encode('utf-8'), query.encode('utf-8'), hashlib.sha256).hexdigest()
+        res = requests.get(self.rest_endpoint + '/v2/private/order', params=params, timeout=10).json()
+        if res.get('ret_code') != 0:
+            raise Exception(f'Resync orders failed: {res}')
+        return [self.__order(o) for o in res.get('result') or []]
+
+    # 取得した注文一覧の反映 (_run_backgroundのdone)
+    def __on_open_orders(self, result:dict, error:Exception):
+        events = []
+        with self.__lock:
+            seen = self.__order_seen
+            self.__order_seen = None
+            if error is not None:
+                self.logger.error(f'Resync orders failed: {error}')
+                return
+            for symbol, orders in result.items():
+                store = self.store[symbol]
+                open_order = {o['order_id']: o for o in orders if o['order_id'] not in seen}
+                for order_id, o in store['my_open_order'].items():
+                    if order_id in seen:
+                        open_order[order_id] = o
+                closed = [o for order_id, o in store['my_open_order'].items() if order_id not in open_order]
+                store['my_open_order'] = open_order
+                events.append((symbol, open_order, closed))
+
+        for symbol, open_order, closed in events:
+            self.logger.info(f'Resynced open orders. {symbol}:{len(open_order)}')
+            self._emit('order', symbol, {'open': list(open_order.values()), 'close': closed})
+
+    #---------------------------------------------------------------------------
+    # 接続時に送信するmessage (auth/subscribe)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     送信するJSON文字列のリスト
+    #---------------------------------------------------------------------------
+    def _open_messages(self):
+        messages = []
+        if any(c in self.channel_list for c in self.PRIVATE_TOPICS):
+            # timestamp足してあげないとAuthエラーが出る
+            timestamp = int((time() + 10.0) * 1000)
+            param_str = 'GET/realtime' + str(timestamp)
+            sign = hmac.new(self.secret.encode('utf-8'),
+                            param_str.encode('utf-8'), hashlib.sha256).hexdigest()
+            messages.append(json.dumps({'op': 'auth', 'args': [self.api_key, timestamp, sign]}))
+        messages.append(json.dumps({'op': 'subscribe', 'args': self.channel_list}))
+        return messages
+
+    #---------------------------------------------------------------------------
+    # [topic] trade
+    #---------------------------------------------------------------------------
+    def __on_trade(self, store:dict, message:dict):
+        to_record = self.__trade
+        trades = store.get('trades')
+        bars = store.get('bars')
+        for d in message['data']:
+            d = to_record(d)
+            store['last_price'] = d['price']
+            store['execution'].append(d)
+            if trades is not None:
+                trades.append(d['trade_time_ms'], d['price'], d['size'], d['side'])
+            if bars is not None:
+                bars.update(d['trade_time_ms'], float(d['price']), d['size'])
+            self._emit('trade', store['symbol'], d)
+
+    #---------------------------------------------------------------------------
+    # 約定から生成した足
+    #---------------------------------------------------------------------------
+    def __bar_emitter(self, symbol:str):
+        def on_bar(timeframe:str, bar:list):
+            self._emit('bar', symbol, {'symbol': symbol, 'timeframe': timeframe, 'bar': bar})
+        return on_bar
+
+    #---------------------------------------------------------------------------
+    # 境界の時刻を過ぎた時間足を確定 (派生クラスのタイマーから呼び出す)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     次に確定する時刻 [sec] (生成中の時間足がなければNone)
+    #---------------------------------------------------------------------------
+    def _close_bars(self):
+        now = int(self._clock() * 1000)
+        next_time = None
+        for store in self.store.values():
+            bars = store.get('bars')
+            if bars is None:
+                continue
+            bars.close_expired(now)
+            t = bars.next_close_time()
+            if t is not None and (next_time is None or t < next_time):
+                next_time = t
+        return next_time / 1000 if next_time is not None else None
+
+    #---------------------------------------------------------------------------
+    # [topic] instrument info
+    #---------------------------------------------------------------------------
+    def __on_instrument(self, store:dict, message:dict):
+        data = message['data']
+        if message['type'] == 'snapshot':
+            store['instrument'] = data
+        else:
+            if store['instrument'] and data['update']:
+                store['instrument'].update(data['update'][0])
+                if 'last_price_e4' in data['update'][0].keys():
+                    # 受信スレッドで更新され続けるdictを渡さないようにコピーして渡す
+                    self._emit('instrument', store['symbol'], dict(store['instrument']))
+
+    #---------------------------------------------------------------------------
+    # [topic] orderbook
+    #---------------------------------------------------------------------------
+    # cross_seqの逆行, 存在しない価格のdelete/update, 板の交差を検知した場合は
+    # 板を空にしてtopicを再購読する (誤った板を見せるより空の板を返す)
+    # 呼値の整数倍でない価格(tick_sizeの誤り)は再購読しても直らないため, 板を空にして次のsnapshotを待つ
+    #---------------------------------------------------------------------------
+    def __on_orderbook(self, store:dict, message:dict):
+        book = store['board_snapshot']
+        topic = message['topic']
+        stats = self.__book_stats[store['symbol']]
+        error = None
+        event = None
+        with self.__lock:
+            try:
+                if message['type'] == 'snapshot':
+                    self.__book_resyncing.discard(topic)
+                    stats['snapshot'] += 1
+                    book.apply_snapshot(message['data'], message.get('cross_seq'))
+                elif topic in self.__book_resyncing:
+                    # 再購読のsnapshot待ち
+                    stats['skipped'] += 1
+                    return
+                else:
+                    stats['delta'] += 1
+                    book.apply_delta(message['data'], message.get('cross_seq'))
+            except OrderBookError as e:
+                error = e
+            if error is not None:
+                stats[error.reason] += 1
+                if error.reason != 'off_grid':
+                    stats['resubscribe'] += 1
+                book.apply_snapshot([])
+                self.__book_resyncing.add(topic)
+            elif self._orderbook_event:
+                # 全板は渡さず最良気配とversionのみ (全板はget_orderbooksで取得)
+                event = {
+                    'symbol': store['symbol'],
+                    'version': book.version,
+                    'bid': book.best_bid(),
+                    'ask': book.best_ask(),
+                }
+
+        # コールバックへの投入はlockの外で行う ('block'で待たされてもget_orderbook_statsを止めない)
+        if event is not None:
+            self._emit('orderbook', store['symbol'], event)
+        if error is not None and error.reason == 'off_grid':
+            self.logger.error(f'Drop {topic} : {error} (check tick_size)')
+        elif error is not None:
+            self.logger.warning(f'Resubscribe {topic} : {error}')
+            self._send(json.dumps({'op': 'unsubscribe', 'args': [topic]}))
+            self._send(json.dumps({'op': 'subscribe', 'args': [topic]}))
+
+    #---------------------------------------------------------------------------
+    # [topic] ohlcv
+    #---------------------------------------------------------------------------
+    def __on_kline(self, store:dict, message:dict):
+        d = message['data'][0]
+        symbol = store['symbol']
+        last_ohlcv = self.last_ohlcv[symbol]
+        ohlcv = [int(d['start']), float(d['open']), float(d['high']), float(d['low']), float(d['close']), int(d['volume'])]
+        if len(last_ohlcv) > 0 and int(d['start']) > last_ohlcv[0]:
+            if self.backfill is None:
+                store['ohlcv'].append(last_ohlcv)
+                self._emit('ohlcv', symbol, last_ohlcv)
+            else:
+                self.__append_backfilled(store, message['topic'].split('.')[1], last_ohlcv)
+        self.last_ohlcv[symbol] = ohlcv
+
+    #---------------------------------------------------------------------------
+    # 確定した足を過去足に続けて追加
+    #---------------------------------------------------------------------------
+    # 過去足と重複する足は捨て, 切断などで抜けた期間はREST APIで取得して埋める.
+    # [@param]
+    #     store        通貨ペア別データ
+    #     interval     時間足 (klineV2の '1', '5', 'D'など)
+    #     bar          確定した足
+    # [return]
+    #---------------------------------------------------------------------------
+    def __append_backfilled(self, store:dict, interval:str, bar:list):
+        symbol = store['symbol']
+        ohlcv = store['ohlcv']
+        key = (symbol, interval)
+        with self.__kline_lock:
+            pending = self.__gap_pending.get(key)
+            if pending is not None:
+                # 抜けの取得中は取得した足の後に追加する
+                pending.append(bar)
+                return
+            if len(ohlcv) > 0:
+                last_start = ohlcv[-1][0]
+                if bar[0] <= last_start:
+                    return
+                seconds = KlineBackfill.interval_seconds(interval)
+                if seconds is not None and bar[0] > last_start + seconds:
+                    # 抜けは受信処理を止めないように別スレッドで取得する
+                    self.__gap_pending[key] = [bar]
+                    self._run_background(
+                        lambda: self.backfill.fetch(symbol, interval, last_start + seconds, bar[0]),
+                        lambda bars, error: self.__on_gap_filled(store, interval, bars, error))
+                    return
+            self.__append_bars(store, interval, [bar])
+
+    # 抜けの取得完了 (取得中に確定した足を続けて追加)
+    def __on_gap_filled(self, store:dict, interval:str, bars:list, error:Exception):
+        symbol = store['symbol']
+        if error is not None:
+            self.logger.error(f'Fill ohlcv gap failed. {symbol} : {error}')
+            bars = []
+        else:
+            self.logger.info(f'Filled ohlcv gap. {symbol}:{len(bars)}')
+        with self.__kline_lock:
+            waiting = self.__gap_pending.pop((symbol, interval), [])
+            self.__append_bars(store, interval, bars + waiting)
+
+    # 確定した足の追加 (__kline_lock内で呼ぶ. 受信順にコールバックするためロック内で通知する)
+    def __append_bars(self, store:dict, interval:str, bars:list):
+        symbol = store['symbol']
+        ohlcv = store['ohlcv']
+        appended = []
+        for b in bars:
+            if len(ohlcv) > 0 and b[0] <= ohlcv[-1][0]:
+                continue
+            ohlcv.append(b)
+            appended.append(b)
+            self._emit('ohlcv', symbol, b)
+        if appended and self.backfill.cache_dir is not None:
+            # キャッシュへの追記は受信処理を止めないように別スレッドで行う (読み込み時に開始時刻順に並べ直す)
+            self._run_background(lambda: self.backfill.append_cache(symbol, interval, *appended), self.__on_cache_appended)
+
+    # キャッシュへの追記完了 (_run_backgroundのdone)
+    def __on_cache_appended(self, result, error:Exception):
+        if error is not None:
+            self.logger.error(f'Append ohlcv cache failed : {error}')
+
+    #---------------------------------------------------------------------------
+    # [topic] position
+    #---------------------------------------------------------------------------
+    def __on_position(self, store:dict, message:dict):
+        for d in message['data']:
+            store = self.store.get(d['symbol'])
+            if store is None:
+                continue
+            d = self.__position(d)
+            pre_pos_size = -1
+            pre_balance = -1.0
+            if store['position']:
+                pre_pos_size = int(store['position']['size'])
+                pre_balance = float(store['position']['wallet_balance'])
+            store['position'] = d
+            if ((pre_pos_size != int(d['size'])) or
+                (pre_balance != float(d['wallet_balance']))):
+                self._emit('position', d['symbol'], d)
+
+    #---------------------------------------------------------------------------
+    # [topic] execution
+    #---------------------------------------------------------------------------
+    def __on_execution(self, store:dict, message:dict):
+        executions = {}
+        for d in message['data']:
+            store = self.store.get(d['symbol'])
+            if store is None:
+                continue
+            d = self.__execution(d)
+            store['my_execution'].append(d)
+            executions.setdefault(d['symbol'], []).append(d)
+        for symbol, lst in executions.items():
+            self._emit('execution', symbol, lst)
+
+    #---------------------------------------------------------------------------
+    # [topic] order
+    #---------------------------------------------------------------------------
+    def __on_order(self, store:dict, message:dict):
+        lst_delete_order = {}
+        with self.__lock:
+            for d in message['data']:
+                store = self.store.get(d['symbol'])
+                if store is None:
+                    continue
+                d = self.__order(d)
+                store['my_order'].append(d)
+                if self.__order_seen is not None:
+                    self.__order_seen.add(d['order_id'])
+
+                is_delete = False
+                order_status = d.get('order_status')
+                if order_status == 'Canceled' or order_status == 'Filled':
+                    is_delete = True
+                leaves_qty = d.get('leaves_qty')
+                if leaves_qty is not None and int(leaves_qty) <= 0:
+                    is_delete = True
+                if is_delete:
+                    if d['order_id'] in store['my_open_order'].keys():
+                        store['my_open_order'].pop(d['order_id'])
+                    lst_delete_order.setdefault(d['symbol'], []).append(d)
+                else:
+                    store['my_open_order'][d['order_id']] = d
+                    lst_delete_order.setdefault(d['symbol'], [])
+
+        for symbol, lst in lst_delete_order.items():
+            self._emit('order', symbol, {
+                           'open': [o for o in self.store[symbol]['my_open_order'].values()],
+                           'close': lst,
+                       })
+
+    #---------------------------------------------------------------------------
+    # orderbook取得
+    #---------------------------------------------------------------------------
+    # 公開済みの板(BookSnapshot)を参照する. (全板はversion毎に最初の参照時に板のlockを取って1回だけ作る)
+    # depthを指定した場合は, 全板が未作成なら上位depth板のみをコピーする.
+    # [@param]
+    #     depth        取得する板数 (Noneは全板)
+    #     symbol       通貨ペア (Noneは先頭の通貨ペア)
+    # [return]
+    #     {'bids':((price, size), ...), 'asks':((price, size), ...), 'version':板のversion}
+    #     tick_size指定時は shape=(n, 2) の書き込み不可ndarray
+    #---------------------------------------------------------------------------
+    def get_orderbooks(self, depth:int=None, symbol:str=None):
+        book = self.store[symbol or self.symbol]['board_snapshot']
+        snap = book.snapshot if depth is None else book.head(depth)
+        return {'bids':snap.bids, 'asks':snap.asks, 'version':snap.version}
+
+    #---------------------------------------------------------------------------
+    # 最良気配取得
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     symbol       通貨ペア (Noneは先頭の通貨ペア)
+    # [return]
+    #     {'bid':(price, size), 'ask':(price, size)} 板が空の側はNone
+    #---------------------------------------------------------------------------
+    def get_best_quote(self, symbol:str=None):
+        top = self.store[symbol or self.symbol]['board_snapshot'].top
+        return {'bid':top.best_bid, 'ask':top.best_ask}
+
+    #---------------------------------------------------------------------------
+    # 公開済みの板取得
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     symbol       通貨ペア (Noneは先頭の通貨ペア)
+    # [return]
+    #     BookSnapshot (version, seq, bids, asks, best_bid, best_ask)
+    #---------------------------------------------------------------------------
+    def get_orderbook_snapshot(self, symbol:str=None):
+        return self.store[symbol or self.symbol]['board_snapshot'].snapshot
+
+    #---------------------------------------------------------------------------
+    # 指定versionから板が更新されたか
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     version      前回取得した板のversion
+    #     symbol       通貨ペア (Noneは先頭の通貨ペア)
+    # [return]
+    #     True:更新あり, False:更新なし
+    #---------------------------------------------------------------------------
+    def is_orderbook_changed(self, version:int, symbol:str=None):
+        return self.store[symbol or self.symbol]['board_snapshot'].top.version != version
+
+    #---------------------------------------------------------------------------
+    # orderbook整合性の統計取得
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     symbol       通貨ペア (Noneは全通貨ペア)
+    # [return]
+    #     {'snapshot': 受信したsnapshot数, 'delta': 受信したdelta数,
+    #      'out_of_order'/'missing_level'/'crossed'/'off_grid': 検知した不整合の回数,
+    #      'resubscribe': 再購読した回数, 'skipped': snapshot待ちで捨てたdelta数}
+    #     symbol=Noneの場合は {symbol: 上記dict}
+    #---------------------------------------------------------------------------
+    def get_orderbook_stats(self, symbol:str=None):
+        with self.__lock:
+            if symbol is not None:
+                return dict(self.__book_stats[symbol])
+            return {s: dict(st) for s, st in self.__book_stats.items()}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from time import perf_counter, sleep
+from bybit_ws_base import BybitWSBase
+from callback_dispatcher import CallbackDispatcher
+from message_recorder import MessageReader
+
+#===============================================================================
+# bybit WebSocket 再生クラス
+#===============================================================================
+# MessageRecorderで記録したフレームを, 受信時と同じ処理 (_on_message -> topic別のhandler
+# -> CallbackDispatcher) に順に渡す. 接続はしない.
+# 受信時刻(data['timestamp'], 足の確定)には記録した受信時刻を使うため, 同じ記録からは
+# 常に同じ結果になる.
+#
+# speed
+#   None : 待機せずに最速で再生 (パーサ/板処理のスループット計測にも使える)
+#   1.0  : 受信時と同じ間隔で再生 (2.0は2倍速)
+#
+# callback_sync=True(default)の場合, コールバックはフレーム毎に処理が終わった時点で再生スレッドから呼び出す.
+# コールバック内で参照するデータ(get_best_quote, data['last_price']など)もそのフレームまでの状態になり,
+# 同じ記録からは常に同じ順序/内容でコールバックされる.
+# Falseの場合は受信時と同じくCallbackDispatcherのworkerスレッドで呼び出す (再生とコールバックが並行).
+#===============================================================================
+class BybitWSReplay(BybitWSBase):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     source       記録の保存先ディレクトリ, または (受信時刻[sec], フレーム) のiterable
+    #     symbol       通貨ペア (複数購読する場合はリスト)
+    #     channel      記録したチャンネルリスト (空リストはBybitWSのdefault)
+    #     callback     チャンネル別のコールバック関数dict
+    #     speed        再生速度の倍率 (Noneは最速)
+    #     start        再生する期間の始め [sec] (Noneは最初から)
+    #     end          再生する期間の終わり [sec] (Noneは最後まで)
+    #     prefix       記録のファイル名の先頭
+    #     callback_sync True:フレーム毎に再生スレッドでコールバック, False:workerスレッドでコールバック
+    #     callback_batch, callback_executor, callback_workers, callback_policy (BybitWS参照)
+    #                  (callback_executor, callback_workers, callback_policyはcallback_sync=Falseの場合のみ)
+    #     **kwargs     tick_size, topic_handler, json_decoder, raw_records, trade_capacity, bar_timeframes,
+    #                  latency (BybitWSBase参照. 取引所の時刻からの遅延は記録した受信時刻で計算)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, source, symbol='BTCUSD', channel:list=[], callback:dict={}, speed:float=None,
+                 start:float=None, end:float=None, prefix:str='bybit', callback_sync:bool=True,
+                 callback_batch:bool=False, callback_executor:str='single', callback_workers:int=4,
+                 callback_policy:dict={}, **kwargs):
+        super().__init__('', '', symbol=symbol, channel=channel, callback=callback, **kwargs)
+        if isinstance(source, str):
+            source = MessageReader(source, prefix).read(start, end)
+        self.source = source
+        self.speed = speed
+        self.callback_sync = callback_sync
+
+        # 再現性のためconflateは指定した場合のみ (BybitWSと違いdefaultは全topic'block')
+        self.dispatcher = CallbackDispatcher(self, self.callback, batch=callback_batch, logger=self.logger,
+                                             executor=callback_executor, workers=callback_workers,
+                                             policy=callback_policy)
+        if self.latency is not None:
+            self.dispatcher.on_latency = self.latency.observe_callback
+
+        # 仮想時計 (再生中のフレームの受信時刻)
+        self.now = None
+        self._clock = lambda: self.now
+        self.__stopped = False
+        self.__pending = []   # callback_sync時のフレーム処理中のコールバック対象データ
+        self.__stats = {'messages': 0, 'elapsed': 0.0, 'msgs_per_sec': 0.0, 'first_time': None, 'last_time': None}
+
+    #---------------------------------------------------------------------------
+    # 再生 (全フレームを処理してコールバックが終わるまで戻らない)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     limit        処理するフレーム数の上限 (Noneは全て)
+    # [return]
+    #     統計dict (stats参照)
+    #---------------------------------------------------------------------------
+    def run(self, limit:int=None):
+        if len(self.callback.keys()) > 0 and not self.callback_sync:
+            self.dispatcher.start()
+        on_message = self._on_message
+        pending = self.__pending
+        call = self.dispatcher.call
+        speed = self.speed
+        has_bars = any('bars' in store for store in self.store.values())
+        next_bar = None
+        first = None
+        count = 0
+        t0 = perf_counter()
+        for ts, frame in self.source:
+            if self.__stopped or (limit is not None and count >= limit):
+                break
+            if first is None:
+                first = ts
+            if speed is not None:
+                wait = (ts - first) / speed - (perf_counter() - t0)
+                if wait > 0:
+                    sleep(wait)
+            self.now = ts
+            if has_bars and (next_bar is None or ts >= next_bar):
+                # 受信時のタイマーの代わりに受信時刻で時間足を確定
+                next_bar = self._close_bars()
+                if pending:
+                    call(pending)
+                    pending.clear()
+            on_message(frame)
+            if pending:
+                call(pending)
+                pending.clear()
+            count += 1
+        elapsed = perf_counter() - t0
+        self.dispatcher.stop()
+
+        self.__stats = {
+            'messages': count,
+            'elapsed': elapsed,
+            'msgs_per_sec': count / elapsed if elapsed > 0 else 0.0,
+            'first_time': first,
+            'last_time': self.now,
+        }
+        self.logger.info(f'Replay finished. {count} messages in {elapsed:.3f} sec.')
+        return self.stats()
+
+    #---------------------------------------------------------------------------
+    # 再生の中止 (コールバックなど別スレッドから呼び出す)
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.__stopped = True
+
+    #---------------------------------------------------------------------------
+    # 統計
+    #---------------------------------------------------------------------------
+    # [return]
+    #     {'messages': 処理したフレーム数, 'elapsed': 処理時間[sec], 'msgs_per_sec': 1秒あたりのフレーム数,
+    #      'first_time': 最初のフレームの受信時刻, 'last_time': 最後のフレームの受信時刻}
+    #---------------------------------------------------------------------------
+    def stats(self):
+        return dict(self.__stats)
+
+    #---------------------------------------------------------------------------
+    # コールバック統計 (CallbackDispatcher.get_stats参照)
+    #---------------------------------------------------------------------------
+    def get_callback_stats(self):
+        return self.dispatcher.get_stats()
+
+    def _emit(self, topic:str, symbol:str, data):
+        if self.callback_sync:
+            if self.callback:
+                self.__pending.append((topic, symbol, data, self._received))
+        else:
+            self.dispatcher.put(topic, symbol, data, self._received)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import threading
+import traceback
+from collections import deque
+from time import perf_counter
+
+#===============================================================================
+# コールバック呼び出しクラス
+#===============================================================================
+# 受信スレッドから積まれたイベントをworkerスレッドでコールバックする.
+# workerはイベントが来るまでブロッキングで待機し, 溜まっている分はまとめて処理する.
+#
+# executor
+#   'single' : 1つのworkerで全topicを処理 (受信順を保持)
+#   'topic'  : topic毎にworkerを生成
+#   'pool'   : workers個のworkerにtopicを割り当て (topic内の順序は保持)
+#
+# policy (topic毎のキューが上限に達した場合の動作)
+#   'block'       : 空くまで投入側(受信スレッド)を待たせる
+#   'drop_oldest' : 一番古い未処理イベントを捨てる
+#   'conflate'    : 未処理イベントを最新の値で上書きする (topic/通貨ペア毎に1件)
+#===============================================================================
+class CallbackDispatcher(object):
+
+    EXECUTORS = ['single', 'topic', 'pool']
+    POLICIES = ['block', 'drop_oldest', 'conflate']
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     owner        コールバック関数の第1引数に渡すインスタンス
+    #     callback     チャンネル別のコールバック関数dict
+    #                  key は topic ('trade') または topic.symbol ('trade.ETHUSD')
+    #     batch        True:溜まったイベントを関数毎にlistでまとめてコールバック
+    #     logger       logger
+    #     executor     'single', 'topic', 'pool'
+    #     workers      executor='pool'の場合のworker数
+    #     policy       topic別のキュー上限時の動作
+    #                  {'trade': ('drop_oldest', 10000), 'instrument': 'conflate', ...}
+    #                  (未指定のtopicは上限なしの'block')
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, owner, callback:dict, batch:bool=False, logger=None,
+                 executor:str='single', workers:int=4, policy:dict={}):
+        if executor not in self.EXECUTORS:
+            raise ValueError(f'Unknown executor: {executor}')
+        self.owner = owner
+        self.callback = callback
+        self.batch = batch
+        self.logger = logger
+        self.executor = executor
+        self.num_workers = workers if executor == 'pool' else 1
+        # 受信からコールバックまでの遅延の通知先 on_latency(topic, delay) (putでreceivedを渡した場合のみ)
+        self.on_latency = None
+
+        self.__policy = {}
+        for topic, p in policy.items():
+            name, maxsize = (p, 0) if isinstance(p, str) else (p[0], p[1])
+            if name not in self.POLICIES:
+                raise ValueError(f'Unknown policy: {name}')
+            self.__policy[topic] = (name, maxsize)
+
+        self.__workers = {}         # worker識別key -> _Worker
+        self.__worker_of = {}       # topic -> _Worker
+        self.__stats = {}           # topic -> 統計dict
+        self.__lock = threading.Lock()
+        self.__running = False
+
+    #---------------------------------------------------------------------------
+    # 開始
+    #---------------------------------------------------------------------------
+    def start(self):
+        with self.__lock:
+            if self.__running:
+                return
+            self.__running = True
+            for w in self.__workers.values():
+                w.start()
+
+    #---------------------------------------------------------------------------
+    # 停止 (未処理のイベントを処理してから終了)
+    #---------------------------------------------------------------------------
+    def stop(self, timeout:float=None):
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__running = False
+            workers = list(self.__workers.values())
+        for w in workers:
+            w.stop(timeout)
+
+    #---------------------------------------------------------------------------
+    # イベント投入
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     topic        'trade', 'order'など
+    #     symbol       通貨ペア
+    #     data         コールバック関数に渡すデータ
+    #     received     受信時刻 (perf_counter) 指定すると on_latency に受信からの遅延を通知
+    # [return]
+    #---------------------------------------------------------------------------
+    def put(self, topic:str, symbol:str, data, received:float=None):
+        # 開始前/停止後は積まない (コールバックなしでキューが溜まり続けないように)
+        if not self.__running:
+            return
+        worker = self.__worker_of.get(topic)
+        if worker is None:
+            worker = self.__assign_worker(topic)
+        policy, maxsize = self.__policy.get(topic, ('block', 0))
+        worker.put(topic, symbol, data, policy, maxsize, self.__stats[topic], received)
+
+    #---------------------------------------------------------------------------
+    # 呼び出し元のスレッドでコールバック (キューとworkerを経由しない)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     events       [(topic, symbol, data, received), ...] (batch=Trueの場合は関数毎にまとめる)
+    # [return]
+    #---------------------------------------------------------------------------
+    def call(self, events:list):
+        now = perf_counter()
+        lst = []
+        for topic, symbol, data, received in events:
+            stats = self.__stats.get(topic)
+            if stats is None:
+                with self.__lock:
+                    stats = self.__stats.setdefault(topic, self.__new_stats())
+            stats['queued'] += 1
+            lst.append([now, topic, symbol, data, stats, True, received])
+        self._dispatch(lst)
+
+    #---------------------------------------------------------------------------
+    # 統計取得
+    #---------------------------------------------------------------------------
+    # [return]
+    #     {'queue_size': 未処理イベント数,
+    #      'dispatched': コールバックしたイベント数,
+    #      'dropped'/'conflated': policyにより捨てた/上書きしたイベント数,
+    #      'delay_last'/'delay_avg'/'delay_max': キュー投入からコールバックまでの遅延[sec],
+    #      'max_drain': 1回でまとめて取り出した最大イベント数,
+    #      'topics': {topic: topic別の上記統計}}
+    #---------------------------------------------------------------------------
+    def get_stats(self):
+        topics = {}
+        for topic, st in list(self.__stats.items()):
+            n = st['dispatched']
+            topics[topic] = {
+                'queue_size': st['queued'] - n - st['dropped'],
+                'dispatched': n,
+                'dropped': st['dropped'],
+                'conflated': st['conflated'],
+                'delay_last': st['delay_last'],
+                'delay_avg': st['delay_sum'] / n if n > 0 else 0.0,
+                'delay_max': st['delay_max'],
+            }
+        n = sum(t['dispatched'] for t in topics.values())
+        delay_sum = sum(st['delay_sum'] for st in list(self.__stats.values()))
+        last = max(list(self.__stats.values()), key=lambda st: st['last_time'], default=None)
+        return {
+            'queue_size': sum(t['queue_size'] for t in topics.values()),
+            'dispatched': n,
+            'dropped': sum(t['dropped'] for t in topics.values()),
+            'conflated': sum(t['conflated'] for t in topics.values()),
+            'delay_last': last['delay_last'] if last else 0.0,
+            'delay_avg': delay_sum / n if n > 0 else 0.0,
+            'delay_max': max([t['delay_max'] for t in topics.values()], default=0.0),
+            'max_drain': max([w.max_drain for w in list(self.__workers.values())], default=0),
+            'topics': topics,
+        }
+
+    #---------------------------------------------------------------------------
+    # topic/通貨ペアからコールバック関数を取得 (通貨ペア指定を優先)
+    #---------------------------------------------------------------------------
+    def get_callback(self, topic:str, symbol:str):
+        func = self.callback.get(topic + '.' + symbol)
+        if func is None:
+            func = self.callback.get(topic)
+        return func
+
+    #---------------------------------------------------------------------------
+    # topicを処理するworkerを決定 (初回のみ)
+    #---------------------------------------------------------------------------
+    def __assign_worker(self, topic:str):
+        with self.__lock:
+            worker = self.__worker_of.get(topic)
+            if worker is not None:
+                return worker
+            if self.executor == 'single':
+                key = 0
+            elif self.executor == 'topic':
+                key = topic
+            else:
+                # 初めて来たtopicから順に割り当て
+                key = len(self.__worker_of) % self.num_workers
+            worker = self.__workers.get(key)
+            if worker is None:
+                worker = _Worker(self, f'callback-{key}')
+                self.__workers[key] = worker
+                if self.__running:
+                    worker.start()
+            self.__stats.setdefault(topic, self.__new_stats())
+            self.__worker_of[topic] = worker
+            return worker
+
+    @staticmethod
+    def __new_stats():
+        return {'queued': 0, 'dispatched': 0, 'dropped': 0, 'conflated': 0,
+                'delay_last': 0.0, 'delay_sum': 0.0, 'delay_max': 0.0, 'last_time': 0.0}
+
+    #---------------------------------------------------------------------------
+    # workerから呼ばれるコールバック処理
+    #---------------------------------------------------------------------------
+    def _dispatch(self, events:list):
+        on_latency = self.on_latency
+        if self.batch:
+            groups = {}
+            for enqueued, topic, symbol, data, stats, _, received in events:
+                self.__record_delay(enqueued, stats)
+                if received is not None and on_latency is not None:
+                    on_latency(topic, perf_counter() - received)
+                func = self.get_callback(topic, symbol)
+                if func is not None:
+                    groups.setdefault(func, []).append(data)
+            for func, lst in groups.items():
+                self.__call(func, lst)
+        else:
+            for enqueued, topic, symbol, data, stats, _, received in events:
+                self.__record_delay(enqueued, stats)
+                if received is not None and on_latency is not None:
+                    on_latency(topic, perf_counter() - received)
+                func = self.get_callback(topic, symbol)
+                if func is not None:
+                    self.__call(func, data)
+
+    def __call(self, func, data):
+        try:
+            func(self.owner, data)
+        except Exception:
+            if self.logger is not None:
+                self.logger.error(traceback.format_exc())
+            else:
+                print(traceback.format_exc())
+
+    # topic別統計は担当workerのスレッドだけが更新する
+    @staticmethod
+    def __record_delay(enqueued:float, stats:dict):
+        now = perf_counter()
+        delay = now - enqueued
+        stats['delay_last'] = delay
+        stats['delay_sum'] += delay
+        if delay > stats['delay_max']:
+            stats['delay_max'] = delay
+        stats['dispatched'] += 1
+        stats['last_time'] = now
+
+
+#===============================================================================
+# コールバック処理worker (CallbackDispatcher内部用)
+#===============================================================================
+class _Worker(object):
+
+    def __init__(self, dispatcher:CallbackDispatcher, name:str):
+        self.dispatcher = dispatcher
+        self.name = name
+        self.max_drain = 0
+        self.__cond = threading.Condition()
+        self.__events = deque()  # 受信順のイベント [enqueued, topic, symbol, data, stats, alive, received]
+        self.__pending = {}      # (topic, symbol) -> 未処理イベントのdeque
+        self.__running = False
+        self.__thread = None
+
+    def start(self):
+        with self.__cond:
+            self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name=self.name)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout:float=None):
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify_all()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+
+    #---------------------------------------------------------------------------
+    # イベント投入 (policyに従って上限を処理)
+    #---------------------------------------------------------------------------
+    def put(self, topic:str, symbol:str, data, policy:str, maxsize:int, stats:dict, received:float=None):
+        key = (topic, symbol)
+        with self.__cond:
+            pending = self.__pending.get(key)
+            if pending is None:
+                pending = self.__pending[key] = deque()
+
+            if policy == 'conflate' and len(pending) > 0:
+                # 未処理のイベントを最新の値で上書き (受信順の位置はそのまま)
+                pending[-1][3] = data
+                pending[-1][6] = received
+                stats['conflated'] += 1
+                return
+
+            if maxsize > 0 and len(pending) >= maxsize:
+                if policy == 'drop_oldest':
+                    pending.popleft()[5] = False
+                    stats['dropped'] += 1
+                else:
+                    while len(pending) >= maxsize and self.__running:
+                        self.__cond.wait()
+
+            event = [perf_counter(), topic, symbol, data, stats, True, received]
+            pending.append(event)
+            self.__events.append(event)
+            stats['queued'] += 1
+            self.__cond.notify_all()
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while len(self.__events) == 0 and self.__running:
+                    self.__cond.wait()
+                if len(self.__events) == 0:
+                    break
+
+                # 溜まっている分をまとめて取り出す
+                events = []
+                for e in self.__events:
+                    if e[5]:
+                        self.__pending[(e[1], e[2])].popleft()
+                        events.append(e)
+                self.__events.clear()
+                # 待機している投入側を起こす
+                self.__cond.notify_all()
+
+            if len(events) > self.max_drain:
+                self.max_drain = len(events)
+            self.dispatcher._dispatch(events)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+
+#===============================================================================
+# JSONデコーダ選択クラス
+#===============================================================================
+# orjson > json(標準) > simplejson の順にインストールされているものを使用する.
+# (simplejsonはCPython3の標準jsonより遅いため明示指定した場合のみ使用)
+# 受信フレームはstr/bytesどちらでもデコードできる.
+#===============================================================================
+class JsonDecoder(object):
+
+    # 自動選択時の優先順
+    PRIORITY = ['orjson', 'json', 'simplejson']
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     name         'orjson', 'simplejson', 'json' (Noneは自動選択)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, name:str=None):
+        if name is None:
+            for n in self.PRIORITY:
+                if self.available(n):
+                    name = n
+                    break
+        self.name = name
+        self.loads = self.__get_loads(name)
+
+    #---------------------------------------------------------------------------
+    # デコーダが使用可能か
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     name         デコーダ名
+    # [return]
+    #     True:使用可能, False:未インストール
+    #---------------------------------------------------------------------------
+    @classmethod
+    def available(cls, name:str):
+        try:
+            cls.__get_loads(name)
+        except ImportError:
+            return False
+        return True
+
+    #---------------------------------------------------------------------------
+    # 受信フレームのデコード
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     frame        str / bytes / bytearray / memoryview
+    # [return]
+    #     デコードしたオブジェクト
+    #---------------------------------------------------------------------------
+    def decode(self, frame):
+        if isinstance(frame, memoryview) and self.name != 'orjson':
+            frame = frame.tobytes()
+        return self.loads(frame)
+
+    @staticmethod
+    def __get_loads(name:str):
+        if name == 'orjson':
+            import orjson
+            return orjson.loads
+        elif name == 'simplejson':
+            import simplejson
+            return simplejson.loads
+        elif name == 'json':
+            return json.loads
+        raise ValueError(f'Unknown json decoder: {name}')
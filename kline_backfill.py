@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import threading
+import requests
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+#===============================================================================
+# 過去足取得クラス (REST API)
+#===============================================================================
+# /v2/public/kline/list から過去の足を取得する.
+# 取得期間を1回の上限(200本)毎のページに分けて並列に取得し, 開始時刻で重複を除いて結合する.
+# 抜けがあったページは1回だけ取得し直す.
+#
+# cache_dirを指定すると確定済みの足を 通貨ペア_時間足.jsonl に保存し,
+# 次回はキャッシュにない期間 (キャッシュより前, 最後の足以降) だけを取得する.
+# 足は [start, open, high, low, close, volume] (startは秒, klineV2のohlcvと同じ形式).
+#===============================================================================
+class KlineBackfill(object):
+
+    PAGE_LIMIT = 200   # 1回の取得の上限本数
+
+    # klineV2の時間足 -> 秒 ('M'は日数が一定でないため抜けの判定をしない)
+    INTERVALS = {'1': 60, '3': 180, '5': 300, '15': 900, '30': 1800, '60': 3600, '120': 7200,
+                 '240': 14400, '360': 21600, 'D': 86400, 'W': 604800, 'M': None}
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     rest_endpoint REST APIのURL ('https://api.bybit.com'など)
+    #     cache_dir    キャッシュの保存先ディレクトリ (Noneは保存しない)
+    #     workers      並列に取得するスレッド数
+    #     timeout      1回の取得のタイムアウト秒数
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, rest_endpoint:str, cache_dir:str=None, workers:int=4, timeout:float=10.0):
+        self.rest_endpoint = rest_endpoint.rstrip('/')
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.__session = requests.Session()
+        self.__lock = threading.Lock()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    #---------------------------------------------------------------------------
+    # 時間足の秒数 (klineV2の '1', '5', 'D'など)
+    #---------------------------------------------------------------------------
+    @classmethod
+    def interval_seconds(cls, interval:str):
+        interval = str(interval)
+        if interval not in cls.INTERVALS:
+            raise ValueError(f'Unknown interval: {interval}')
+        return cls.INTERVALS[interval]
+
+    #---------------------------------------------------------------------------
+    # 直近の確定済みの足を取得 (キャッシュ + REST API)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     symbol       通貨ペア
+    #     interval     時間足 (klineV2の '1', '5', 'D'など)
+    #     count        取得する本数
+    #     now          現在時刻 [sec] (Noneはtime())
+    # [return]
+    #     確定済みの足のlist (古い順)
+    #---------------------------------------------------------------------------
+    def load(self, symbol:str, interval:str, count:int, now:float=None):
+        interval = str(interval)
+        if now is None:
+            now = time()
+        seconds = self.interval_seconds(interval) or 31 * 86400
+        # 生成中の足はWebSocketで受信するので含めない
+        end = int(now) - int(now) % seconds if interval != 'M' else int(now)
+        start = end - count * seconds
+
+        cache = self.read_cache(symbol, interval)
+        cached = [b for b in cache if b[0] >= start]
+        fetched = []
+        if cached:
+            # キャッシュより前 (前回より多い本数を指定した場合) とキャッシュの最後の足以降を取得
+            if cached[0][0] > start:
+                fetched += self.fetch(symbol, interval, start, cached[0][0])
+            start = cached[-1][0] + seconds
+        if start < end:
+            fetched += self.fetch(symbol, interval, start, end)
+        bars = self.merge(cached, fetched)
+        bars = [b for b in bars if b[0] + seconds <= now][-count:]
+        if fetched or len(cache) > len(bars):
+            # 追記で増えた分も含めて直近count本に置き換える
+            self.write_cache(symbol, interval, bars)
+        return bars
+
+    #---------------------------------------------------------------------------
+    # 期間指定で足を取得 (REST API)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     symbol       通貨ペア
+    #     interval     時間足 (klineV2の '1', '5', 'D'など)
+    #     start        期間の始め [sec] (この時刻以降に始まる足)
+    #     end          期間の終わり [sec] (この時刻より前に始まる足)
+    # [return]
+    #     足のlist (古い順, 重複なし)
+    #---------------------------------------------------------------------------
+    def fetch(self, symbol:str, interval:str, start:int, end:int):
+        interval = str(interval)
+        seconds = self.interval_seconds(interval)
+        if seconds is None:
+            # 月足はページを計算できないので順に取得
+            return self.__fetch_serial(symbol, interval, start, end)
+        span = seconds * self.PAGE_LIMIT
+        pages = list(range(start - start % seconds, end, span))
+        results = self.__fetch_pages(symbol, interval, pages)
+
+        bars = {}
+        retry = []
+        for page, rows in zip(pages, results):
+            page_end = min(page + span, end)
+            expected = (page_end - max(page, start) + seconds - 1) // seconds
+            got = [b for b in rows if start <= b[0] < page_end]
+            if len(got) < expected:
+                retry.append(page)
+            for b in got:
+                bars[b[0]] = b
+        if retry:
+            # 抜けのあったページを取得し直す (取引のない期間は取得し直しても埋まらない)
+            for page, rows in zip(retry, self.__fetch_pages(symbol, interval, retry)):
+                for b in rows:
+                    if start <= b[0] < end:
+                        bars[b[0]] = b
+        return [bars[k] for k in sorted(bars)]
+
+    def __fetch_serial(self, symbol:str, interval:str, start:int, end:int):
+        bars = {}
+        page = start
+        while page < end:
+            rows = self.__fetch_page(symbol, interval, page)
+            rows = [b for b in rows if page <= b[0] < end]
+            if not rows:
+                break
+            for b in rows:
+                bars[b[0]] = b
+            page = rows[-1][0] + 1
+        return [bars[k] for k in sorted(bars)]
+
+    def __fetch_pages(self, symbol:str, interval:str, pages:list):
+        if len(pages) <= 1:
+            return [self.__fetch_page(symbol, interval, p) for p in pages]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda p: self.__fetch_page(symbol, interval, p), pages))
+
+    #---------------------------------------------------------------------------
+    # 1ページ取得
+    #---------------------------------------------------------------------------
+    def __fetch_page(self, symbol:str, interval:str, start:int):
+        params = {'symbol': symbol, 'interval': interval, 'from': start, 'limit': self.PAGE_LIMIT}
+        res = self.__session.get(self.rest_endpoint + '/v2/public/kline/list', params=params,
+                                 timeout=self.timeout).json()
+        if res.get('ret_code') != 0:
+            raise Exception(f'Fetch kline failed: {res}')
+        return [[int(d['open_time']), float(d['open']), float(d['high']), float(d['low']),
+                 float(d['close']), int(float(d['volume']))] for d in res.get('result') or []]
+
+    #---------------------------------------------------------------------------
+    # 足の結合 (開始時刻で重複を除く. 重複した場合は後のlistを優先)
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def merge(*lists):
+        bars = {}
+        for l in lists:
+            for b in l:
+                bars[int(b[0])] = list(b)
+        return [bars[k] for k in sorted(bars)]
+
+    #---------------------------------------------------------------------------
+    # キャッシュ
+    #---------------------------------------------------------------------------
+    def cache_path(self, symbol:str, interval:str):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f'{symbol}_{interval}.jsonl')
+
+    # キャッシュ読み込み (古い順, 重複なし)
+    def read_cache(self, symbol:str, interval:str):
+        path = self.cache_path(symbol, interval)
+        if path is None or not os.path.exists(path):
+            return []
+        bars = []
+        with self.__lock, open(path) as f:
+            for line in f:
+                try:
+                    bars.append(json.loads(line))
+                except ValueError:
+                    # 書き込み途中で終了した行は捨てる
+                    continue
+        return self.merge(bars)
+
+    # キャッシュ書き込み (全体を置き換え)
+    def write_cache(self, symbol:str, interval:str, bars:list):
+        path = self.cache_path(symbol, interval)
+        if path is None:
+            return
+        tmp = path + '.tmp'
+        with self.__lock:
+            with open(tmp, 'w') as f:
+                for b in bars:
+                    f.write(json.dumps(b) + '\n')
+            os.replace(tmp, path)
+
+    # キャッシュに確定した足を追記
+    def append_cache(self, symbol:str, interval:str, *bars:list):
+        path = self.cache_path(symbol, interval)
+        if path is None:
+            return
+        with self.__lock, open(path, 'a') as f:
+            for bar in bars:
+                f.write(json.dumps(list(bar)) + '\n')
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import requests
+from time import time
+from collections import deque
+from metrics import Histogram, Metrics
+
+#===============================================================================
+# 遅延計測クラス
+#===============================================================================
+# topic別に 取引所の時刻 -> 受信 と 受信 -> コールバック の遅延の分布を記録する.
+#
+# 取引所の時刻との差 (受信時刻 - 取引所の時刻) にはローカル時計のずれが含まれるため,
+# 時計のずれ(clock offset)を推定して差し引く.
+#   sync_clock()を呼んだ場合 : REST APIのサーバ時刻と往復時間から推定 (NTPと同じ考え方)
+#   呼んでいない場合         : 直近window秒の最小の差をずれとみなす
+#                              (最も速く届いたmessageの遅延を0とした相対的な遅延になる)
+#
+# thresholdを指定すると, 遅延がthreshold秒を超えた状態がgrace秒続いた時に on_lag(topic, lag) を呼び出す.
+# metricsを指定すると, histogramはMetricsに登録したもの (exchange_lag_seconds, callback_latency_seconds) を使う.
+#===============================================================================
+class LatencyTracker(object):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     threshold    遅延の許容秒数 (Noneは判定しない)
+    #     on_lag       遅延が続いた時に呼び出す関数 on_lag(topic, lag)
+    #     grace        thresholdを超えた状態が何秒続いたら on_lag を呼び出すか
+    #     cooldown     同じtopicで on_lag を再度呼び出すまでの秒数
+    #     window       時計のずれを推定する期間 [sec] (sync_clockしていない場合)
+    #     metrics      histogramを登録するMetrics (Noneは登録しない)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, threshold:float=None, on_lag=None, grace:float=1.0, cooldown:float=60.0, window:float=300.0,
+                 metrics:Metrics=None):
+        self.threshold = threshold
+        self.metrics = metrics
+        self.on_lag = on_lag
+        self.grace = grace
+        self.cooldown = cooldown
+        self.window = window
+        self.synced_offset = None   # sync_clockで推定したずれ [sec]
+        self.lag_events = 0         # on_lagを呼び出した回数
+
+        self.__slot_seconds = window / 30
+        self.__slots = deque()      # [区間番号, 区間内の最小の差]
+        self.__min_offset = None    # 直近window秒の最小の差
+        self.__exchange = {}        # topic -> Histogram (取引所の時刻 -> 受信)
+        self.__callback = {}        # topic -> Histogram (受信 -> コールバック)
+        self.__over = {}            # topic -> thresholdを超え始めた受信時刻
+        self.__fired = {}           # topic -> 最後にon_lagを呼び出した受信時刻
+
+    #---------------------------------------------------------------------------
+    # 推定した時計のずれ [sec] (ローカル時刻 - 取引所の時刻)
+    #---------------------------------------------------------------------------
+    @property
+    def clock_offset(self):
+        if self.synced_offset is not None:
+            return self.synced_offset
+        return self.__min_offset or 0.0
+
+    #---------------------------------------------------------------------------
+    # REST APIのサーバ時刻で時計のずれを推定
+    #---------------------------------------------------------------------------
+    # 往復時間が最も短かった回の (送信時刻 + 受信時刻) / 2 - サーバ時刻 をずれとする.
+    # [@param]
+    #     rest_endpoint REST APIのURL
+    #     samples      取得回数
+    #     timeout      1回の取得のタイムアウト秒数
+    # [return]
+    #     推定したずれ [sec]
+    #---------------------------------------------------------------------------
+    def sync_clock(self, rest_endpoint:str, samples:int=5, timeout:float=5.0):
+        best = None
+        with requests.Session() as session:
+            for _ in range(samples):
+                t0 = time()
+                res = session.get(rest_endpoint + '/v2/public/time', timeout=timeout).json()
+                t1 = time()
+                server = float(res['time_now'])
+                if best is None or t1 - t0 < best[0]:
+                    best = (t1 - t0, (t0 + t1) / 2 - server)
+        self.synced_offset = best[1]
+        return self.synced_offset
+
+    #---------------------------------------------------------------------------
+    # 取引所の時刻 -> 受信 の記録
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     topic        topic
+    #     received     受信時刻 [sec]
+    #     exchange     取引所の時刻 [sec]
+    # [return]
+    #     ずれを差し引いた遅延 [sec]
+    #---------------------------------------------------------------------------
+    def observe_exchange(self, topic:str, received:float, exchange:float):
+        diff = received - exchange
+        self.__update_offset(received, diff)
+        lag = diff - self.clock_offset
+        h = self.__exchange.get(topic)
+        if h is None:
+            h = self.__exchange[topic] = self.__histogram('exchange_lag_seconds', topic)
+        h.observe(lag)
+
+        if self.threshold is not None:
+            if lag <= self.threshold:
+                self.__over[topic] = None
+            else:
+                since = self.__over.get(topic)
+                if since is None:
+                    self.__over[topic] = since = received
+                fired = self.__fired.get(topic)
+                if received - since >= self.grace and (fired is None or received - fired >= self.cooldown):
+                    self.__fired[topic] = received
+                    self.__over[topic] = None
+                    self.lag_events += 1
+                    if self.on_lag is not None:
+                        self.on_lag(topic, lag)
+        return lag
+
+    #---------------------------------------------------------------------------
+    # 遅延の継続判定のリセット (再接続時)
+    #---------------------------------------------------------------------------
+    def reset(self):
+        self.__over = {}
+
+    #---------------------------------------------------------------------------
+    # 受信 -> コールバック の記録
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     topic        コールバックのtopic ('trade'など)
+    #     delay        受信からコールバックまでの秒数
+    # [return]
+    #---------------------------------------------------------------------------
+    def observe_callback(self, topic:str, delay:float):
+        h = self.__callback.get(topic)
+        if h is None:
+            h = self.__callback[topic] = self.__histogram('callback_latency_seconds', topic)
+        h.observe(delay)
+
+    def __histogram(self, name:str, topic:str):
+        if self.metrics is not None:
+            return self.metrics.histogram(name, topic=topic)
+        return Histogram(Metrics.BUCKETS)
+
+    #---------------------------------------------------------------------------
+    # 統計
+    #---------------------------------------------------------------------------
+    # [return]
+    #     {'clock_offset': ずれ[sec], 'offset_source': 'rest' or 'min_filter', 'lag_events': on_lagの回数,
+    #      'exchange': {topic: {'count', 'sum', 'p50', 'p99', 'max', 'buckets'}},
+    #      'callback': {topic: {...}}}
+    #---------------------------------------------------------------------------
+    def stats(self):
+        return {
+            'clock_offset': self.clock_offset,
+            'offset_source': 'rest' if self.synced_offset is not None else 'min_filter',
+            'lag_events': self.lag_events,
+            'exchange': {t: h.to_dict() for t, h in list(self.__exchange.items())},
+            'callback': {t: h.to_dict() for t, h in list(self.__callback.items())},
+        }
+
+    #---------------------------------------------------------------------------
+    # 直近window秒の最小の差 (window/30秒毎の区間の最小値で管理)
+    #---------------------------------------------------------------------------
+    def __update_offset(self, received:float, diff:float):
+        slot = int(received // self.__slot_seconds)
+        slots = self.__slots
+        if slots and slots[-1][0] == slot:
+            if diff < slots[-1][1]:
+                slots[-1][1] = diff
+            if diff < self.__min_offset:
+                self.__min_offset = diff
+            return
+        slots.append([slot, diff])
+        while slots[0][0] <= slot - 30:
+            slots.popleft()
+        self.__min_offset = min(m for _, m in slots)
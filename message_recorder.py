@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import gzip
+import queue
+import threading
+import traceback
+from time import time, gmtime, strftime
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#===============================================================================
+# 受信メッセージ記録クラス
+#===============================================================================
+# 受信したフレームを受信時刻と合わせて圧縮ファイルに追記する.
+# 受信スレッドはキューに積むだけで, 圧縮/書き込みは記録スレッドで行う.
+# (キューが上限に達した場合は記録せずに dropped に数える)
+#
+# ファイル
+#   prefix_YYYYmmdd_HHMMSS.rec.gz (.rec.zst)  セグメント (segment_seconds毎に切り替え, 時刻はUTC)
+#   prefix_YYYYmmdd_HHMMSS.rec.gz.idx         索引 (1行 = 分の開始時刻[sec] + タブ + ファイル位置)
+#
+# セグメントは1分毎に独立したgzip member (zstd frame) を追記した形式で,
+# 索引の位置からそのまま展開すれば指定した分の先頭から読める.
+# 展開後の1行は 受信時刻[sec] + タブ + 受信フレーム.
+#===============================================================================
+class MessageRecorder(object):
+
+    COMPRESSIONS = {'gzip': '.rec.gz', 'zstd': '.rec.zst'}
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     directory    保存先ディレクトリ
+    #     prefix       ファイル名の先頭
+    #     compression  'gzip', 'zstd' (zstdは要zstandard)
+    #     segment_seconds セグメントを切り替える秒数
+    #     queue_size   記録待ちのフレーム数の上限
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, directory:str, prefix:str='bybit', compression:str='gzip', segment_seconds:int=3600,
+                 queue_size:int=100000):
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f'Unknown compression: {compression}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires zstandard.')
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.segment_seconds = segment_seconds
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.recorded = 0
+        self.dropped = 0
+        self.__queue = queue.Queue(queue_size)
+        self.__file = None       # セグメントファイル
+        self.__index = None      # 索引ファイル
+        self.__segment_end = 0   # セグメントの終了時刻 [sec]
+        self.__member = None     # 書き込み中のgzip member (zstd frame)
+        self.__minute = None     # 書き込み中のmemberの分 [sec]
+
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    #---------------------------------------------------------------------------
+    # フレームの記録 (受信スレッドから呼び出す. ブロックしない)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     frame        受信したフレーム (str/bytes)
+    #     timestamp    受信時刻 [sec] (Noneはtime())
+    # [return]
+    #---------------------------------------------------------------------------
+    def record(self, frame, timestamp:float=None):
+        try:
+            self.__queue.put_nowait((time() if timestamp is None else timestamp, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    #---------------------------------------------------------------------------
+    # 終了 (記録待ちのフレームを書き込んでからファイルを閉じる)
+    #---------------------------------------------------------------------------
+    def close(self, timeout:float=10.0):
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+
+    #---------------------------------------------------------------------------
+    # 統計
+    #---------------------------------------------------------------------------
+    def stats(self):
+        return {'recorded': self.recorded, 'dropped': self.dropped, 'queue_size': self.__queue.qsize()}
+
+    #---------------------------------------------------------------------------
+    # 記録スレッド
+    #---------------------------------------------------------------------------
+    def __run(self):
+        get = self.__queue.get
+        get_nowait = self.__queue.get_nowait
+        closing = False
+        while not closing:
+            try:
+                items = [get(timeout=1.0)]
+            except queue.Empty:
+                # 受信がなくても分が変わればmemberを閉じてファイルに書き出す
+                if self.__minute is not None and time() >= self.__minute + 60:
+                    self.__end_member()
+                continue
+            # 溜まっている分はまとめて書き込む
+            try:
+                while len(items) < 10000:
+                    items.append(get_nowait())
+            except queue.Empty:
+                pass
+            if None in items:
+                closing = True
+                items = items[:items.index(None)]
+            try:
+                self.__write(items)
+            except Exception:
+                print(traceback.format_exc())
+        self.__end_member()
+        self.__close_segment()
+
+    def __write(self, items:list):
+        lines = []
+        for timestamp, frame in items:
+            minute = int(timestamp) - int(timestamp) % 60
+            if minute != self.__minute:
+                if lines:
+                    self.__member.write(b''.join(lines))
+                    lines = []
+                self.__end_member()
+                if timestamp >= self.__segment_end or self.__file is None:
+                    self.__open_segment(timestamp)
+                self.__begin_member(minute)
+            if isinstance(frame, str):
+                frame = frame.encode('utf-8')
+            elif isinstance(frame, memoryview):
+                frame = frame.tobytes()
+            lines.append(b'%.6f\t%s\n' % (timestamp, frame))
+        if lines:
+            self.__member.write(b''.join(lines))
+        self.recorded += len(items)
+
+    def __open_segment(self, timestamp:float):
+        self.__close_segment()
+        start = int(timestamp) - int(timestamp) % self.segment_seconds
+        name = f'{self.prefix}_{strftime("%Y%m%d_%H%M%S", gmtime(start))}{self.COMPRESSIONS[self.compression]}'
+        path = os.path.join(self.directory, name)
+        self.__file = open(path, 'ab')
+        self.__index = open(path + '.idx', 'a')
+        self.__segment_end = start + self.segment_seconds
+
+    def __close_segment(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__index.close()
+            self.__file = self.__index = None
+
+    def __begin_member(self, minute:int):
+        self.__index.write(f'{minute}\t{self.__file.tell()}\n')
+        self.__index.flush()
+        if self.compression == 'zstd':
+            self.__member = zstandard.ZstdCompressor().stream_writer(self.__file, closefd=False)
+        else:
+            self.__member = gzip.GzipFile(fileobj=self.__file, mode='wb', compresslevel=6)
+        self.__minute = minute
+
+    def __end_member(self):
+        if self.__member is not None:
+            self.__member.close()
+            self.__file.flush()
+            self.__member = None
+            self.__minute = None
+
+
+#===============================================================================
+# 記録したメッセージの読み込みクラス
+#===============================================================================
+class MessageReader(object):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     directory    MessageRecorderの保存先ディレクトリ
+    #     prefix       ファイル名の先頭
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, directory:str, prefix:str='bybit'):
+        self.directory = directory
+        self.prefix = prefix
+
+    #---------------------------------------------------------------------------
+    # セグメントファイルのリスト (古い順)
+    #---------------------------------------------------------------------------
+    def segments(self):
+        exts = tuple(MessageRecorder.COMPRESSIONS.values())
+        names = [n for n in os.listdir(self.directory) if n.startswith(self.prefix + '_') and n.endswith(exts)]
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    #---------------------------------------------------------------------------
+    # 期間指定で読み込み
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     start        期間の始め [sec] (Noneは最初から) 索引でこの時刻の分の先頭から読む
+    #     end          期間の終わり [sec] (Noneは最後まで)
+    # [return]
+    #     (受信時刻[sec], 受信フレーム(str)) のiterator (記録順)
+    #---------------------------------------------------------------------------
+    def read(self, start:float=None, end:float=None):
+        for path in self.segments():
+            index = self.read_index(path)
+            if not index:
+                continue
+            if end is not None and index[0][0] >= end:
+                break
+            offset = 0
+            if start is not None:
+                # start以前の最後の分から読む (セグメント全体がstartより前なら最後の分)
+                before = [o for m, o in index if m <= start]
+                offset = before[-1] if before else 0
+            for ts, frame in self.__read_segment(path, offset):
+                if start is not None and ts < start:
+                    continue
+                if end is not None and ts >= end:
+                    return
+                yield ts, frame
+
+    #---------------------------------------------------------------------------
+    # 索引の読み込み
+    #---------------------------------------------------------------------------
+    # [return]
+    #     [(分の開始時刻[sec], ファイル位置), ...]
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def read_index(path:str):
+        index = []
+        if os.path.exists(path + '.idx'):
+            with open(path + '.idx') as f:
+                for line in f:
+                    cols = line.split('\t')
+                    if len(cols) == 2:
+                        index.append((int(cols[0]), int(cols[1])))
+        return index
+
+    def __read_segment(self, path:str, offset:int):
+        with open(path, 'rb') as raw:
+            raw.seek(offset)
+            if path.endswith(MessageRecorder.COMPRESSIONS['zstd']):
+                if zstandard is None:
+                    raise ImportError('zstd compression requires zstandard.')
+                stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+            else:
+                stream = gzip.GzipFile(fileobj=raw, mode='rb')
+            try:
+                for line in stream:
+                    ts, _, frame = line.rstrip(b'\n').partition(b'\t')
+                    yield float(ts), frame.decode('utf-8')
+            except EOFError:
+                # 書き込み中のmemberは読める所まで
+                pass
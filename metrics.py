@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#===============================================================================
+# 計測値の管理クラス
+#===============================================================================
+# counter(累計)とhistogram(分布)を名前+labelで管理し, snapshot(dict)または
+# Prometheusのtext形式で取り出す.
+# 値の更新はロックを取らない (受信スレッドから呼ぶ前提. 取り出し側は多少ずれてもよい).
+#
+# 取り出す時に値を集める collector も登録できる (キューの長さ, 再接続回数など).
+#   collector() -> [(名前, 'counter' or 'gauge', {label: 値}, 値), ...]
+#===============================================================================
+class Metrics(object):
+
+    # histogramの区切り [sec] (1us〜10sec)
+    BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+               0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     prefix       計測値の名前の先頭
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, prefix:str='bybit_'):
+        self.prefix = prefix
+        self.__counters = {}     # (名前, labels) -> Counter
+        self.__histograms = {}   # (名前, labels) -> Histogram
+        self.__collectors = []
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    #---------------------------------------------------------------------------
+    # counter/histogramの取得 (なければ生成. 受信処理では取得したものを使い回す)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     name         名前 (prefixは付けない)
+    #     **labels     label ('topic'など)
+    # [return]
+    #     Counter / Histogram
+    #---------------------------------------------------------------------------
+    def counter(self, name:str, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        c = self.__counters.get(key)
+        if c is None:
+            with self.__lock:
+                c = self.__counters.setdefault(key, Counter())
+        return c
+
+    def histogram(self, name:str, buckets:tuple=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        h = self.__histograms.get(key)
+        if h is None:
+            with self.__lock:
+                h = self.__histograms.setdefault(key, Histogram(buckets or self.BUCKETS))
+        return h
+
+    #---------------------------------------------------------------------------
+    # 取り出す時に値を集める関数の登録
+    #---------------------------------------------------------------------------
+    def add_collector(self, collector):
+        with self.__lock:
+            self.__collectors.append(collector)
+
+    #---------------------------------------------------------------------------
+    # 全計測値の取得
+    #---------------------------------------------------------------------------
+    # [return]
+    #     {'counters': {名前: [{'labels': {...}, 'value': 値}, ...]},
+    #      'gauges': {名前: [...]},
+    #      'histograms': {名前: [{'labels': {...}, 'count', 'sum', 'p50', 'p99', 'max', 'buckets'}, ...]}}
+    #---------------------------------------------------------------------------
+    def snapshot(self):
+        result = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for (name, labels), c in list(self.__counters.items()):
+            result['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': c.value})
+        for name, kind, labels, value in self.__collect():
+            result['counters' if kind == 'counter' else 'gauges'].setdefault(name, []).append(
+                {'labels': labels, 'value': value})
+        for (name, labels), h in list(self.__histograms.items()):
+            d = h.to_dict()
+            d['labels'] = dict(labels)
+            result['histograms'].setdefault(name, []).append(d)
+        return result
+
+    #---------------------------------------------------------------------------
+    # Prometheusのtext形式
+    #---------------------------------------------------------------------------
+    def prometheus(self):
+        lines = []
+        snap = self.snapshot()
+        for kind in ('counters', 'gauges'):
+            for name, values in sorted(snap[kind].items()):
+                full = self.prefix + name
+                lines.append(f'# TYPE {full} {kind[:-1]}')
+                for v in values:
+                    lines.append(f'{full}{self.__labels(v["labels"])} {v["value"]}')
+        for name, values in sorted(snap['histograms'].items()):
+            full = self.prefix + name
+            lines.append(f'# TYPE {full} histogram')
+            for v in values:
+                cumulative = 0
+                for bound, n in v['buckets']:
+                    cumulative += n
+                    le = '+Inf' if bound is None else repr(bound)
+                    lines.append(f'{full}_bucket{self.__labels(dict(v["labels"], le=le))} {cumulative}')
+                lines.append(f'{full}_sum{self.__labels(v["labels"])} {v["sum"]}')
+                lines.append(f'{full}_count{self.__labels(v["labels"])} {v["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    #---------------------------------------------------------------------------
+    # HTTPでの公開 (GET /metrics でPrometheusのtext形式, GET /metrics.json でsnapshot)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     port         待ち受けるポート
+    #     host         待ち受けるアドレス
+    # [return]
+    #---------------------------------------------------------------------------
+    def start_http_server(self, port:int, host:str='127.0.0.1'):
+        if self.__server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body, ctype = metrics.prometheus(), 'text/plain; version=0.0.4'
+                elif path == '/metrics.json':
+                    body, ctype = json.dumps(metrics.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        th = threading.Thread(target=self.__server.serve_forever)
+        th.daemon = True
+        th.start()
+
+    def stop_http_server(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def __collect(self):
+        values = []
+        for collector in list(self.__collectors):
+            try:
+                values.extend(collector())
+            except Exception:
+                continue
+        return values
+
+    @staticmethod
+    def __labels(labels:dict):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+#===============================================================================
+# counter (累計値)
+#===============================================================================
+class Counter(object):
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+#===============================================================================
+# histogram (区切り毎の件数 + 合計 + 最大)
+#===============================================================================
+class Histogram(object):
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds:tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最後は区切りを超えた分
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v:float):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.count += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+
+    #---------------------------------------------------------------------------
+    # 分位点 (区切りの上端で近似)
+    #---------------------------------------------------------------------------
+    def quantile(self, q:float):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        n = 0
+        for i, c in enumerate(self.counts):
+            n += c
+            if n >= rank and c > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.50),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': list(zip(list(self.bounds) + [None], list(self.counts))),
+        }
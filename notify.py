@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import atexit
 import logging
 import logging.handlers
+import queue
 import requests
+import threading
 import traceback
+from time import time, sleep
 
 #===============================================================================
 # 通知管理クラス
@@ -12,33 +16,48 @@ class Notify(object):
 
     DISCORD_URL = ''
     __loggers = {}
+    __notifier = None
+    __notifier_lock = threading.Lock()
 
     #---------------------------------------------------------------------------
-    # Discord送信
+    # Discord送信 (送信スレッドのキューに積んで戻る. 送信を待たない)
     #---------------------------------------------------------------------------
     # [@param]
     #     message      送信するメッセージ
     #     fileName     送信するファイルパス
+    #     wait         True:送信が終わるまで待機
     # [return]
+    #     wait=False : True:キューに積んだ, False:送信しない/キューが一杯
+    #     wait=True  : このメッセージを送信したPOSTのrequests.Response (従来と同じ. 送信できなかった場合はNone)
+    #                  False:送信しない/キューが一杯
     #---------------------------------------------------------------------------
     @classmethod
-    def discord_notify(cls, message:str='', fileName:str=None):
+    def discord_notify(cls, message:str='', fileName:str=None, wait:bool=False):
         if len(cls.DISCORD_URL) > 0:
-            discord_webhook_url = cls.DISCORD_URL
-            data = {'content': ' ' + message + ' '}
-            if fileName == None:
-                try:
-                    return requests.post(discord_webhook_url, data=data)
-                except Exception:
-                    print(traceback.format_exc())
-            else:
-                try:
-                    files = {'imageFile': open(fileName, 'rb')}
-                    return requests.post(discord_webhook_url, data=data, files=files)
-                except Exception:
-                    print(traceback.format_exc())
+            notifier = cls.get_discord_notifier()
+            if wait:
+                return notifier.post(message, fileName)
+            return notifier.send(message, fileName)
         return False
 
+    #---------------------------------------------------------------------------
+    # Discord送信スレッド取得 (DISCORD_URLが変わった場合は作り直す)
+    #---------------------------------------------------------------------------
+    # [return]
+    #     DiscordNotifier
+    #---------------------------------------------------------------------------
+    @classmethod
+    def get_discord_notifier(cls):
+        with cls.__notifier_lock:
+            notifier = cls.__notifier
+            if notifier is None or notifier.url != cls.DISCORD_URL:
+                if notifier is not None:
+                    notifier.close()
+                notifier = cls.__notifier = DiscordNotifier(cls.DISCORD_URL)
+                # 終了時に未送信分を送る
+                atexit.register(notifier.close)
+            return notifier
+
     #---------------------------------------------------------------------------
     # logger取得
     #---------------------------------------------------------------------------
@@ -91,3 +110,381 @@ class Notify(object):
 
         cls.__loggers[name] = logger
         return logger
+
+
+#===============================================================================
+# Discord送信クラス
+#===============================================================================
+# 送信スレッドでWebhookにPOSTする. 呼び出し側はキューに積むだけで待たない.
+#   - 接続はrequests.Sessionで使い回す
+#   - 溜まったメッセージは改行で連結し, 2000文字(Discordの上限)まで1回のPOSTにまとめる
+#     (2000文字を超えるメッセージは行単位で分割. ```で囲んだメッセージは分割後も囲む)
+#   - rate秒間にburst回までのtoken bucketで送信間隔を制御し,
+#     429の場合はRetry-After(またはX-RateLimit-Reset-After)の秒数だけ待って再送する
+#   - ファイル付きのメッセージはまとめずに1件ずつ送信する
+#===============================================================================
+class DiscordNotifier(object):
+
+    MAX_LENGTH = 2000   # 1回のPOSTのcontentの上限文字数
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     url          Webhook URL
+    #     burst        token bucketの容量 (連続で送信できる回数)
+    #     rate         tokenが1つ回復する秒数
+    #     batch_delay  最初のメッセージを受け取ってからまとめるために待つ秒数
+    #     queue_size   未送信メッセージの上限 (超えた分は捨てる)
+    #     retries      429以外の失敗(接続エラー, 5xx)の再送回数
+    #     timeout      POSTのタイムアウト秒数
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, url:str, burst:int=5, rate:float=0.4, batch_delay:float=0.5, queue_size:int=1000,
+                 retries:int=3, timeout:float=10.0):
+        self.url = url
+        self.batch_delay = batch_delay
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.bucket = TokenBucket(burst, rate)
+        # 統計
+        self.posted = 0         # POST成功回数
+        self.sent = 0           # 送信したメッセージ数
+        self.dropped = 0        # キューが一杯で捨てたメッセージ数
+        self.rate_limited = 0   # 429を受けた回数
+        self.failed = 0         # 再送しても失敗したPOST数
+
+        self.__queue = queue.Queue(queue_size)
+        self.__done = threading.Condition()   # 送信スレッドがキューの処理を終える毎に通知
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, name='discord-notify')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    #---------------------------------------------------------------------------
+    # メッセージ送信 (キューに積んで戻る)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     message      送信するメッセージ
+    #     fileName     添付するファイルパス (読み込みは送信スレッドで行う)
+    # [return]
+    #     True:キューに積んだ, False:キューが一杯/終了済み
+    #---------------------------------------------------------------------------
+    def send(self, message:str='', fileName:str=None):
+        if not message and fileName is None:
+            return not self.__closed
+        return self.__put(message, fileName, None)
+
+    #---------------------------------------------------------------------------
+    # メッセージ送信 (送信完了まで待機)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     message      送信するメッセージ
+    #     fileName     添付するファイルパス
+    #     timeout      待機する最大秒数 (Noneは無制限)
+    # [return]
+    #     このメッセージを送信したPOSTのrequests.Response (失敗/タイムアウトはNone)
+    #     False:キューが一杯/終了済み
+    #---------------------------------------------------------------------------
+    def post(self, message:str='', fileName:str=None, timeout:float=None):
+        if not message and fileName is None:
+            return None
+        result = _PostResult()
+        if not self.__put(message, fileName, result):
+            return False
+        result.event.wait(timeout)
+        return result.response
+
+    def __put(self, message:str, fileName:str, result):
+        if self.__closed:
+            return False
+        try:
+            self.__queue.put_nowait((message, fileName, result))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    #---------------------------------------------------------------------------
+    # 未送信メッセージの送信完了まで待機
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeout      待機する最大秒数 (Noneは無制限)
+    # [return]
+    #     True:送信完了, False:タイムアウト
+    #---------------------------------------------------------------------------
+    def flush(self, timeout:float=None):
+        with self.__done:
+            return self.__done.wait_for(lambda: self.__queue.unfinished_tasks == 0 or not self.__thread.is_alive(),
+                                        timeout) and self.__queue.unfinished_tasks == 0
+
+    #---------------------------------------------------------------------------
+    # 終了処理 (未送信分を送ってから送信スレッドを止める)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timeout      待機する最大秒数
+    # [return]
+    #---------------------------------------------------------------------------
+    def close(self, timeout:float=10.0):
+        if self.__closed:
+            return
+        self.__closed = True
+        try:
+            self.__queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.__thread.join(timeout)
+        self.session.close()
+
+    #---------------------------------------------------------------------------
+    # 統計
+    #---------------------------------------------------------------------------
+    # [return]
+    #     {'queue_size', 'posted', 'sent', 'dropped', 'rate_limited', 'failed'}
+    #---------------------------------------------------------------------------
+    def stats(self):
+        return {
+            'queue_size': self.__queue.qsize(),
+            'posted': self.posted,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+        }
+
+    #---------------------------------------------------------------------------
+    # 送信スレッド
+    #---------------------------------------------------------------------------
+    def __run(self):
+        while True:
+            items = [self.__queue.get()]
+            # batch_delay秒の間に来た分もまとめる
+            if items[0] is not None:
+                deadline = time() + self.batch_delay
+                while True:
+                    try:
+                        item = self.__queue.get(timeout=max(0.0, deadline - time()))
+                    except queue.Empty:
+                        break
+                    items.append(item)
+                    if item is None:
+                        break
+            stop = items[-1] is None
+            messages = [m for m in items if m is not None]
+            try:
+                for content, fileName, results in self.__batches(messages):
+                    ok, res = self.__post(content, fileName)
+                    if ok:
+                        self.sent += len(results)
+                    for r in results:
+                        if r is not None:
+                            r.response = res
+                            r.event.set()
+            except Exception:
+                print(traceback.format_exc())
+            with self.__done:
+                for _ in items:
+                    self.__queue.task_done()
+                self.__done.notify_all()
+            # 送信できずに残った待機を解除
+            for m in messages:
+                if m[2] is not None:
+                    m[2].event.set()
+            if stop:
+                return
+
+    #---------------------------------------------------------------------------
+    # メッセージをPOST単位にまとめる
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     messages     [(メッセージ, ファイルパス, 送信結果), ...]
+    # [return]
+    #     [(content, ファイルパス, [送信結果, ...]), ...] (メッセージの最後のchunkを含むPOSTに送信結果を付ける)
+    #---------------------------------------------------------------------------
+    def __batches(self, messages:list):
+        batches = []
+        content, results = '', []
+        for message, fileName, result in messages:
+            chunks = self.split(message)
+            if fileName is not None:
+                # ファイルは最後のchunkに付けて単独で送信
+                if content:
+                    batches.append((content, None, results))
+                    content, results = '', []
+                chunks = chunks or ['']
+                for c in chunks[:-1]:
+                    batches.append((c, None, []))
+                batches.append((chunks[-1], fileName, [result]))
+                continue
+            for i, c in enumerate(chunks):
+                if content and len(content) + 1 + len(c) <= self.MAX_LENGTH:
+                    content += '\n' + c
+                else:
+                    if content:
+                        batches.append((content, None, results))
+                        results = []
+                    content = c
+                if i == len(chunks) - 1:
+                    results.append(result)
+        if content:
+            batches.append((content, None, results))
+        return batches
+
+    #---------------------------------------------------------------------------
+    # MAX_LENGTH以下に分割 (行単位, 1行が長い場合は文字数で分割)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     message      メッセージ
+    # [return]
+    #     分割したメッセージリスト
+    #---------------------------------------------------------------------------
+    @classmethod
+    def split(cls, message:str):
+        if len(message) <= cls.MAX_LENGTH:
+            return [message] if message else []
+        fence = ''
+        if message.startswith('```') and message.endswith('```') and len(message) >= 6:
+            # コードブロックは分割後のそれぞれを囲み直す
+            fence = '```'
+            message = message[3:-3]
+        limit = cls.MAX_LENGTH - len(fence) * 2
+        chunks = []
+        chunk = ''
+        for line in message.splitlines(True):
+            while len(line) > limit:
+                if chunk:
+                    chunks.append(chunk)
+                    chunk = ''
+                chunks.append(line[:limit])
+                line = line[limit:]
+            if len(chunk) + len(line) > limit:
+                chunks.append(chunk)
+                chunk = ''
+            chunk += line
+        if chunk:
+            chunks.append(chunk)
+        return [fence + c + fence for c in chunks]
+
+    #---------------------------------------------------------------------------
+    # POST (429はRetry-After秒待って再送, 接続エラー/5xxはretries回まで再送)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     content      送信するcontent
+    #     fileName     添付するファイルパス
+    # [return]
+    #     (True:成功 False:失敗, 最後のrequests.Response (接続エラーの場合はNone))
+    #---------------------------------------------------------------------------
+    def __post(self, content:str, fileName:str=None):
+        failures = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                data = {'content': content}
+                if fileName is None:
+                    res = self.session.post(self.url, data=data, timeout=self.timeout)
+                else:
+                    with open(fileName, 'rb') as f:
+                        files = {'file': (os.path.basename(fileName), f)}
+                        res = self.session.post(self.url, data=data, files=files, timeout=self.timeout)
+            except requests.RequestException as e:
+                res = None
+                error = str(e)
+            except OSError as e:
+                # ファイルが読めない場合は再送しない
+                print(f'Discord notify failed : {e}')
+                self.failed += 1
+                return False, None
+
+            if res is not None:
+                # 残り回数が0ならリセットまで待つ
+                if res.headers.get('X-RateLimit-Remaining') == '0':
+                    self.bucket.pause(self.__seconds(res.headers.get('X-RateLimit-Reset-After')))
+                if res.status_code == 429:
+                    self.rate_limited += 1
+                    self.bucket.pause(self.__retry_after(res))
+                    continue
+                if res.status_code < 400:
+                    self.posted += 1
+                    return True, res
+                error = f'{res.status_code} {res.text[:200]}'
+                if res.status_code < 500:
+                    # 4xxは再送しても同じ
+                    failures = self.retries
+
+            failures += 1
+            if failures > self.retries:
+                print(f'Discord notify failed : {error}')
+                self.failed += 1
+                return False, res
+            sleep(min(30.0, 2 ** (failures - 1)))
+
+    # 429の待機秒数 (Retry-Afterヘッダ, なければJSONのretry_after)
+    def __retry_after(self, res):
+        seconds = self.__seconds(res.headers.get('Retry-After'))
+        if seconds == 0.0:
+            try:
+                seconds = self.__seconds(res.json().get('retry_after'))
+            except ValueError:
+                seconds = 1.0
+        return seconds or 1.0
+
+    @staticmethod
+    def __seconds(value):
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return 0.0
+
+
+#===============================================================================
+# 待機中のメッセージの送信結果 (DiscordNotifier内部用)
+#===============================================================================
+class _PostResult(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+
+
+#===============================================================================
+# token bucket (capacity回まで連続で取得でき, rate秒毎に1つ回復する)
+#===============================================================================
+class TokenBucket(object):
+
+    def __init__(self, capacity:int, rate:float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time()
+        self.paused_until = 0.0
+        self.__lock = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    # tokenを1つ取得 (なければ回復するまで待機)
+    #---------------------------------------------------------------------------
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = time()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) * self.rate
+            sleep(wait)
+
+    #---------------------------------------------------------------------------
+    # seconds秒の間は取得させない (429のRetry-Afterなど)
+    #---------------------------------------------------------------------------
+    def pause(self, seconds:float):
+        with self.__lock:
+            now = time()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # 待機後はburstせずに1つずつ
+            self.tokens = 0.0
+            self.updated = self.paused_until
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+#===============================================================================
+# OHLCV格納クラス (NumPy)
+#===============================================================================
+# 確定した足を列 (start, open, high, low, close, volume) の配列に格納する.
+# 配列は容量の2倍を確保して末尾に追加し, 使い切ったら直近の足だけを新しい配列に移す.
+# 常に連続した領域になるため, to_numpy()はコピーせずにviewを返す.
+# (移した後も以前に返したviewは元の配列を参照するので値は変わらない)
+#
+# 指標(EMA, ATRなど)を登録すると足を追加する毎にO(1)で更新し, 列として保持する.
+# 旧形式(dequeの[start, open, high, low, close, volume])と同じく len/反復/index参照ができる.
+#===============================================================================
+class OHLCVStore(object):
+
+    COLUMNS = ['start', 'open', 'high', 'low', 'close', 'volume']
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     capacity     保持する足の数
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, capacity:int=1000):
+        if np is None:
+            raise ImportError('OHLCVStore requires numpy.')
+        self.capacity = capacity
+        self.__indicators = {}   # 指標名 -> 指標インスタンス
+        self.__columns = list(self.COLUMNS)
+        # (配列, 開始位置, 終了位置) を1つの参照で差し替えて公開する
+        self.__state = (np.full((capacity * 2, len(self.__columns)), np.nan), 0, 0)
+
+    #---------------------------------------------------------------------------
+    # 指標の登録
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     name         列名 ('ema20'など)
+    #     indicator    update(bar)で値を返すインスタンス (EMA, ATR, RSIなど)
+    #                  barは {'start', 'open', 'high', 'low', 'close', 'volume'} のdict
+    # [return]
+    #---------------------------------------------------------------------------
+    def add_indicator(self, name:str, indicator):
+        if name in self.__columns:
+            raise ValueError(f'Column already exists: {name}')
+        data, begin, end = self.__state
+        # 登録済みの足で値を計算してから列を追加
+        values = np.full((len(data), 1), np.nan)
+        for i in range(begin, end):
+            values[i, 0] = self.__value(indicator.update(self.__bar_dict(data[i])))
+        self.__indicators[name] = indicator
+        self.__columns.append(name)
+        self.__state = (np.hstack((data, values)), begin, end)
+
+    #---------------------------------------------------------------------------
+    # 足の追加
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     bar          [start, open, high, low, close, volume]
+    # [return]
+    #---------------------------------------------------------------------------
+    def append(self, bar:list):
+        data, begin, end = self.__state
+        if end >= len(data):
+            # 直近 capacity-1 本を新しい配列に移す
+            keep = data[end - self.capacity + 1:end]
+            data = np.full(data.shape, np.nan)
+            data[:len(keep)] = keep
+            begin, end = 0, len(keep)
+        row = data[end]
+        row[:6] = bar[:6]
+        if self.__indicators:
+            d = self.__bar_dict(row)
+            for j, indicator in enumerate(self.__indicators.values()):
+                row[6 + j] = self.__value(indicator.update(d))
+        end += 1
+        if end - begin > self.capacity:
+            begin += 1
+        self.__state = (data, begin, end)
+
+    #---------------------------------------------------------------------------
+    # 配列取得 (コピーなしのview)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     column       列名 (Noneは全列の shape=(n, 列数) 配列)
+    # [return]
+    #     書き込み不可のndarray view (古い順)
+    #---------------------------------------------------------------------------
+    def to_numpy(self, column:str=None):
+        data, begin, end = self.__state
+        if column is None:
+            view = data[begin:end]
+        else:
+            view = data[begin:end, self.__columns.index(column)]
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    #---------------------------------------------------------------------------
+    # DataFrame取得 (index: 足の開始時刻 UTC)
+    #---------------------------------------------------------------------------
+    def to_pandas(self):
+        if pd is None:
+            raise ImportError('to_pandas requires pandas.')
+        data, begin, end = self.__state
+        df = pd.DataFrame(data[begin:end], columns=self.__columns, copy=True)
+        df.index = pd.DatetimeIndex(pd.to_datetime(df['start'], unit='s', utc=True), name='time')
+        return df
+
+    #---------------------------------------------------------------------------
+    # 列名のリスト
+    #---------------------------------------------------------------------------
+    def columns(self):
+        return list(self.__columns)
+
+    #---------------------------------------------------------------------------
+    # 旧形式 (dequeの[start, open, high, low, close, volume]) での参照用
+    #---------------------------------------------------------------------------
+    @property
+    def maxlen(self):
+        return self.capacity
+
+    def __len__(self):
+        _, begin, end = self.__state
+        return end - begin
+
+    def __getitem__(self, i:int):
+        data, begin, end = self.__state
+        n = end - begin
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('OHLCVStore index out of range')
+        return self.__bar_list(data[begin + i])
+
+    def __iter__(self):
+        data, begin, end = self.__state
+        for i in range(begin, end):
+            yield self.__bar_list(data[i])
+
+    @staticmethod
+    def __bar_list(row):
+        return [int(row[0]), float(row[1]), float(row[2]), float(row[3]), float(row[4]), float(row[5])]
+
+    @staticmethod
+    def __bar_dict(row):
+        return {'start': int(row[0]), 'open': float(row[1]), 'high': float(row[2]), 'low': float(row[3]),
+                'close': float(row[4]), 'volume': float(row[5])}
+
+    @staticmethod
+    def __value(v):
+        return np.nan if v is None else v
+
+
+#===============================================================================
+# 指数移動平均
+#===============================================================================
+class EMA(object):
+
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     period       期間
+    #     source       計算に使う列 ('close'など)
+    #---------------------------------------------------------------------------
+    def __init__(self, period:int, source:str='close'):
+        self.period = period
+        self.source = source
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+        self.__count = 0
+        self.__sum = 0.0
+
+    def update(self, bar:dict):
+        x = bar[self.source]
+        if self.value is None:
+            # 最初のperiod本は単純平均で初期化
+            self.__count += 1
+            self.__sum += x
+            if self.__count < self.period:
+                return None
+            self.value = self.__sum / self.period
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+#===============================================================================
+# ATR (Wilderの平滑化)
+#===============================================================================
+class ATR(object):
+
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     period       期間
+    #---------------------------------------------------------------------------
+    def __init__(self, period:int=14):
+        self.period = period
+        self.value = None
+        self.__prev_close = None
+        self.__count = 0
+        self.__sum = 0.0
+
+    def update(self, bar:dict):
+        high, low = bar['high'], bar['low']
+        if self.__prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high, self.__prev_close) - min(low, self.__prev_close)
+        self.__prev_close = bar['close']
+        if self.value is None:
+            self.__count += 1
+            self.__sum += tr
+            if self.__count < self.period:
+                return None
+            self.value = self.__sum / self.period
+        else:
+            self.value += (tr - self.value) / self.period
+        return self.value
+
+
+#===============================================================================
+# RSI (Wilderの平滑化)
+#===============================================================================
+class RSI(object):
+
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     period       期間
+    #     source       計算に使う列 ('close'など)
+    #---------------------------------------------------------------------------
+    def __init__(self, period:int=14, source:str='close'):
+        self.period = period
+        self.source = source
+        self.value = None
+        self.__prev = None
+        self.__count = 0
+        self.__gain = 0.0
+        self.__loss = 0.0
+
+    def update(self, bar:dict):
+        x = bar[self.source]
+        prev, self.__prev = self.__prev, x
+        if prev is None:
+            return None
+        gain = max(x - prev, 0.0)
+        loss = max(prev - x, 0.0)
+        if self.__count < self.period:
+            self.__count += 1
+            self.__gain += gain / self.period
+            self.__loss += loss / self.period
+            if self.__count < self.period:
+                return None
+        else:
+            self.__gain += (gain - self.__gain) / self.period
+            self.__loss += (loss - self.__loss) / self.period
+        if self.__loss == 0:
+            self.value = 100.0
+        else:
+            self.value = 100.0 - 100.0 / (1.0 + self.__gain / self.__loss)
+        return self.value
+
+
+#-------------------------------------------------------------------------------
+# OHLCV格納先の生成 (numpyがなければ従来のdeque)
+#-------------------------------------------------------------------------------
+def new_ohlcv_store(capacity:int=1000):
+    if np is None:
+        return deque(maxlen=capacity)
+    return OHLCVStore(capacity)
@@ -0,0 +1,658 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import namedtuple
+from sortedcontainers import SortedDict
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#===============================================================================
+# orderbook整合性エラー
+#===============================================================================
+# reason
+#   'out_of_order'  : cross_seqが前回以下のdelta (適用せずに捨てる)
+#   'missing_level' : 存在しない価格のdelete/update (差分の取りこぼし)
+#   'crossed'       : 最良買気配 >= 最良売気配
+#   'off_grid'      : 呼値の整数倍でない価格 (TickOrderBookのtick_sizeの誤り. 適用せずに捨てる)
+#===============================================================================
+class OrderBookError(Exception):
+
+    def __init__(self, reason:str, message:str):
+        super().__init__(message)
+        self.reason = reason
+
+#===============================================================================
+# 公開済みの板 (読み取り専用)
+#===============================================================================
+# 公開後は変更されないため, 他スレッドからロックなし/コピーなしで参照できる.
+#   version  : 板のversion (更新される毎に増える)
+#   seq      : 最後に適用したcross_seq
+#   bids     : 買板 (価格の高い順), asks: 売板 (価格の安い順)
+#   best_bid / best_ask : 最良気配 (price, size) 板が空の場合はNone
+#
+# BookTopは更新毎に公開する最良気配のみの板 (全板を作らないため更新毎のコストが板の数に依らない)
+#===============================================================================
+BookSnapshot = namedtuple('BookSnapshot', ['version', 'seq', 'bids', 'asks', 'best_bid', 'best_ask'])
+BookTop = namedtuple('BookTop', ['version', 'seq', 'best_bid', 'best_ask'])
+
+#===============================================================================
+# orderbook管理クラス
+#===============================================================================
+# 差分(delete/insert/update)をその場で適用し, 整合性を確認してから
+# 最良気配(BookTop)を参照の差し替えで公開する.
+# 全板のBookSnapshotはversion毎に最初に参照された時に1回だけ作り, 次の更新まで使い回す.
+# (各versionの最初の参照だけは板のlockを取って全板をコピーする(O(板数)). 作成済みのsnapshot/最良気配の参照はロックなし)
+# 上位n板の参照(head)は全板が未作成ならversion毎に最初の参照時にlock内で上位n板のみをコピーする(O(n)).
+# 取得系の関数(get_bids, best_bidなど)は公開済みの板を参照する.
+#===============================================================================
+class OrderBook(object):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.__bids = SortedDict() # price -> (price, size)
+        self.__asks = SortedDict() # price -> (price, size)
+        self.version = 0           # 板が更新される毎にインクリメント
+        self.seq = None            # 最後に適用したcross_seq
+        self.top = BookTop(0, None, None, None)                   # 公開済みの最良気配
+        self.__snapshot = BookSnapshot(0, None, (), (), None, None) # 作成済みの全板
+        self.__head = (0, self.__snapshot)                        # 作成済みの上位板 (depth, BookSnapshot)
+        self.__lock = threading.Lock() # 板の更新と全板の作成の排他
+
+    #---------------------------------------------------------------------------
+    # snapshot適用
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     data         snapshotのdataリスト
+    #     seq          messageのcross_seq (Noneは順序を検証しない)
+    # [return]
+    #---------------------------------------------------------------------------
+    def apply_snapshot(self, data:list, seq:int=None):
+        with self.__lock:
+            self.__bids.clear()
+            self.__asks.clear()
+            for d in data:
+                price = float(d['price'])
+                if d['side'] == 'Buy':
+                    self.__bids[price] = (price, float(d['size']))
+                elif d['side'] == 'Sell':
+                    self.__asks[price] = (price, float(d['size']))
+            self.seq = seq
+            self._applied(seq, 0)
+
+    #---------------------------------------------------------------------------
+    # delta適用
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     data         deltaのdata (delete/update/insert)
+    #     seq          messageのcross_seq (Noneは順序を検証しない)
+    # [return]
+    #     OrderBookError  順序が前回以前 (適用しない) / 存在しない価格のdelete/update (適用後)
+    #---------------------------------------------------------------------------
+    def apply_delta(self, data:dict, seq:int=None):
+        self._check_seq(seq)
+        missing = 0
+        with self.__lock:
+            if data.get('delete'):
+                for d in data['delete']:
+                    book = self.__bids if d['side'] == 'Buy' else self.__asks
+                    if book.pop(float(d['price']), None) is None:
+                        missing += 1
+
+            for key in ('insert', 'update'):
+                if data.get(key):
+                    for d in data[key]:
+                        price = float(d['price'])
+                        book = self.__bids if d['side'] == 'Buy' else self.__asks
+                        if key == 'update' and price not in book:
+                            missing += 1
+                        book[price] = (price, float(d['size']))
+
+            self._applied(seq, missing)
+
+    #---------------------------------------------------------------------------
+    # 最良買気配 (price, size) / 板が空の場合はNone
+    #---------------------------------------------------------------------------
+    def best_bid(self):
+        return self.top.best_bid
+
+    #---------------------------------------------------------------------------
+    # 最良売気配 (price, size) / 板が空の場合はNone
+    #---------------------------------------------------------------------------
+    def best_ask(self):
+        return self.top.best_ask
+
+    #---------------------------------------------------------------------------
+    # 板が交差しているか (最良買気配 >= 最良売気配)
+    #---------------------------------------------------------------------------
+    def is_crossed(self):
+        if len(self.__bids) == 0 or len(self.__asks) == 0:
+            return False
+        return self.__bids.peekitem(-1)[0] >= self.__asks.peekitem(0)[0]
+
+    #---------------------------------------------------------------------------
+    # 最良気配を公開 (参照の差し替えのみで公開する. 全板はsnapshotの参照時に作る)
+    #---------------------------------------------------------------------------
+    def publish(self):
+        bids, asks = self.__bids, self.__asks
+        self.top = BookTop(self.version, self.seq,
+                           bids.peekitem(-1)[1] if bids else None, asks.peekitem(0)[1] if asks else None)
+
+    #---------------------------------------------------------------------------
+    # 公開済みの全板 (BookSnapshot)
+    #---------------------------------------------------------------------------
+    # 公開済みのversionで未作成なら作る (versionが変わるまで同じものを返す).
+    # 公開後に不整合で破棄される板 (公開済みのversionと板が異なる) の間は前回作成したものを返す.
+    #---------------------------------------------------------------------------
+    @property
+    def snapshot(self):
+        snap = self.__snapshot
+        top = self.top
+        if snap.version == top.version:
+            return snap
+        with self.__lock:
+            snap = self.__snapshot
+            top = self.top
+            if snap.version != top.version and self.version == top.version:
+                snap = self.__snapshot = BookSnapshot(top.version, top.seq, tuple(self.__bids.values()[::-1]),
+                                                      tuple(self.__asks.values()), top.best_bid, top.best_ask)
+            return snap
+
+    #---------------------------------------------------------------------------
+    # 公開済みの上位depth板 (BookSnapshot)
+    #---------------------------------------------------------------------------
+    # 全板が作成済みならそのsliceを返し, 未作成なら上位depth板のみをコピーする. (全板は作らない)
+    #---------------------------------------------------------------------------
+    def head(self, depth:int):
+        snap = self.__snapshot
+        top = self.top
+        if snap.version != top.version:
+            # 同じversionで作成済みの上位板 (depth以上) があれば使い回す
+            n, head = self.__head
+            if head.version == top.version and n >= depth:
+                if n == depth:
+                    return head
+                snap = head
+            else:
+                with self.__lock:
+                    snap = self.__snapshot
+                    top = self.top
+                    if snap.version != top.version and self.version == top.version:
+                        values = self.__bids.values()
+                        snap = BookSnapshot(top.version, top.seq, tuple(values[max(len(values) - depth, 0):][::-1]),
+                                            tuple(self.__asks.values()[:depth]), top.best_bid, top.best_ask)
+                        self.__head = (depth, snap)
+                        return snap
+        return snap._replace(bids=snap.bids[:depth], asks=snap.asks[:depth])
+
+    #---------------------------------------------------------------------------
+    # cross_seqの順序検証 / 適用後の後処理
+    #---------------------------------------------------------------------------
+    def _check_seq(self, seq:int):
+        if seq is not None and self.seq is not None and seq <= self.seq:
+            raise OrderBookError('out_of_order', f'Out of order delta. seq:{seq} last:{self.seq}')
+
+    def _applied(self, seq:int, missing:int):
+        if seq is not None:
+            self.seq = seq
+        self.version += 1
+        # 不整合な板は公開しない
+        if missing > 0:
+            raise OrderBookError('missing_level', f'Missing {missing} levels in delta. seq:{seq}')
+        if self.is_crossed():
+            raise OrderBookError('crossed', f'Crossed book. seq:{seq}')
+        self.publish()
+
+    #---------------------------------------------------------------------------
+    # 買板取得 (価格の高い順)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     depth        取得する板数 (Noneは全板)
+    # [return]
+    #     ((price, size), ...) 公開済みの板 (変更されないtuple)
+    #---------------------------------------------------------------------------
+    def get_bids(self, depth:int=None):
+        return self.snapshot.bids if depth is None else self.head(depth).bids
+
+    #---------------------------------------------------------------------------
+    # 売板取得 (価格の安い順)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     depth        取得する板数 (Noneは全板)
+    # [return]
+    #     ((price, size), ...) 公開済みの板 (変更されないtuple)
+    #---------------------------------------------------------------------------
+    def get_asks(self, depth:int=None):
+        return self.snapshot.asks if depth is None else self.head(depth).asks
+
+    #---------------------------------------------------------------------------
+    # 上位n板の合計数量
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     side         'bids' or 'asks'
+    #     depth        集計する板数 (Noneは全板)
+    # [return]
+    #     合計数量
+    #---------------------------------------------------------------------------
+    def depth(self, side:str, depth:int=None):
+        return sum(s for _, s in self.__side(side, depth))
+
+    #---------------------------------------------------------------------------
+    # 上位n板の累積数量
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     side         'bids' or 'asks'
+    #     depth        集計する板数 (Noneは全板)
+    # [return]
+    #     [累積数量, ...]
+    #---------------------------------------------------------------------------
+    def cumulative_size(self, side:str, depth:int=None):
+        ret = []
+        total = 0.0
+        for _, s in self.__side(side, depth):
+            total += s
+            ret.append(total)
+        return ret
+
+    #---------------------------------------------------------------------------
+    # 指定数量を板から約定させた場合の平均価格
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     side         'bids' or 'asks'
+    #     size         約定させる数量
+    # [return]
+    #     (平均価格, 約定可能数量)  板が空の場合は(None, 0.0)
+    #---------------------------------------------------------------------------
+    def vwap(self, side:str, size:float):
+        filled = 0.0
+        cost = 0.0
+        for p, s in self[side]:
+            q = min(s, size - filled)
+            filled += q
+            cost += p * q
+            if filled >= size:
+                break
+        if filled <= 0:
+            return (None, 0.0)
+        return (cost / filled, filled)
+
+    #---------------------------------------------------------------------------
+    # 旧形式 board_snapshot['bids'] / ['asks'] での参照用
+    #---------------------------------------------------------------------------
+    def __getitem__(self, side:str):
+        if side == 'bids':
+            return self.get_bids()
+        elif side == 'asks':
+            return self.get_asks()
+        raise KeyError(side)
+
+    def __len__(self):
+        return len(self.__bids) + len(self.__asks)
+
+    def __side(self, side:str, depth:int):
+        if side == 'bids':
+            return self.get_bids(depth)
+        elif side == 'asks':
+            return self.get_asks(depth)
+        raise KeyError(side)
+
+
+#===============================================================================
+# 固定tick orderbook管理クラス (NumPy)
+#===============================================================================
+# 価格をtick index(整数)に変換し, 板を連続したndarrayで保持する.
+# 各サイドは最良気配から順に並んだ (price, size) の2列配列で,
+# OrderBookと同じく更新毎に公開するのは最良気配(BookTop)のみ.
+# 全板の書き込み不可のコピー(BookSnapshot)はversion毎に最初に参照された時に1回だけ作り,
+# get_bids/get_asksは作成済みの配列(またはそのview)をコピーせずに返す.
+# 上位n板の参照(head)は全板が未作成ならversion毎に最初の参照時にlock内で上位n板のみをコピーする(O(n)).
+# 呼値の整数倍でない価格は別の価格と同じtick indexになり板を上書きするため, 適用せずにエラーにする.
+#===============================================================================
+class TickOrderBook(object):
+
+    EPS = 1e-6  # 呼値の整数倍とみなす誤差 [tick]
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     tick_size    呼値 (BTCUSD:0.5)
+    #     capacity     片側あたりの初期確保板数 (超えた場合は拡張)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, tick_size:float, capacity:int=512):
+        if np is None:
+            raise ImportError('TickOrderBook requires numpy.')
+        if capacity < 1:
+            raise ValueError(f'capacity must be >= 1: {capacity}')
+        self.tick_size = float(tick_size)
+        self.version = 0
+        self.seq = None
+        self.top = BookTop(0, None, None, None)   # 公開済みの最良気配
+        empty = np.empty((0, 2))
+        empty.flags.writeable = False
+        self.__snapshot = BookSnapshot(0, None, empty, empty, None, None) # 作成済みの全板
+        self.__head = (0, self.__snapshot)                                 # 作成済みの上位板 (depth, BookSnapshot)
+        self.__lock = threading.Lock() # 板の更新と全板の作成の排他
+        # key: 最良気配から昇順になるtick index (bidsは符号反転)
+        # levels: [[price, size], ...]
+        self.__keys = {'bids': np.empty(capacity, dtype=np.int64),
+                       'asks': np.empty(capacity, dtype=np.int64)}
+        self.__levels = {'bids': np.empty((capacity, 2), dtype=np.float64),
+                         'asks': np.empty((capacity, 2), dtype=np.float64)}
+        self.__count = {'bids': 0, 'asks': 0}
+
+    #---------------------------------------------------------------------------
+    # snapshot適用
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     data         snapshotのdataリスト
+    #     seq          messageのcross_seq (Noneは順序を検証しない)
+    #     OrderBookError  呼値の整数倍でない価格 (適用しない)
+    #---------------------------------------------------------------------------
+    def apply_snapshot(self, data:list, seq:int=None):
+        # 全ての価格を検証してから板を書き換える
+        sides = {}
+        for side in ('bids', 'asks'):
+            rows = [(float(d['price']), float(d['size'])) for d in data
+                    if (d['side'] == 'Buy') == (side == 'bids')]
+            if len(rows) == 0:
+                sides[side] = (None, None)
+                continue
+            levels = np.array(rows, dtype=np.float64)
+            ticks = levels[:, 0] / self.tick_size
+            keys = np.rint(ticks)
+            off = np.abs(ticks - keys) > self.EPS
+            if off.any():
+                raise OrderBookError('off_grid', f'Price {levels[off][0, 0]} is not a multiple of tick_size {self.tick_size}.')
+            keys = keys.astype(np.int64)
+            if side == 'bids':
+                keys = -keys
+            order = np.argsort(keys, kind='stable')
+            sides[side] = (keys[order], levels[order])
+
+        with self.__lock:
+            for side, (keys, levels) in sides.items():
+                n = 0 if keys is None else len(keys)
+                self.__reserve(side, n)
+                if n > 0:
+                    self.__keys[side][:n] = keys
+                    self.__levels[side][:n] = levels
+                self.__count[side] = n
+            self.seq = seq
+            self._applied(seq, 0)
+
+    #---------------------------------------------------------------------------
+    # delta適用
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     data         deltaのdata (delete/update/insert)
+    #     seq          messageのcross_seq (Noneは順序を検証しない)
+    # [return]
+    #     OrderBookError  順序が前回以前/呼値の整数倍でない価格 (適用しない) / 存在しない価格のdelete/update (適用後)
+    #---------------------------------------------------------------------------
+    def apply_delta(self, data:dict, seq:int=None):
+        self._check_seq(seq)
+        # 全ての価格を検証してから板を書き換える
+        deletes = []
+        sets = []
+        if data.get('delete'):
+            for d in data['delete']:
+                side = 'bids' if d['side'] == 'Buy' else 'asks'
+                deletes.append((side, self.__key(side, float(d['price']))))
+        for key in ('insert', 'update'):
+            if data.get(key):
+                for d in data[key]:
+                    side = 'bids' if d['side'] == 'Buy' else 'asks'
+                    price = float(d['price'])
+                    sets.append((key == 'update', side, self.__key(side, price), price, float(d['size'])))
+
+        missing = 0
+        with self.__lock:
+            for side, k in deletes:
+                if not self.__delete(side, k):
+                    missing += 1
+            for is_update, side, k, price, size in sets:
+                found = self.__set(side, k, price, size)
+                if is_update and not found:
+                    missing += 1
+
+            self._applied(seq, missing)
+
+    #---------------------------------------------------------------------------
+    # 最良買気配 (price, size) / 板が空の場合はNone
+    #---------------------------------------------------------------------------
+    def best_bid(self):
+        return self.top.best_bid
+
+    #---------------------------------------------------------------------------
+    # 最良売気配 (price, size) / 板が空の場合はNone
+    #---------------------------------------------------------------------------
+    def best_ask(self):
+        return self.top.best_ask
+
+    #---------------------------------------------------------------------------
+    # 板が交差しているか (最良買気配 >= 最良売気配)
+    #---------------------------------------------------------------------------
+    def is_crossed(self):
+        if self.__count['bids'] == 0 or self.__count['asks'] == 0:
+            return False
+        return self.__levels['bids'][0, 0] >= self.__levels['asks'][0, 0]
+
+    #---------------------------------------------------------------------------
+    # 最良気配を公開 (参照の差し替えのみで公開する. 全板はsnapshotの参照時に作る)
+    #---------------------------------------------------------------------------
+    def publish(self):
+        best = {}
+        for side in ('bids', 'asks'):
+            levels = self.__levels[side]
+            best[side] = (float(levels[0, 0]), float(levels[0, 1])) if self.__count[side] > 0 else None
+        self.top = BookTop(self.version, self.seq, best['bids'], best['asks'])
+
+    #---------------------------------------------------------------------------
+    # 公開済みの全板 (BookSnapshot, bids/asksは書き込み不可のndarray)
+    #---------------------------------------------------------------------------
+    # 公開済みのversionで未作成なら作る (versionが変わるまで同じものを返す).
+    # 公開後に不整合で破棄される板 (公開済みのversionと板が異なる) の間は前回作成したものを返す.
+    #---------------------------------------------------------------------------
+    @property
+    def snapshot(self):
+        snap = self.__snapshot
+        top = self.top
+        if snap.version == top.version:
+            return snap
+        with self.__lock:
+            snap = self.__snapshot
+            top = self.top
+            if snap.version != top.version and self.version == top.version:
+                snap = self.__snapshot = BookSnapshot(top.version, top.seq, self.__copy('bids', None),
+                                                      self.__copy('asks', None), top.best_bid, top.best_ask)
+            return snap
+
+    #---------------------------------------------------------------------------
+    # 公開済みの上位depth板 (BookSnapshot)
+    #---------------------------------------------------------------------------
+    # 全板が作成済みならそのviewを返し, 未作成なら上位depth板のみをコピーする. (全板は作らない)
+    #---------------------------------------------------------------------------
+    def head(self, depth:int):
+        snap = self.__snapshot
+        top = self.top
+        if snap.version != top.version:
+            # 同じversionで作成済みの上位板 (depth以上) があれば使い回す
+            n, head = self.__head
+            if head.version == top.version and n >= depth:
+                if n == depth:
+                    return head
+                snap = head
+            else:
+                with self.__lock:
+                    snap = self.__snapshot
+                    top = self.top
+                    if snap.version != top.version and self.version == top.version:
+                        snap = BookSnapshot(top.version, top.seq, self.__copy('bids', depth),
+                                            self.__copy('asks', depth), top.best_bid, top.best_ask)
+                        self.__head = (depth, snap)
+                        return snap
+        return snap._replace(bids=snap.bids[:depth], asks=snap.asks[:depth])
+
+    #---------------------------------------------------------------------------
+    # cross_seqの順序検証 / 適用後の後処理
+    #---------------------------------------------------------------------------
+    def _check_seq(self, seq:int):
+        if seq is not None and self.seq is not None and seq <= self.seq:
+            raise OrderBookError('out_of_order', f'Out of order delta. seq:{seq} last:{self.seq}')
+
+    def _applied(self, seq:int, missing:int):
+        if seq is not None:
+            self.seq = seq
+        self.version += 1
+        # 不整合な板は公開しない
+        if missing > 0:
+            raise OrderBookError('missing_level', f'Missing {missing} levels in delta. seq:{seq}')
+        if self.is_crossed():
+            raise OrderBookError('crossed', f'Crossed book. seq:{seq}')
+        self.publish()
+
+    #---------------------------------------------------------------------------
+    # 買板取得 (価格の高い順, shape=(n, 2)の書き込み不可ndarray)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     depth        取得する板数 (Noneは全板)
+    # [return]
+    #     ndarray [[price, size], ...]
+    #---------------------------------------------------------------------------
+    def get_bids(self, depth:int=None):
+        return self.__view('bids', depth)
+
+    #---------------------------------------------------------------------------
+    # 売板取得 (価格の安い順, shape=(n, 2)の書き込み不可ndarray)
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     depth        取得する板数 (Noneは全板)
+    # [return]
+    #     ndarray [[price, size], ...]
+    #---------------------------------------------------------------------------
+    def get_asks(self, depth:int=None):
+        return self.__view('asks', depth)
+
+    #---------------------------------------------------------------------------
+    # 上位n板の合計数量
+    #---------------------------------------------------------------------------
+    def depth(self, side:str, depth:int=None):
+        return float(self.__view(side, depth)[:, 1].sum())
+
+    #---------------------------------------------------------------------------
+    # 上位n板の累積数量 (ndarray)
+    #---------------------------------------------------------------------------
+    def cumulative_size(self, side:str, depth:int=None):
+        return np.cumsum(self.__view(side, depth)[:, 1])
+
+    #---------------------------------------------------------------------------
+    # 指定数量を板から約定させた場合の平均価格
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     side         'bids' or 'asks'
+    #     size         約定させる数量
+    # [return]
+    #     (平均価格, 約定可能数量)  板が空の場合は(None, 0.0)
+    #---------------------------------------------------------------------------
+    def vwap(self, side:str, size:float):
+        levels = self.__view(side, None)
+        if len(levels) == 0 or size <= 0:
+            return (None, 0.0)
+        prices = levels[:, 0]
+        sizes = levels[:, 1]
+        cum = np.cumsum(sizes)
+        # 指定数量に達する板のindex (全板で足りない場合は最終板)
+        i = min(int(np.searchsorted(cum, size)), len(cum) - 1)
+        filled = min(float(size), float(cum[i]))
+        prev = float(cum[i - 1]) if i > 0 else 0.0
+        cost = float(np.dot(prices[:i], sizes[:i])) + float(prices[i]) * (filled - prev)
+        return (cost / filled, filled)
+
+    #---------------------------------------------------------------------------
+    # 旧形式 board_snapshot['bids'] / ['asks'] での参照用
+    #---------------------------------------------------------------------------
+    def __getitem__(self, side:str):
+        if side == 'bids' or side == 'asks':
+            return self.__view(side, None)
+        raise KeyError(side)
+
+    def __len__(self):
+        return self.__count['bids'] + self.__count['asks']
+
+    #---------------------------------------------------------------------------
+    # 価格 -> tick index (bidsは符号反転)
+    #---------------------------------------------------------------------------
+    def __key(self, side:str, price:float):
+        ticks = price / self.tick_size
+        key = int(round(ticks))
+        if abs(ticks - key) > self.EPS:
+            raise OrderBookError('off_grid', f'Price {price} is not a multiple of tick_size {self.tick_size}.')
+        return -key if side == 'bids' else key
+
+    #---------------------------------------------------------------------------
+    # keyの挿入位置 (見つかったかどうか)
+    #---------------------------------------------------------------------------
+    def __find(self, side:str, key:int):
+        n = self.__count[side]
+        keys = self.__keys[side]
+        i = int(np.searchsorted(keys[:n], key))
+        return i, (i < n and keys[i] == key)
+
+    def __set(self, side:str, key:int, price:float, size:float):
+        i, found = self.__find(side, key)
+        if not found:
+            n = self.__count[side]
+            self.__reserve(side, n + 1)
+            keys = self.__keys[side]
+            levels = self.__levels[side]
+            if i < n:
+                keys[i + 1:n + 1] = keys[i:n]
+                levels[i + 1:n + 1] = levels[i:n]
+            keys[i] = key
+            levels[i, 0] = price
+            self.__count[side] = n + 1
+        self.__levels[side][i, 1] = size
+        return found
+
+    def __delete(self, side:str, key:int):
+        i, found = self.__find(side, key)
+        if found:
+            n = self.__count[side]
+            keys = self.__keys[side]
+            levels = self.__levels[side]
+            keys[i:n - 1] = keys[i + 1:n]
+            levels[i:n - 1] = levels[i + 1:n]
+            self.__count[side] = n - 1
+        return found
+
+    #---------------------------------------------------------------------------
+    # 容量拡張
+    #---------------------------------------------------------------------------
+    def __reserve(self, side:str, n:int):
+        capacity = len(self.__keys[side])
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        count = self.__count[side]
+        keys = np.empty(capacity, dtype=np.int64)
+        levels = np.empty((capacity, 2), dtype=np.float64)
+        keys[:count] = self.__keys[side][:count]
+        levels[:count] = self.__levels[side][:count]
+        self.__keys[side] = keys
+        self.__levels[side] = levels
+
+    # 上位depth板の書き込み不可のコピー (lock内で呼ぶ)
+    def __copy(self, side:str, depth:int):
+        n = self.__count[side]
+        a = self.__levels[side][:n if depth is None else min(depth, n)].copy()
+        a.flags.writeable = False
+        return a
+
+    def __view(self, side:str, depth:int):
+        snap = self.snapshot if depth is None else self.head(depth)
+        return snap.bids if side == 'bids' else snap.asks
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+#===============================================================================
+# 受信データのrecordクラス
+#===============================================================================
+# 受信したdictを受信時に1回だけ変換して, __slots__のインスタンスに格納する.
+# 数値の項目は変換済み (文字列で届く price, exec_fee なども float) なので
+# コールバック側で float()/int() し直す必要はない.
+# 旧形式の参照用に record['price'], record.get('price') でも値を取得できる.
+#===============================================================================
+
+#-------------------------------------------------------------------------------
+# 項目の変換関数 (未設定/空文字はNone)
+#-------------------------------------------------------------------------------
+def _float(v):
+    return None if v is None or v == '' else float(v)
+
+def _int(v):
+    return None if v is None or v == '' else int(v)
+
+def _str(v):
+    return v
+
+def _bool(v):
+    return None if v is None else bool(v)
+
+
+#===============================================================================
+# recordの基底クラス
+#===============================================================================
+# 派生クラスは FIELDS = (('項目名', 変換関数), ...) を定義する.
+# __slots__ は FIELDS から生成する.
+#===============================================================================
+class Record(object):
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._names = tuple(name for name, _ in cls.FIELDS)
+        # slotのdescriptorに直接書き込む (setattrより速い)
+        cls._setters = tuple((cls.__dict__[name].__set__, name, conv) for name, conv in cls.FIELDS)
+
+    #---------------------------------------------------------------------------
+    # 受信dictから生成
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     d            受信データのdict
+    # [return]
+    #     recordインスタンス
+    #---------------------------------------------------------------------------
+    @classmethod
+    def from_dict(cls, d:dict):
+        self = cls.__new__(cls)
+        get = d.get
+        for set_, name, conv in cls._setters:
+            set_(self, conv(get(name)))
+        return self
+
+    #---------------------------------------------------------------------------
+    # dictに変換 (変換済みの値)
+    #---------------------------------------------------------------------------
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self._names}
+
+    #---------------------------------------------------------------------------
+    # 旧形式 data['price'] / data.get('price') での参照用
+    #---------------------------------------------------------------------------
+    def __getitem__(self, key:str):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key:str, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self._names
+
+    def __contains__(self, key:str):
+        return key in self._names
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + ', '.join(f'{n}={getattr(self, n)!r}' for n in self._names) + ')'
+
+
+#===============================================================================
+# [topic] trade
+#===============================================================================
+class Trade(Record):
+    FIELDS = (
+        ('symbol', _str),
+        ('side', _str),
+        ('price', _float),
+        ('size', _int),
+        ('trade_time_ms', _int),
+        ('timestamp', _str),
+        ('tick_direction', _str),
+        ('trade_id', _str),
+        ('cross_seq', _int),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+#===============================================================================
+# [topic] execution
+#===============================================================================
+class Execution(Record):
+    FIELDS = (
+        ('symbol', _str),
+        ('side', _str),
+        ('order_id', _str),
+        ('exec_id', _str),
+        ('order_link_id', _str),
+        ('price', _float),
+        ('order_qty', _int),
+        ('exec_type', _str),
+        ('exec_qty', _int),
+        ('exec_fee', _float),
+        ('leaves_qty', _int),
+        ('is_maker', _bool),
+        ('trade_time', _str),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+#===============================================================================
+# [topic] order
+#===============================================================================
+class Order(Record):
+    FIELDS = (
+        ('order_id', _str),
+        ('order_link_id', _str),
+        ('symbol', _str),
+        ('side', _str),
+        ('order_type', _str),
+        ('price', _float),
+        ('qty', _int),
+        ('time_in_force', _str),
+        ('create_type', _str),
+        ('cancel_type', _str),
+        ('order_status', _str),
+        ('leaves_qty', _int),
+        ('cum_exec_qty', _int),
+        ('cum_exec_value', _float),
+        ('cum_exec_fee', _float),
+        ('timestamp', _str),
+        ('take_profit', _float),
+        ('stop_loss', _float),
+        ('trailing_stop', _float),
+        ('last_exec_price', _float),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+#===============================================================================
+# [topic] position
+#===============================================================================
+class Position(Record):
+    FIELDS = (
+        ('symbol', _str),
+        ('side', _str),
+        ('size', _int),
+        ('position_value', _float),
+        ('entry_price', _float),
+        ('liq_price', _float),
+        ('bust_price', _float),
+        ('leverage', _float),
+        ('order_margin', _float),
+        ('position_margin', _float),
+        ('available_balance', _float),
+        ('take_profit', _float),
+        ('stop_loss', _float),
+        ('realised_pnl', _float),
+        ('trailing_stop', _float),
+        ('wallet_balance', _float),
+        ('occ_closing_fee', _float),
+        ('occ_funding_fee', _float),
+        ('cum_realised_pnl', _float),
+        ('position_status', _str),
+        ('position_seq', _int),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import socket
+import threading
+from time import time, sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Benchmark'))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# 条件が満たされるまで待機 (満たされなければFalse)
+def wait_until(cond, timeout:float=10.0, interval:float=0.05):
+    deadline = time() + timeout
+    while time() < deadline:
+        if cond():
+            return True
+        sleep(interval)
+    return cond()
+
+
+#===============================================================================
+# REST APIのスタブ (handler(method, path, query, body) -> (status, headers, dict))
+#===============================================================================
+class StubHTTPServer(object):
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.__handle('GET')
+
+            def do_POST(self):
+                self.__handle('POST')
+
+            def __handle(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length > 0 else b''
+                path, _, query = self.path.partition('?')
+                stub.requests.append((method, path, query, body))
+                status, headers, data = stub.handler(method, path, query, body)
+                payload = b'' if data is None else json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http_stub():
+    servers = []
+    def start(handler):
+        s = StubHTTPServer(handler)
+        servers.append(s)
+        return s
+    yield start
+    for s in servers:
+        s.close()
+
+
+@pytest.fixture
+def mock_server():
+    from mock_server import MockBybitServer
+    server = MockBybitServer(port=free_port(), scale=5, seed=1).start()
+    yield server
+    server.stop()
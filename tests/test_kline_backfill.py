@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import json
+from time import time
+from urllib.parse import parse_qs
+
+from conftest import wait_until
+from bybit_ws_base import BybitWSBase
+from kline_backfill import KlineBackfill
+
+NOW = 1600000050           # 現在時刻 (1分足の途中)
+BOUNDARY = NOW - NOW % 60  # 生成中の足の開始時刻
+
+
+def bar(start:int):
+    price = 10000.0 + (start // 60) % 100
+    return [start, price, price + 1.0, price - 1.0, price + 0.5, start % 1000]
+
+
+# /v2/public/kline/list のスタブ (fromから1分足をlimit本)
+def kline_handler(drop=None):
+    def handler(method, path, query, body):
+        assert path == '/v2/public/kline/list'
+        q = {k: v[0] for k, v in parse_qs(query).items()}
+        start = int(q['from'])
+        start += -start % 60
+        rows = [bar(start + i * 60) for i in range(int(q['limit']))]
+        if drop is not None:
+            rows = drop(start, rows)
+        result = [{'symbol': q['symbol'], 'interval': q['interval'], 'open_time': b[0], 'open': str(b[1]),
+                   'high': str(b[2]), 'low': str(b[3]), 'close': str(b[4]), 'volume': str(b[5])} for b in rows]
+        return 200, {'Content-Type': 'application/json'}, {'ret_code': 0, 'ret_msg': 'OK', 'result': result}
+    return handler
+
+
+def assert_continuous(bars, seconds=60):
+    assert all(b[0] + seconds == n[0] for b, n in zip(bars, bars[1:]))
+
+
+def test_load_pages_and_cache(http_stub, tmp_path):
+    stub = http_stub(kline_handler())
+    backfill = KlineBackfill(stub.url, cache_dir=str(tmp_path))
+    bars = backfill.load('BTCUSD', '1', 450, now=NOW)
+    assert len(bars) == 450
+    assert_continuous(bars)
+    assert bars[-1][0] == BOUNDARY - 60   # 生成中の足は含めない
+    assert bars[-1] == bar(bars[-1][0])
+    assert len(stub.requests) == 3
+
+    # 2回目はキャッシュの最後の足以降だけを取得
+    stub.requests.clear()
+    bars = backfill.load('BTCUSD', '1', 450, now=NOW + 180)
+    assert len(bars) == 450
+    assert_continuous(bars)
+    assert bars[-1][0] == BOUNDARY + 120
+    assert len(stub.requests) == 1
+    assert backfill.read_cache('BTCUSD', '1') == bars
+
+
+def test_fetch_retries_incomplete_page(http_stub):
+    seen = set()
+    def drop(start, rows):
+        # 各ページの初回は最後の10本が抜ける
+        if start in seen:
+            return rows
+        seen.add(start)
+        return rows[:-10]
+    stub = http_stub(kline_handler(drop))
+    backfill = KlineBackfill(stub.url)
+    start = BOUNDARY - 400 * 60
+    bars = backfill.fetch('BTCUSD', '1', start, BOUNDARY)
+    assert len(bars) == 400
+    assert_continuous(bars)
+    assert len(stub.requests) == 4
+
+
+#===============================================================================
+# 受信処理 (_emitを記録)
+#===============================================================================
+class Client(BybitWSBase):
+
+    def __init__(self, **kwargs):
+        super().__init__('', '', channel=['klineV2.1.BTCUSD'], **kwargs)
+        self.emitted = []
+
+    def _emit(self, topic:str, symbol:str, data):
+        self.emitted.append((topic, symbol, data))
+
+
+def kline_frame(start:int):
+    b = bar(start)
+    return json.dumps({'topic': 'klineV2.1.BTCUSD', 'data': [{
+        'start': b[0], 'end': b[0] + 60, 'open': b[1], 'high': b[2], 'low': b[3], 'close': b[4],
+        'volume': str(b[5]), 'turnover': 0.0, 'confirm': False, 'cross_seq': 1, 'timestamp': b[0] * 1000000}],
+        'timestamp_e6': b[0] * 1000000})
+
+
+def test_backfill_and_gap_fill(http_stub, tmp_path):
+    stub = http_stub(kline_handler())
+    ws = Client(rest_endpoint=stub.url, backfill=5, backfill_cache=str(tmp_path))
+    ws._prepare()
+    ohlcv = ws.store['BTCUSD']['ohlcv']
+    assert len(ohlcv) == 5
+    last = ohlcv[-1][0]
+    assert last + 60 <= time()
+
+    # 過去足と重複する足は捨て, 切断で抜けた3本はREST APIで埋める
+    ws._on_message(kline_frame(last))
+    ws._on_message(kline_frame(last + 240))
+    ws._on_message(kline_frame(last + 300))
+    assert wait_until(lambda: len(ohlcv) == 9)
+    bars = list(ohlcv)
+    assert_continuous(bars)
+    assert bars[-1] == bar(last + 240)
+    assert [d[0] for t, s, d in ws.emitted] == [last + 60, last + 120, last + 180, last + 240]
+
+    # 確定した足はキャッシュにも追記される
+    assert wait_until(lambda: KlineBackfill(stub.url, cache_dir=str(tmp_path)).read_cache('BTCUSD', '1')[-1][0] == last + 240)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from time import perf_counter
+from urllib.parse import parse_qs
+
+from notify import DiscordNotifier
+
+
+def contents(stub):
+    return [parse_qs(body.decode('utf-8'))['content'][0] for method, path, query, body in stub.requests]
+
+
+def test_retry_after_429(http_stub):
+    responses = [(429, {'Retry-After': '0.5'}, {'message': 'You are being rate limited.', 'retry_after': 0.5}),
+                 (204, {}, None)]
+    stub = http_stub(lambda method, path, query, body: responses.pop(0) if len(responses) > 1 else responses[0])
+    notifier = DiscordNotifier(stub.url, batch_delay=0.0)
+    try:
+        t0 = perf_counter()
+        res = notifier.post('hello', timeout=10.0)
+        elapsed = perf_counter() - t0
+        assert res is not None and res.status_code == 204
+        assert elapsed >= 0.5
+        assert notifier.rate_limited == 1
+        assert notifier.stats()['posted'] == 1
+        assert contents(stub) == ['hello', 'hello']
+    finally:
+        notifier.close()
+
+
+def test_batches_messages(http_stub):
+    stub = http_stub(lambda method, path, query, body: (204, {}, None))
+    notifier = DiscordNotifier(stub.url, batch_delay=0.2)
+    try:
+        messages = [f'{i:04d} ' + 'x' * 95 for i in range(50)]
+        for m in messages:
+            assert notifier.send(m)
+        assert notifier.flush(timeout=10.0)
+        posted = contents(stub)
+        # 2000文字まで改行で連結して送信
+        assert len(posted) < len(messages)
+        assert all(len(c) <= DiscordNotifier.MAX_LENGTH for c in posted)
+        assert '\n'.join(posted).split('\n') == messages
+        assert notifier.stats()['sent'] == len(messages)
+    finally:
+        notifier.close()
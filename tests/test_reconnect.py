@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from conftest import wait_until
+from bybit_ws import BybitWS
+from bybit_ws_async import AsyncBybitWS
+
+BOOK_TOPIC = 'orderBook_200.100ms.BTCUSD'
+
+
+def new_client(server, **kwargs):
+    return BybitWS('API_KEY', 'API_SECRET', endpoint=server.url, resync_orders=False,
+                   backoff=(0.1, 0.5), timeout=10.0, **kwargs)
+
+
+def test_reconnect_and_resubscribe_after_disconnect(mock_server):
+    ws = new_client(mock_server)
+    try:
+        subscribed = mock_server.stats['subscribe']
+        mock_server.kick()
+        assert wait_until(lambda: ws.reconnect_count >= 1 and ws.ready.is_set())
+        assert mock_server.stats['connections'] >= 2
+        assert mock_server.stats['subscribe'] > subscribed
+        # 再購読のsnapshotで板が復元される
+        assert wait_until(lambda: ws.get_best_quote()['bid'] is not None)
+        assert ws.get_orderbook_stats('BTCUSD')['snapshot'] >= 2
+    finally:
+        ws.close()
+
+
+def test_missing_level_resubscribes(mock_server):
+    ws = new_client(mock_server)
+    try:
+        assert wait_until(lambda: ws.get_best_quote()['bid'] is not None)
+        # 存在しない価格のupdate (差分の取りこぼし)
+        mock_server.broadcast({'topic': BOOK_TOPIC, 'type': 'delta', 'cross_seq': 10 ** 15, 'timestamp_e6': 0,
+                               'data': {'delete': [], 'update': [{'price': '1.5', 'side': 'Buy', 'size': 1}],
+                                        'insert': []}})
+        assert wait_until(lambda: ws.get_orderbook_stats('BTCUSD')['missing_level'] == 1)
+        stats = ws.get_orderbook_stats('BTCUSD')
+        assert stats['resubscribe'] == 1
+        # 再購読のsnapshotで板が復元される
+        assert wait_until(lambda: ws.get_orderbook_stats('BTCUSD')['snapshot'] >= 2
+                          and ws.get_best_quote()['bid'] is not None)
+        assert ws.reconnect_count == 0
+    finally:
+        ws.close()
+
+
+def test_async_client_reconnects(mock_server):
+    async def run():
+        ws = AsyncBybitWS('API_KEY', 'API_SECRET', endpoint=mock_server.url, backoff=(0.1, 0.5))
+        await ws.start(timeout=10)
+        try:
+            mock_server.kick()
+            for _ in range(200):
+                if ws.reconnect_count >= 1 and ws.is_ready():
+                    break
+                await asyncio.sleep(0.05)
+            assert ws.reconnect_count >= 1
+            assert ws.is_ready()
+        finally:
+            await ws.close()
+    asyncio.run(run())
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import threading
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#===============================================================================
+# 約定履歴リングバッファ (NumPy)
+#===============================================================================
+# 約定を項目別の配列 (timestamp[ms], price, size, side) に格納する.
+# 配列は最初に確保し, 容量を超えると古い約定から上書きする.
+# 期間指定の取り出しと出来高/VWAP/買い売りの偏りの集計はベクトル演算で行う.
+#   side : 1:Buy, -1:Sell
+#===============================================================================
+class TradeBuffer(object):
+
+    #---------------------------------------------------------------------------
+    # コンストラクタ
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     capacity     保持する約定数 (1約定あたり25byte)
+    # [return]
+    #---------------------------------------------------------------------------
+    def __init__(self, capacity:int=200000):
+        if np is None:
+            raise ImportError('TradeBuffer requires numpy.')
+        self.capacity = capacity
+        self.__timestamp = np.zeros(capacity, dtype=np.int64)
+        self.__price = np.zeros(capacity, dtype=np.float64)
+        self.__size = np.zeros(capacity, dtype=np.float64)
+        self.__side = np.zeros(capacity, dtype=np.int8)
+        self.__count = 0   # これまでに追加した約定数 (次の書き込み位置 = count % capacity)
+        self.__lock = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    # 約定追加
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     timestamp    約定時刻 [ms]
+    #     price        約定価格
+    #     size         約定数量
+    #     side         'Buy' or 'Sell'
+    # [return]
+    #---------------------------------------------------------------------------
+    def append(self, timestamp:int, price:float, size:float, side:str):
+        with self.__lock:
+            i = self.__count % self.capacity
+            self.__timestamp[i] = timestamp
+            self.__price[i] = price
+            self.__size[i] = size
+            self.__side[i] = 1 if side == 'Buy' else -1
+            self.__count += 1
+
+    def __len__(self):
+        return min(self.__count, self.capacity)
+
+    #---------------------------------------------------------------------------
+    # 最新の約定時刻 [ms] (約定がない場合はNone)
+    #---------------------------------------------------------------------------
+    def last_timestamp(self):
+        with self.__lock:
+            if self.__count == 0:
+                return None
+            return int(self.__timestamp[(self.__count - 1) % self.capacity])
+
+    #---------------------------------------------------------------------------
+    # 期間指定で約定を取り出す
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     seconds      最新の約定(またはuntil)から遡る秒数 (Noneは保持している全約定)
+    #     until        期間の終わり [ms] (Noneは最新の約定時刻)
+    # [return]
+    #     {'timestamp': ndarray, 'price': ndarray, 'size': ndarray, 'side': ndarray}
+    #     古い順のコピー
+    #---------------------------------------------------------------------------
+    def window(self, seconds:float=None, until:int=None):
+        with self.__lock:
+            return {k: v.copy() for k, v in self.__window(seconds, until).items()}
+
+    #---------------------------------------------------------------------------
+    # 直近n件の約定を取り出す (古い順のコピー)
+    #---------------------------------------------------------------------------
+    def last(self, n:int):
+        with self.__lock:
+            cols = self.__columns(max(0, min(self.__count, self.capacity) - n))
+            return {k: v.copy() for k, v in cols.items()}
+
+    #---------------------------------------------------------------------------
+    # 期間内の集計
+    #---------------------------------------------------------------------------
+    # [@param]
+    #     seconds      最新の約定(またはuntil)から遡る秒数 (Noneは保持している全約定)
+    #     until        期間の終わり [ms] (Noneは最新の約定時刻)
+    # [return]
+    #     {'count': 約定数, 'volume': 出来高, 'buy_volume': 買い出来高, 'sell_volume': 売り出来高,
+    #      'vwap': 出来高加重平均価格, 'imbalance': (買い - 売り) / 出来高 (-1.0〜1.0)}
+    #     約定がない場合 vwap/imbalance は None
+    #---------------------------------------------------------------------------
+    def stats(self, seconds:float=None, until:int=None):
+        with self.__lock:
+            w = self.__window(seconds, until)
+            size = w['size']
+            volume = float(size.sum())
+            buy = float(size[w['side'] > 0].sum())
+            vwap = float(np.dot(w['price'], size)) / volume if volume > 0 else None
+            count = len(size)
+        sell = volume - buy
+        return {
+            'count': count,
+            'volume': volume,
+            'buy_volume': buy,
+            'sell_volume': sell,
+            'vwap': vwap,
+            'imbalance': (buy - sell) / volume if volume > 0 else None,
+        }
+
+    #---------------------------------------------------------------------------
+    # 期間内の出来高
+    #---------------------------------------------------------------------------
+    def volume(self, seconds:float=None, until:int=None):
+        with self.__lock:
+            return float(self.__window(seconds, until)['size'].sum())
+
+    #---------------------------------------------------------------------------
+    # 期間内のVWAP (約定がない場合はNone)
+    #---------------------------------------------------------------------------
+    def vwap(self, seconds:float=None, until:int=None):
+        return self.stats(seconds, until)['vwap']
+
+    #---------------------------------------------------------------------------
+    # 期間内の買い売りの偏り (買い - 売り) / 出来高 (約定がない場合はNone)
+    #---------------------------------------------------------------------------
+    def imbalance(self, seconds:float=None, until:int=None):
+        return self.stats(seconds, until)['imbalance']
+
+    #---------------------------------------------------------------------------
+    # 期間内の約定 (ロック中に呼ぶこと)
+    #---------------------------------------------------------------------------
+    def __window(self, seconds:float, until:int):
+        n = min(self.__count, self.capacity)
+        if n == 0 or (seconds is None and until is None):
+            return self.__columns(0, n)
+        if until is None:
+            until = int(self.__timestamp[(self.__count - 1) % self.capacity])
+        end = self.__search(until)
+        start = 0
+        if seconds is not None:
+            start = self.__search(until - int(seconds * 1000))
+        return self.__columns(start, end)
+
+    #---------------------------------------------------------------------------
+    # timestampより後の最初の約定の位置 (古い順の通し番号)
+    #   古い側/新しい側の2区間それぞれで二分探索するので並べ替え不要
+    #---------------------------------------------------------------------------
+    def __search(self, timestamp:int):
+        old, new = self.__segments(self.__timestamp)
+        i = int(np.searchsorted(old, timestamp, side='right'))
+        if i < len(old):
+            return i
+        return len(old) + int(np.searchsorted(new, timestamp, side='right'))
+
+    #---------------------------------------------------------------------------
+    # 古い順にstart〜end番目の項目別の配列 (折り返しを跨がなければview)
+    #---------------------------------------------------------------------------
+    def __columns(self, start:int, end:int=None):
+        if end is None:
+            end = min(self.__count, self.capacity)
+        cols = {}
+        for k, a in (('timestamp', self.__timestamp), ('price', self.__price),
+                     ('size', self.__size), ('side', self.__side)):
+            old, new = self.__segments(a)
+            m = len(old)
+            if end <= m:
+                cols[k] = old[start:end]
+            elif start >= m:
+                cols[k] = new[start - m:end - m]
+            else:
+                cols[k] = np.concatenate((old[start:], new[:end - m]))
+        return cols
+
+    # 古い側/新しい側の区間 (折り返していなければ新しい側は空)
+    def __segments(self, a):
+        if self.__count <= self.capacity:
+            return a[:self.__count], a[:0]
+        head = self.__count % self.capacity
+        return a[head:], a[:head]